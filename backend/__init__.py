@@ -5,10 +5,21 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi_utils.tasks import repeat_every
 
-from backend.background import update_working_providers
+from backend.background import (
+    leader_lock,
+    restore_probe_snapshot,
+    run_due_probes,
+    shared_state,
+    sync_shared_state,
+)
+from backend.dependencies import add_catalog_examples, provider_and_models
+from backend.egress import egress_identity
 from backend.errors import add_exception_handlers
+from backend.pool import client_pool
 from backend.routes import add_routers
+from backend.sessions import session_store
 from backend.settings import TEMPLATES_PATH, settings
+from backend.startup import startup_timer
 
 app = FastAPI(
     title="G4F API",
@@ -23,11 +34,82 @@ app.mount("/static", StaticFiles(directory=TEMPLATES_PATH), name="static")
 logging.getLogger("uvicorn.error").setLevel(logging.WARNING)
 
 
+def openapi() -> dict:
+    if app.openapi_schema is None:
+        with startup_timer.phase("openapi"):
+            app.openapi_schema = add_catalog_examples(FastAPI.openapi(app))
+    return app.openapi_schema
+
+
+app.openapi = openapi
+
+
+@app.on_event("startup")
+def load_catalog() -> None:
+    """Builds the provider catalog before the first request instead of at import."""
+    provider_and_models.load()
+    print(f"Startup phases: {startup_timer.report()}")
+
+
 @app.on_event("startup")
-@repeat_every(seconds=60 * 60, wait_first=2, on_exception=logging.exception)
+def restore_providers() -> None:
+    if settings.CHECK_WORKING_PROVIDERS:
+        restore_probe_snapshot()
+
+
+@app.on_event("startup")
+@repeat_every(
+    seconds=settings.PROBE_TICK_SECONDS, wait_first=2, on_exception=logging.exception
+)
 async def selftest_providers() -> None:
     if settings.CHECK_WORKING_PROVIDERS:
-        await update_working_providers()
+        await run_due_probes()
+
+
+@app.on_event("startup")
+@repeat_every(
+    seconds=settings.SHARED_STATE_SYNC_SECONDS, on_exception=logging.exception
+)
+async def sync_workers() -> None:
+    # Async so it runs on the event loop: the SQLite connection stays on one
+    # thread, and the health, probe and catalog state is only changed there
+    sync_shared_state()
+
+
+@app.on_event("startup")
+@repeat_every(seconds=60, wait_first=60, on_exception=logging.exception)
+async def evict_idle_clients() -> None:
+    client_pool.evict_idle()
+
+
+@app.on_event("shutdown")
+async def close_client_pool() -> None:
+    await client_pool.close()
+
+
+@app.on_event("shutdown")
+async def close_session_store() -> None:
+    session_store.close()
+
+
+@app.on_event("shutdown")
+def release_shared_state() -> None:
+    if leader_lock is not None:
+        leader_lock.release()
+    if shared_state is not None:
+        shared_state.close()
+
+
+@app.on_event("startup")
+@repeat_every(seconds=10 * 60, wait_first=10 * 60, on_exception=logging.exception)
+async def purge_expired_sessions() -> None:
+    session_store.purge_expired()
+
+
+@app.on_event("startup")
+@repeat_every(seconds=settings.EGRESS_REFRESH_SECONDS, on_exception=logging.exception)
+async def refresh_egress_identity() -> None:
+    await egress_identity.refresh()
 
 
 app.add_middleware(
@@ -1,22 +1,45 @@
 import asyncio
 import logging
+import random
+import time
+from collections.abc import AsyncIterator
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any
 
-from g4f import AsyncClient, ProviderType
-from g4f.client.stubs import ChatCompletion
-
-from backend.dependencies import base_working_providers_map, provider_and_models
+from backend.dependencies import (
+    ChatCompletions,
+    chat_completion,
+    get_base_working_providers_map,
+    provider_and_models,
+)
 from backend.errors import CustomValidationError
+from backend.health import provider_health
+from backend.history import provider_history
+from backend.metrics import probe_results, probe_run_duration, provider_working
+from backend.settings import settings
+from backend.shared import LeaderLock, SharedState
+from backend.snapshot import load_snapshot, save_snapshot
+
+if TYPE_CHECKING:
+    from g4f import ProviderType
+    from g4f.client.stubs import ChatCompletion
 
 lock = asyncio.Lock()
 
 
-async def ai_respond(messages: list[dict], model: str, provider: ProviderType) -> str:
+async def ai_respond(
+    messages: list[dict],
+    model: str,
+    provider: "ProviderType | str",
+    chat: ChatCompletions | None = None,
+) -> str:
     """Generate a response from the AI."""
-    client = AsyncClient()
-    chat_completion: ChatCompletion = await client.chat.completions.create(
+    if chat is None:
+        chat = chat_completion()
+    completion: "ChatCompletion" = await chat.create(
         messages=messages, model=model, provider=provider, stream=False
     )
-    choices = chat_completion.choices
+    choices = completion.choices
     if len(choices) == 0:
         raise CustomValidationError(
             "No response from the provider", error={"messages": messages}
@@ -25,12 +48,29 @@ async def ai_respond(messages: list[dict], model: str, provider: ProviderType) -
     return choices[0].message.content
 
 
-async def test_provider(
-    provider: ProviderType, queue: asyncio.Queue, semaphore: asyncio.Semaphore
-) -> bool:
+async def ai_stream(
+    messages: list[dict],
+    model: str,
+    provider: "ProviderType | str",
+    chat: ChatCompletions | None = None,
+) -> AsyncIterator[str]:
+    """Stream the non-empty text chunks of a response from the AI."""
+    if chat is None:
+        chat = chat_completion()
+    async for chunk in chat.create(
+        messages=messages, model=model, provider=provider, stream=True
+    ):
+        choices = getattr(chunk, "choices", None)
+        if not choices or not choices[0].delta.content:
+            continue
+        yield choices[0].delta.content
+
+
+async def test_provider(provider: "ProviderType", semaphore: asyncio.Semaphore) -> bool:
     """Sends hi to a provider and check if there is response or error."""
     print(f"Testing provider {provider.__name__}")
     async with semaphore:
+        started = time.monotonic()
         try:
             messages = [{"role": "user", "content": "hi, how are you?"}]
             if hasattr(provider, "supported_models"):
@@ -45,7 +85,7 @@ async def test_provider(
                 )[0]
             else:
                 model = "gpt-4"
-            async with asyncio.timeout(5):
+            async with asyncio.timeout(settings.PROBE_TIMEOUT):
                 text = await ai_respond(messages, model, provider=provider)
             result = len(text.strip()) > 0 and isinstance(text, str)
         except ValueError as e:
@@ -57,47 +97,212 @@ async def test_provider(
         except Exception as e:
             logging.exception(e)
             result = False
+        provider_history.record(
+            provider.__name__,
+            None,
+            "probe_pass" if result else "probe_fail",
+            time.monotonic() - started,
+        )
 
-        await queue.put((provider, result))
     return result
 
 
-async def update_working_providers():
-    if lock.locked():
+@dataclass
+class ProbeSchedule:
+    next_probe_at: float = 0.0
+    interval: float = 0.0
+    last_result: bool | None = None
+
+
+@dataclass
+class ProbeScheduler:
+    """
+    Gives every provider its own next probe time. A provider whose result changed
+    is probed again after PROBE_MIN_INTERVAL, and every probe with the same result
+    as the previous one doubles the interval up to PROBE_MAX_INTERVAL, or only up to
+    PROBE_FAILED_MAX_INTERVAL while the provider keeps failing. Intervals are
+    jittered so probes spread out instead of running in waves.
+    """
+
+    schedules: dict[str, ProbeSchedule] = field(default_factory=dict)
+    # None until the first probe result: every provider is assumed to work
+    working_provider_names: set[str] | None = None
+
+    def working(self) -> set[str]:
+        if self.working_provider_names is None:
+            self.working_provider_names = set(get_base_working_providers_map())
+        return self.working_provider_names
+
+    def due(self, now: float) -> list[str]:
+        base_working_providers_map = get_base_working_providers_map()
+        for name in base_working_providers_map:
+            self.schedules.setdefault(name, ProbeSchedule())
+        return sorted(
+            (
+                name
+                for name in base_working_providers_map
+                if self.schedules[name].next_probe_at <= now
+            ),
+            key=lambda name: self.schedules[name].next_probe_at,
+        )
+
+    def record(self, name: str, result: bool, now: float) -> bool:
+        """Stores a probe result. Returns True if the working set changed."""
+        schedule = self.schedules.setdefault(name, ProbeSchedule())
+        if schedule.last_result is None or schedule.last_result != result:
+            schedule.interval = settings.PROBE_MIN_INTERVAL
+        else:
+            max_interval = (
+                settings.PROBE_MAX_INTERVAL
+                if result
+                else settings.PROBE_FAILED_MAX_INTERVAL
+            )
+            schedule.interval = min(schedule.interval * 2, max_interval)
+        schedule.last_result = result
+        jitter = random.uniform(-settings.PROBE_JITTER, settings.PROBE_JITTER)
+        schedule.next_probe_at = now + schedule.interval * (1 + jitter)
+
+        working = self.working()
+        changed = result != (name in working)
+        if result:
+            working.add(name)
+        else:
+            working.discard(name)
+        return changed
+
+    def dump(self) -> dict[str, Any]:
+        # Monotonic clocks restart with the process, so save wall clock times
+        offset = time.time() - time.monotonic()
+        return {
+            "working_providers": sorted(self.working()),
+            "probes": {
+                name: {
+                    "next_probe_at": schedule.next_probe_at + offset,
+                    "interval": schedule.interval,
+                    "last_result": schedule.last_result,
+                }
+                for name, schedule in self.schedules.items()
+                if schedule.last_result is not None
+            },
+        }
+
+    def restore(self, data: dict[str, Any]) -> None:
+        base_working_providers_map = get_base_working_providers_map()
+        offset = time.time() - time.monotonic()
+        self.working_provider_names = {
+            name
+            for name in data.get("working_providers", [])
+            if name in base_working_providers_map
+        }
+        for name, probe in data.get("probes", {}).items():
+            if name not in base_working_providers_map:
+                continue
+            self.schedules[name] = ProbeSchedule(
+                next_probe_at=probe["next_probe_at"] - offset,
+                interval=probe["interval"],
+                last_result=probe["last_result"],
+            )
+
+
+probe_scheduler = ProbeScheduler()
+shared_state: SharedState | None = None
+leader_lock: LeaderLock | None = None
+if settings.SHARED_STATE_PATH:
+    shared_state = SharedState(settings.SHARED_STATE_PATH)
+    leader_lock = LeaderLock(f"{settings.SHARED_STATE_PATH}.lock")
+
+
+def apply_working_providers() -> None:
+    provider_and_models.update_model_providers(probe_scheduler.working())
+
+
+def save_probe_snapshot() -> None:
+    if settings.SNAPSHOT_PATH:
+        try:
+            save_snapshot(settings.SNAPSHOT_PATH, probe_scheduler.dump())
+        except OSError as e:
+            logging.warning(f"Failed to save snapshot {settings.SNAPSHOT_PATH}: {e}")
+
+
+def restore_probe_snapshot() -> bool:
+    """Starts from the last saved probe results instead of every provider working."""
+    if not settings.SNAPSHOT_PATH:
+        return False
+    data = load_snapshot(settings.SNAPSHOT_PATH, settings.SNAPSHOT_MAX_AGE)
+    if data is None:
+        return False
+    probe_scheduler.restore(data)
+    apply_working_providers()
+    print(
+        f"Restored {len(probe_scheduler.working())} working providers from {settings.SNAPSHOT_PATH}"
+    )
+    return True
+
+
+async def probe_providers(provider_names: list[str]) -> None:
+    """Probes the providers, applying each result to the routing as soon as it is in."""
+    semaphore = asyncio.Semaphore(settings.PROBE_CONCURRENCY)
+
+    async def probe(name: str) -> None:
+        provider = get_base_working_providers_map()[name]
+        result = await test_provider(provider, semaphore)
+        probe_results.inc(name, "pass" if result else "fail")
+        provider_working.set(int(result), name)
+        if probe_scheduler.record(name, result, time.monotonic()):
+            print(f"Provider {name} is now {'working' if result else 'not working'}")
+            apply_working_providers()
+
+    started = time.monotonic()
+    await asyncio.gather(*[probe(name) for name in provider_names])
+    probe_run_duration.observe(time.monotonic() - started)
+
+
+def is_probe_leader() -> bool:
+    """Without shared state every worker probes for itself."""
+    return leader_lock is None or leader_lock.try_acquire()
+
+
+def publish_probe_results() -> None:
+    save_probe_snapshot()
+    if shared_state is not None:
+        shared_state.publish_probes(probe_scheduler.dump())
+
+
+def sync_shared_state() -> None:
+    """Exchanges provider health with the other workers and follows the leader's probes."""
+    if shared_state is None:
+        return
+    shared_state.publish_health(provider_health.take_changes())
+    for provider, data in shared_state.read_health().items():
+        provider_health.apply(provider, data)
+
+    if leader_lock is not None and leader_lock.held:
+        return
+    data = shared_state.read_probes()
+    if data is not None:
+        probe_scheduler.restore(data)
+        apply_working_providers()
+
+
+async def run_due_probes() -> None:
+    if lock.locked() or not is_probe_leader():
         return
 
     async with lock:
-        now_working_providers = set()
-        queue = asyncio.Queue()
-        providers = list(base_working_providers_map.values())
-
-        async def producer():
-            semaphore = asyncio.Semaphore(8)
-            await asyncio.gather(
-                *[test_provider(provider, queue, semaphore) for provider in providers]
-            )
-            await queue.join()
-            await queue.put((None, None))
-
-        async def consumer():
-            async with asyncio.timeout(5 * 60):
-                while True:
-                    provider, result = await queue.get()
-                    if provider is None and result is None:
-                        break
-                    name = provider.__name__
-                    if result:
-                        now_working_providers.add(name)
-                    queue.task_done()
-
-        await asyncio.gather(producer(), consumer())
+        due = probe_scheduler.due(time.monotonic())
+        if due:
+            await probe_providers(due)
+            publish_probe_results()
 
+
+async def update_working_providers():
+    """Probes every provider right away, regardless of its schedule."""
+    if lock.locked() or not is_probe_leader():
+        return
+
+    async with lock:
+        await probe_providers(list(get_base_working_providers_map()))
+        publish_probe_results()
         print(
-            f"Finished testing providers. Updating working providers to {len(now_working_providers)}"
-        )
-        provider_and_models.update_model_providers(
-            {
-                provider_name: base_working_providers_map[provider_name]
-                for provider_name in now_working_providers
-            }
+            f"Finished testing providers. Working providers: {len(probe_scheduler.working())}"
         )
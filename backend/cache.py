@@ -0,0 +1,114 @@
+# Description: Exact-match completion response cache with TTL and LRU eviction.
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from backend.dependencies import CompletionResponse
+from backend.settings import settings
+
+
+def completion_cache_key(
+    messages: list[dict], model: str | None, provider: str | None
+) -> str:
+    """
+    Hashes the canonical JSON form of a completion request.
+
+    Args:
+        messages (list[dict]): Messages of the conversation.
+        model (str | None): Requested model, None for the best available.
+        provider (str | None): Requested provider, None for the best available.
+
+    Returns:
+        str: Hex digest identifying the request.
+    """
+    canonical = json.dumps(
+        {"messages": messages, "model": model, "provider": provider},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+@dataclass(frozen=True)
+class CachePolicy:
+    read: bool = True
+    store: bool = True
+    ttl: float = 0.0
+
+    @classmethod
+    def from_header(cls, cache_control: str | None) -> "CachePolicy":
+        """
+        Builds the policy of a request from its Cache-Control header. no-cache skips
+        the lookup, no-store skips the lookup and the storage and max-age sets the
+        time to live of the stored response.
+        """
+        read, store, ttl = True, True, settings.CACHE_TTL
+        for directive in (cache_control or "").lower().split(","):
+            name, _, value = directive.strip().partition("=")
+            if name == "no-cache":
+                read = False
+            elif name == "no-store":
+                read = store = False
+            elif name == "max-age" and value.strip().isdigit():
+                ttl = min(float(value), settings.CACHE_TTL)
+        return cls(read=read, store=store and ttl > 0, ttl=ttl)
+
+
+@dataclass
+class CacheEntry:
+    response: CompletionResponse
+    expires_at: float
+    size: int
+
+
+@dataclass
+class ResponseCache:
+    """Least recently used cache bounded by number of entries and total size."""
+
+    max_entries: int
+    max_bytes: int
+    entries: OrderedDict[str, CacheEntry] = field(default_factory=OrderedDict)
+    size: int = 0
+    hits: int = 0
+    misses: int = 0
+
+    def get(self, key: str) -> CompletionResponse | None:
+        entry = self.entries.get(key)
+        if entry is not None and entry.expires_at < time.monotonic():
+            self._remove(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry.response
+
+    def put(self, key: str, response: CompletionResponse, ttl: float) -> None:
+        size = len(response.completion.encode())
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = CacheEntry(
+            response=response, expires_at=time.monotonic() + ttl, size=size
+        )
+        self.size += size
+        while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.size = 0
+
+    def _remove(self, key: str) -> None:
+        self.size -= self.entries.pop(key).size
+
+
+response_cache = ResponseCache(
+    max_entries=settings.CACHE_MAX_ENTRIES, max_bytes=settings.CACHE_MAX_BYTES
+)
@@ -0,0 +1,101 @@
+# Description: Time budget of a completion request, split between its attempts with jittered backoff in between.
+
+import asyncio
+import random
+import time
+from dataclasses import dataclass, field
+
+from fastapi import Request
+
+from backend.errors import CustomValidationError
+from backend.settings import settings
+
+REQUEST_TIMEOUT_HEADER = "X-Request-Timeout"
+
+
+@dataclass
+class Attempt:
+    model: str
+    provider: str
+    duration: float
+    outcome: str
+
+    def __str__(self) -> str:
+        return f"{self.model} on {self.provider} ({self.outcome}, {self.duration:.2f}s)"
+
+
+@dataclass
+class RetryBudget:
+    """
+    Deadline of a request and the attempts made within it. With retries left, an
+    attempt gets a share of the time left so the fallbacks still have some, the
+    last attempt gets all of it.
+    """
+
+    timeout: float
+    deadline: float = field(init=False)
+    attempts: list[Attempt] = field(default_factory=list)
+
+    def __post_init__(self) -> None:
+        self.deadline = time.monotonic() + self.timeout
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - time.monotonic())
+
+    @property
+    def exhausted(self) -> bool:
+        """No time left for another attempt. The first one always gets its chance."""
+        if not self.attempts:
+            return self.remaining() <= 0
+        return self.remaining() < settings.ATTEMPT_TIMEOUT_MIN
+
+    def attempt_timeout(self, retries_left: int) -> float:
+        remaining = self.remaining()
+        if retries_left <= 0:
+            return remaining
+        share = max(
+            settings.ATTEMPT_TIMEOUT_MIN, remaining * settings.ATTEMPT_TIMEOUT_SHARE
+        )
+        return min(remaining, share)
+
+    def record(self, model: str, provider: str, started: float, outcome: str) -> None:
+        self.attempts.append(
+            Attempt(model, provider, time.monotonic() - started, outcome)
+        )
+
+    async def backoff(self) -> bool:
+        """
+        Waits a jittered, exponentially growing delay before the next attempt.
+
+        Returns:
+            bool: False without waiting if the delay would leave no time for it.
+        """
+        ceiling = settings.RETRY_BACKOFF_BASE * 2 ** (len(self.attempts) - 1)
+        delay = random.uniform(0, min(settings.RETRY_BACKOFF_MAX, ceiling))
+        if self.remaining() - delay < settings.ATTEMPT_TIMEOUT_MIN:
+            return False
+        await asyncio.sleep(delay)
+        return True
+
+    def describe(self) -> str:
+        return "; ".join(str(attempt) for attempt in self.attempts) or "none"
+
+
+def request_budget(request: Request) -> RetryBudget:
+    """
+    Dependency giving the request its time budget: REQUEST_TIMEOUT seconds, or what
+    the client asks for in the X-Request-Timeout header up to REQUEST_TIMEOUT_MAX.
+    """
+    header = request.headers.get(REQUEST_TIMEOUT_HEADER)
+    if header is None:
+        return RetryBudget(settings.REQUEST_TIMEOUT)
+    try:
+        timeout = float(header)
+    except ValueError:
+        timeout = 0.0
+    if not timeout > 0:
+        raise CustomValidationError(
+            f"{REQUEST_TIMEOUT_HEADER} must be a positive number of seconds",
+            error={REQUEST_TIMEOUT_HEADER: header},
+        )
+    return RetryBudget(min(timeout, settings.REQUEST_TIMEOUT_MAX))
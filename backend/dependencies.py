@@ -1,16 +1,21 @@
+import time
+from collections.abc import Collection, Mapping
 from dataclasses import dataclass, field
-from typing import TypeVar
+from functools import cached_property, lru_cache
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Any, NamedTuple, Protocol, TypeVar
 
-import g4f
 from fastapi import Query
 from fastapi.openapi.models import Example
-from g4f.models import ModelUtils
-from g4f.Provider import BaseProvider, RetryProvider
-from g4f.Provider.base_provider import ProviderModelMixin
 from pydantic import BaseModel, Field
 
 from backend.errors import CustomValidationError
 from backend.models import CompletionModel, CompletionProvider, Message
+from backend.pool import pooled_chat_completions
+from backend.startup import startup_timer
+
+if TYPE_CHECKING:
+    from g4f.Provider import BaseProvider, ProviderType
 
 MODEL_BLACKLIST = [
     "TextGenerations",
@@ -57,159 +62,418 @@ provider_models_override = {
 }
 
 
-base_working_providers_map = {
-    provider.__name__: provider
-    for provider in g4f.Provider.__providers__
-    if provider.working
-    and not provider.needs_auth
-    and provider.__name__ not in PROVIDER_BLACKLIST
-}
+@lru_cache(maxsize=1)
+def get_base_working_providers_map() -> dict[str, "BaseProvider"]:
+    with startup_timer.phase("import g4f"):
+        import g4f
 
+    return {
+        provider.__name__: provider
+        for provider in g4f.Provider.__providers__
+        if provider.working
+        and not provider.needs_auth
+        and provider.__name__ not in PROVIDER_BLACKLIST
+    }
 
-@dataclass
-class ProviderAndModels:
-    all_working_provider_names: list[str] = field(default_factory=list)
-    all_working_providers_map: dict[str, CompletionProvider] = field(
-        default_factory=dict
+
+class NofailParms(NamedTuple):
+    model: str
+    provider: str
+
+
+@dataclass(frozen=True, eq=False)
+class RoutingIndex:
+    """Lookups for request routing, rebuilt whenever the working providers change."""
+
+    model_names: frozenset[str] = frozenset()
+    provider_names: frozenset[str] = frozenset()
+    # Position of each model in the order of preference
+    model_rank: Mapping[str, int] = field(default_factory=lambda: MappingProxyType({}))
+    # Working providers of each model, recommended providers first
+    model_providers: Mapping[str, tuple[str, ...]] = field(
+        default_factory=lambda: MappingProxyType({})
+    )
+    # Models supported by each provider, best first
+    provider_models: Mapping[str, tuple[str, ...]] = field(
+        default_factory=lambda: MappingProxyType({})
+    )
+    # Model and provider to try in nofail mode, best first
+    fallback_chain: tuple[NofailParms, ...] = ()
+
+    def rank(self, model: str) -> int:
+        return self.model_rank.get(model, len(self.model_rank))
+
+
+@lru_cache(maxsize=None)
+def recommended_provider_names(model_name: str) -> tuple[str, ...]:
+    """Providers g4f recommends for a model, in its order of preference."""
+    from g4f.models import ModelUtils
+
+    model = ModelUtils.convert.get(model_name)
+    if model is None or not model.best_provider:
+        return ()
+    if hasattr(model.best_provider, "providers"):
+        return tuple(p.__name__ for p in model.best_provider.providers)
+    return (model.best_provider.__name__,)
+
+
+@lru_cache(maxsize=1)
+def media_model_names() -> frozenset[str]:
+    """Models the providers list as generating images, audio or video."""
+    return frozenset(
+        name
+        for provider in get_base_working_providers_map().values()
+        for attribute in ("image_models", "audio_models", "video_models")
+        for name in getattr(provider, attribute, None) or ()
     )
-    all_model_names: list[str] = field(default_factory=list)
-    all_models_map: dict[str, CompletionModel] = field(default_factory=dict)
-
-    def update_model_providers(
-        self, working_providers_map: dict[str, BaseProvider]
-    ) -> None:
-        self.all_working_provider_names = list(working_providers_map.keys())
-        self.all_working_providers_map = {}
-        self.all_model_names = list(ModelUtils.convert.keys())
-        self.all_models_map = {}
-
-        for model_name in self.all_model_names:
-            model = ModelUtils.convert[model_name]
-            best_providers = set([model.base_provider])
-
-            # Retry providers contain multiple recomendations
-            if isinstance(model.best_provider, RetryProvider):
-                best_providers.update(
-                    [p.__name__ for p in model.best_provider.providers]
-                )
-            elif model.best_provider:
-                best_providers.add(model.best_provider.__name__)
-            else:
-                continue
 
-            complation_model = CompletionModel(
-                name=model.name, supported_provider_names=best_providers
+
+@lru_cache(maxsize=None)
+def is_chat_model(model_name: str) -> bool:
+    """Whether the model answers in text, rather than with images, audio or video."""
+    from g4f.models import AudioModel, ImageModel, ModelUtils, VideoModel
+
+    model = ModelUtils.convert.get(model_name)
+    if model is not None:
+        return not isinstance(model, (AudioModel, ImageModel, VideoModel))
+    return model_name not in media_model_names()
+
+
+def build_routing_index(
+    providers_map: dict[str, CompletionProvider],
+    models_map: dict[str, CompletionModel],
+) -> RoutingIndex:
+    # Past the preferred models, only chat models: nofail must not fall back to a
+    # text to speech or image model, nor pick one as the best model of a provider
+    model_order = [name for name in BEST_MODELS_ORDERED if name in models_map] + [
+        name
+        for name in models_map
+        if name not in BEST_MODELS_ORDERED
+        and name not in MODEL_BLACKLIST
+        and is_chat_model(name)
+    ]
+    model_rank = {name: rank for rank, name in enumerate(model_order)}
+
+    supporting_providers: dict[str, list[str]] = {}
+    for provider in providers_map.values():
+        for model_name in provider.supported_models:
+            supporting_providers.setdefault(model_name, []).append(provider.name)
+
+    model_providers = {}
+    for model_name, provider_names in supporting_providers.items():
+        recommended = [
+            name
+            for name in recommended_provider_names(model_name)
+            if name in provider_names
+        ]
+        model_providers[model_name] = tuple(
+            recommended + [name for name in provider_names if name not in recommended]
+        )
+
+    def _sort_key(model_name: str) -> tuple[int, str]:
+        return model_rank.get(model_name, len(model_rank)), model_name
+
+    return RoutingIndex(
+        model_names=frozenset(models_map),
+        provider_names=frozenset(providers_map),
+        model_rank=MappingProxyType(model_rank),
+        model_providers=MappingProxyType(model_providers),
+        provider_models=MappingProxyType(
+            {
+                provider.name: tuple(sorted(provider.supported_models, key=_sort_key))
+                for provider in providers_map.values()
+            }
+        ),
+        fallback_chain=tuple(
+            NofailParms(model=model_name, provider=model_providers[model_name][0])
+            for model_name in model_order
+            if model_name in model_providers
+        ),
+    )
+
+
+@dataclass(frozen=True)
+class ProviderGraph:
+    """
+    What every known provider supports, independent of which providers work. Built
+    once per process, since it only depends on the installed g4f version.
+    """
+
+    # Models g4f defines, with the providers it recommends for them
+    models: Mapping[str, CompletionModel]
+    # Every provider as listed when it works
+    providers: Mapping[str, CompletionProvider]
+    # Models each working provider adds itself to as a supported provider
+    provider_model_links: Mapping[str, tuple[str, ...]]
+    # Inverse of provider_model_links
+    model_link_providers: Mapping[str, tuple[str, ...]]
+
+    @cached_property
+    def model_names(self) -> tuple[str, ...]:
+        """Every model once, in the order catalogs list them: g4f's own first."""
+        return tuple(dict.fromkeys([*self.models, *self.model_link_providers]))
+
+
+def build_provider_graph(
+    base_providers_map: dict[str, "BaseProvider"],
+) -> ProviderGraph:
+    import g4f
+    from g4f.models import ModelUtils
+    from g4f.Provider import RetryProvider
+    from g4f.Provider.base_provider import ProviderModelMixin
+
+    models: dict[str, CompletionModel] = {}
+    supported_models: dict[str, set[str]] = {name: set() for name in base_providers_map}
+    links: dict[str, set[str]] = {name: set() for name in base_providers_map}
+
+    for model_name, model in ModelUtils.convert.items():
+        best_providers = set([model.base_provider])
+
+        # Retry providers contain multiple recomendations
+        if isinstance(model.best_provider, RetryProvider):
+            best_providers.update([p.__name__ for p in model.best_provider.providers])
+        elif model.best_provider:
+            best_providers.add(model.best_provider.__name__)
+        else:
+            continue
+
+        models[model_name] = CompletionModel(
+            name=model.name, supported_provider_names=best_providers
+        )
+
+        # Populate providers with recomended models
+        for provider_name in best_providers:
+            if provider_name in supported_models:
+                supported_models[provider_name].add(model.name)
+
+    # Populate with models declared in the provider class definitions themselves
+    for provider_name, provider in base_providers_map.items():
+        if hasattr(provider, "models"):
+            for model in provider.models:
+                if isinstance(model, str):
+                    supported_models[provider_name].add(model)
+                elif isinstance(model, dict):
+                    supported_models[provider_name].update(set(model.keys()))
+
+        if hasattr(provider, "default_model"):
+            supported_models[provider_name].update(
+                [provider.default_model] if provider.default_model else []
             )
-            self.all_models_map[model_name] = complation_model
-
-            # Populate providers with recomended models
-            for provider_name in best_providers:
-                if provider_name not in working_providers_map:
-                    continue
-
-                if provider_name not in self.all_working_providers_map:
-                    self.all_working_providers_map[provider_name] = CompletionProvider(
-                        name=provider_name,
-                        supported_models=set(),
-                        url=working_providers_map[provider_name].url or "",
-                    )
-                self.all_working_providers_map[provider_name].supported_models.add(
-                    model.name
-                )
 
-        # Populate with models declared in the provider class definitions themselves
-        for provider_name in working_providers_map:
-            if provider_name not in working_providers_map:
-                continue
-            provider: BaseProvider = working_providers_map[provider_name]
-            if provider_name not in self.all_working_providers_map:
-                self.all_working_providers_map[provider_name] = CompletionProvider(
-                    name=provider_name,
-                    supported_models=set(),
+        if hasattr(provider, "supports_gpt_4") and provider.supports_gpt_4:
+            supported_models[provider_name].add("gpt-4")
+
+        if (
+            hasattr(provider, "supports_gpt_35_turbo")
+            and provider.supports_gpt_35_turbo
+        ):
+            supported_models[provider_name].add("gpt-3.5-turbo")
+
+        links[provider_name].update(supported_models[provider_name])
+
+    # ProviderMixins also have models directly associated with them
+    for provider in g4f.Provider.__providers__:
+        provider_name = provider.__name__
+        if (
+            provider.working
+            and isinstance(provider, ProviderModelMixin)
+            and provider_name in supported_models
+        ):
+            supported_models[provider_name].update(provider.models)
+            links[provider_name].update(supported_models[provider_name])
+
+    for provider_name, override in provider_models_override.items():
+        if provider_name in supported_models:
+            supported_models[provider_name] = set(override)
+
+    model_link_providers: dict[str, list[str]] = {}
+    for provider_name, model_names in links.items():
+        for model_name in model_names:
+            model_link_providers.setdefault(model_name, []).append(provider_name)
+
+    return ProviderGraph(
+        models=MappingProxyType(models),
+        providers=MappingProxyType(
+            {
+                name: CompletionProvider(
+                    name=name,
+                    supported_models=supported_models[name],
                     url=provider.url or "",
                 )
-            if hasattr(provider, "models"):
-                for model in provider.models:
-                    if isinstance(model, str):
-                        self.all_working_providers_map[
-                            provider_name
-                        ].supported_models.add(model)
-                    elif isinstance(model, dict):
-                        self.all_working_providers_map[
-                            provider_name
-                        ].supported_models.update(set(model.keys()))
-
-            if hasattr(provider, "default_model"):
-                self.all_working_providers_map[provider_name].supported_models.update(
-                    [provider.default_model] if provider.default_model else []
-                )
+                for name, provider in base_providers_map.items()
+            }
+        ),
+        provider_model_links=MappingProxyType(
+            {name: tuple(model_names) for name, model_names in links.items()}
+        ),
+        model_link_providers=MappingProxyType(
+            {name: tuple(names) for name, names in model_link_providers.items()}
+        ),
+    )
 
-            if hasattr(provider, "supports_gpt_4") and provider.supports_gpt_4:
-                self.all_working_providers_map[provider_name].supported_models.add(
-                    "gpt-4"
-                )
 
-            if (
-                hasattr(provider, "supports_gpt_35_turbo")
-                and provider.supports_gpt_35_turbo
-            ):
-                self.all_working_providers_map[provider_name].supported_models.add(
-                    "gpt-3.5-turbo"
-                )
+@lru_cache(maxsize=1)
+def get_provider_graph() -> ProviderGraph:
+    base_map = get_base_working_providers_map()
+    with startup_timer.phase("provider graph"):
+        return build_provider_graph(base_map)
+
+
+def link_model(
+    graph: ProviderGraph, model_name: str, working: Collection[str]
+) -> CompletionModel | None:
+    """The catalog entry of a model for the given working providers."""
+    linked = {
+        name
+        for name in graph.model_link_providers.get(model_name, ())
+        if name in working
+    }
+    model = graph.models.get(model_name)
+    if model is None:
+        if not linked:
+            return None
+        return CompletionModel(name=model_name, supported_provider_names=linked)
+    if linked <= model.supported_provider_names:
+        return model
+    return CompletionModel(
+        name=model.name,
+        supported_provider_names=model.supported_provider_names | linked,
+    )
 
-            for model_name in self.all_working_providers_map[
-                provider_name
-            ].supported_models:
-                if model_name not in self.all_models_map:
-                    self.all_models_map[model_name] = CompletionModel(
-                        name=model_name, supported_provider_names={provider_name}
-                    )
-                else:
-                    self.all_models_map[model_name].supported_provider_names.add(
-                        provider_name
-                    )
 
-        # ProviderMixins also have models directly associated with them
-        for provider in g4f.Provider.__providers__:
-            if not provider.working:
-                continue
-            provider_name = provider.__name__
-            if (
-                isinstance(provider, ProviderModelMixin)
-                and provider_name in self.all_working_providers_map
-            ):
-                self.all_working_providers_map[provider_name].supported_models.update(
-                    provider.models
-                )
-                for model_name in self.all_working_providers_map[
-                    provider_name
-                ].supported_models:
-                    if model_name not in self.all_models_map:
-                        self.all_models_map[model_name] = CompletionModel(
-                            name=model_name, supported_provider_names={provider_name}
-                        )
-                    else:
-                        self.all_models_map[model_name].supported_provider_names.add(
-                            provider_name
-                        )
-
-        self.all_model_names = list(self.all_models_map.keys())
-
-        for provider_name in provider_models_override:
-            if provider_name in self.all_working_providers_map:
-                self.all_working_providers_map[provider_name].supported_models = set(
-                    provider_models_override[provider_name]
-                )
+@dataclass(frozen=True, eq=False)
+class Catalog:
+    """
+    Immutable snapshot of the working providers and the models they support.
+    Updates build a new snapshot, so readers holding one never see it change.
+    """
 
+    created_at: float = field(default_factory=time.time)
 
-provider_and_models = ProviderAndModels()
-provider_and_models.update_model_providers(base_working_providers_map)
+    all_working_provider_names: list[str] = field(default_factory=list)
+    all_working_providers_map: Mapping[str, CompletionProvider] = field(
+        default_factory=lambda: MappingProxyType({})
+    )
+    all_model_names: list[str] = field(default_factory=list)
+    all_models_map: Mapping[str, CompletionModel] = field(
+        default_factory=lambda: MappingProxyType({})
+    )
+    routing: RoutingIndex = field(default_factory=RoutingIndex)
+
+    def with_working_providers(
+        self, graph: ProviderGraph, provider_names: Collection[str]
+    ) -> "Catalog":
+        """
+        Snapshot for another set of working providers. Only the models linked to
+        providers that started or stopped working are recomputed, every other entry
+        is shared with this snapshot.
+        """
+        working = {name for name in provider_names if name in graph.providers}
+        changed = working.symmetric_difference(self.routing.provider_names)
+        if not changed:
+            return self
+
+        models_map = dict(self.all_models_map)
+        for model_name in {
+            model_name
+            for provider_name in changed
+            for model_name in graph.provider_model_links[provider_name]
+        }:
+            model = link_model(graph, model_name, working)
+            if model is None:
+                models_map.pop(model_name, None)
+            else:
+                models_map[model_name] = model
+        # Models added back go to their place in a full build, not to the end, so
+        # the model list, the fallback chain and the ETags do not depend on history
+        models_map = {
+            name: models_map[name] for name in graph.model_names if name in models_map
+        }
+
+        providers_map = {
+            name: provider
+            for name, provider in graph.providers.items()
+            if name in working
+        }
+        return Catalog(
+            all_working_provider_names=list(providers_map),
+            all_working_providers_map=MappingProxyType(providers_map),
+            all_model_names=list(models_map),
+            all_models_map=MappingProxyType(models_map),
+            routing=build_routing_index(providers_map, models_map),
+        )
 
-BEST_MODELS_ORDERED += [
-    model_name
-    for model_name in provider_and_models.all_model_names
-    if model_name not in BEST_MODELS_ORDERED and model_name not in MODEL_BLACKLIST
-]
+
+def build_catalog(graph: ProviderGraph, provider_names: Collection[str]) -> Catalog:
+    working = {name for name in provider_names if name in graph.providers}
+    models_map = {}
+    for model_name in graph.model_names:
+        model = link_model(graph, model_name, working)
+        if model is not None:
+            models_map[model_name] = model
+
+    providers_map = {
+        name: provider for name, provider in graph.providers.items() if name in working
+    }
+    return Catalog(
+        all_working_provider_names=list(providers_map),
+        all_working_providers_map=MappingProxyType(providers_map),
+        all_model_names=list(models_map),
+        all_models_map=MappingProxyType(models_map),
+        routing=build_routing_index(providers_map, models_map),
+    )
+
+
+class ProviderAndModels:
+    """
+    Working providers and the models they support. The catalog is built on first
+    use, normally by the startup phase. Updates swap in a new snapshot, so readers
+    should take the catalog once per request instead of going through the
+    properties below repeatedly.
+    """
+
+    def __init__(self) -> None:
+        self._catalog: Catalog | None = None
+
+    def load(self) -> Catalog:
+        """Builds the catalog unless it is already built, with every provider working."""
+        if self._catalog is None:
+            graph = get_provider_graph()
+            with startup_timer.phase("catalog"):
+                self._catalog = build_catalog(graph, graph.providers)
+        return self._catalog
+
+    @property
+    def catalog(self) -> Catalog:
+        return self.load()
+
+    @property
+    def all_working_provider_names(self) -> list[str]:
+        return self.catalog.all_working_provider_names
+
+    @property
+    def all_working_providers_map(self) -> Mapping[str, CompletionProvider]:
+        return self.catalog.all_working_providers_map
+
+    @property
+    def all_model_names(self) -> list[str]:
+        return self.catalog.all_model_names
+
+    @property
+    def all_models_map(self) -> Mapping[str, CompletionModel]:
+        return self.catalog.all_models_map
+
+    @property
+    def routing(self) -> RoutingIndex:
+        return self.catalog.routing
+
+    def update_model_providers(self, provider_names: Collection[str]) -> None:
+        self._catalog = self.catalog.with_working_providers(
+            get_provider_graph(), provider_names
+        )
+
+
+provider_and_models = ProviderAndModels()
 
 A = TypeVar("A")
 
@@ -218,12 +482,31 @@ def generate_examples_from_values(values: list) -> dict[str, Example]:
     return {str(v or "--"): Example(value=v) for v in values}
 
 
-def allowed_values_or_none(v: A | None, allowed: list[A]) -> A | None:
+def add_catalog_examples(openapi_schema: dict) -> dict:
+    """
+    Adds the known models and providers as examples of the model and provider
+    query parameters. Done when the schema is first requested instead of at import.
+    """
+    examples = {
+        "model": [None] + provider_and_models.all_model_names,
+        "provider": [None] + provider_and_models.all_working_provider_names,
+    }
+    for path in openapi_schema.get("paths", {}).values():
+        for operation in path.values():
+            for parameter in operation.get("parameters", []):
+                if parameter.get("in") == "query" and parameter["name"] in examples:
+                    parameter["examples"] = generate_examples_from_values(
+                        examples[parameter["name"]]
+                    )
+    return openapi_schema
+
+
+def allowed_values_or_none(v: A | None, allowed: Collection[A]) -> A | None:
     if v is None:
         return v
     if v not in allowed:
         raise CustomValidationError(
-            f"Value {v} not in allowed values: {allowed}", error={}
+            f"Value {v} not in allowed values: {sorted(allowed)}", error={}
         )
     return v
 
@@ -234,16 +517,10 @@ class CompletionParams:
         model: str | None = Query(
             None,
             description="LLM model to use for completion. If not specified, the best available model will be used.",
-            openapi_examples=generate_examples_from_values(
-                [None] + provider_and_models.all_model_names
-            ),
         ),
         provider: str | None = Query(
             None,
             description="Provider to use for completion. If not specified, the best available provider will be used.",
-            openapi_examples=generate_examples_from_values(
-                [None] + provider_and_models.all_working_provider_names
-            ),
         ),
     ):
         provider = provider or None
@@ -253,17 +530,16 @@ class CompletionParams:
             self.model = None
             return
 
-        allowed_values_or_none(model, provider_and_models.all_model_names)
-        allowed_values_or_none(provider, provider_and_models.all_working_provider_names)
+        catalog = provider_and_models.catalog
+        allowed_values_or_none(model, catalog.routing.model_names)
+        allowed_values_or_none(provider, catalog.routing.provider_names)
         if model and provider:
-            if provider not in provider_and_models.all_working_providers_map:
+            if provider not in catalog.all_working_providers_map:
                 raise CustomValidationError(
                     f"Provider {provider} not in working providers. Check available providers with /api/providers",
-                    error={
-                        "allowed_providers": provider_and_models.all_working_provider_names
-                    },
+                    error={"allowed_providers": catalog.all_working_provider_names},
                 )
-            provider_model = provider_and_models.all_working_providers_map[provider]
+            provider_model = catalog.all_working_providers_map[provider]
             if model not in provider_model.supported_models:
                 raise CustomValidationError(
                     f"Model {model} not supported by provider {provider}. Check available providers and their supported models with /api/providers",
@@ -274,8 +550,22 @@ class CompletionParams:
         self.model = model
 
 
-def chat_completion() -> type[g4f.ChatCompletion]:
-    return g4f.ChatCompletion
+class ChatCompletions(Protocol):
+    """The part of g4f's AsyncCompletions used to talk to providers."""
+
+    def create(
+        self,
+        messages: list[dict],
+        model: str,
+        provider: "ProviderType | str | None" = None,
+        stream: bool = False,
+        **kwargs: Any,
+    ) -> Any: ...
+
+
+def chat_completion() -> ChatCompletions:
+    """Completions through the pooled client of each provider, see backend.pool."""
+    return pooled_chat_completions
 
 
 class CompletionResponse(BaseModel):
@@ -284,6 +574,10 @@ class CompletionResponse(BaseModel):
     model: str | None = Field(None, description="Model used for completion")
 
 
+class SessionCompletionResponse(CompletionResponse):
+    session_id: str = Field(..., description="Conversation the completion was added to")
+
+
 class UiCompletionRequest(BaseModel):
     model: str | None = Field(
         None,
@@ -297,3 +591,7 @@ class UiCompletionRequest(BaseModel):
     history: list[Message] = Field(
         default_factory=list, description="History of past messages"
     )
+    session_id: str | None = Field(
+        None,
+        description="Conversation held by the server. When given, its messages are used instead of the history.",
+    )
@@ -0,0 +1,53 @@
+# Description: Cancellation of completions whose client went away before the answer was ready.
+
+import asyncio
+from collections.abc import Awaitable
+from typing import TypeVar
+
+from fastapi import HTTPException, Request
+
+from backend.metrics import client_disconnects
+
+T = TypeVar("T")
+
+# Not sent to anyone, the status only shows up in the access log
+CLIENT_CLOSED_REQUEST = 499
+
+
+async def wait_for_disconnect(request: Request) -> None:
+    """
+    Returns once the client closed the connection. Only usable once the body has
+    been read, and while nothing else receives from the request, that is until
+    the endpoint returns.
+    """
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def cancel_on_disconnect(request: Request, work: Awaitable[T], route: str) -> T:
+    """
+    Runs the work until it is done or the client disconnects. A disconnect cancels
+    it, and with it the provider call in progress and the fallbacks left, since
+    nobody would read the answer.
+
+    Raises:
+        HTTPException: 499 when the client disconnected.
+    """
+    task = asyncio.ensure_future(work)
+    watcher = asyncio.ensure_future(wait_for_disconnect(request))
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        watcher.cancel()
+    if task.done():
+        return task.result()
+
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    client_disconnects.inc(route)
+    raise HTTPException(status_code=CLIENT_CLOSED_REQUEST, detail="Client disconnected")
@@ -0,0 +1,115 @@
+# Description: Public egress addresses of the server and detection of them leaking in responses.
+
+import asyncio
+import json
+import logging
+import re
+import time
+from collections.abc import Awaitable, Callable, Iterable
+from dataclasses import dataclass, field
+
+import aiohttp
+
+from backend.settings import settings
+
+
+async def fetch_public_ip(url: str, proxy: str | None = None) -> str | None:
+    """
+    Asks a lookup service like ipify for the public address requests leave with.
+
+    Args:
+        url (str): Lookup service answering with JSON containing "ip" or plain text.
+        proxy (str | None): Proxy to send the lookup through.
+
+    Returns:
+        str | None: The address, None if the lookup failed.
+    """
+    timeout = aiohttp.ClientTimeout(total=settings.EGRESS_LOOKUP_TIMEOUT)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        async with session.get(url, proxy=proxy) as response:
+            if not response.ok:
+                return None
+            text = (await response.text()).strip()
+    if text.startswith("{"):
+        return json.loads(text).get("ip")
+    return text or None
+
+
+def compile_leak_pattern(addresses: Iterable[str]) -> re.Pattern | None:
+    """Single matcher for all addresses, not matching inside longer numbers."""
+    alternatives = "|".join(
+        re.escape(address) for address in sorted(addresses, key=len, reverse=True)
+    )
+    if not alternatives:
+        return None
+    return re.compile(
+        rf"(?<![0-9a-f])(?:{alternatives})(?![0-9a-f])", flags=re.IGNORECASE
+    )
+
+
+@dataclass
+class LeakScanner:
+    """Finds addresses split across the chunks of a streamed response."""
+
+    pattern: re.Pattern | None
+    overlap: int
+    tail: str = ""
+
+    def feed(self, chunk: str) -> bool:
+        if self.pattern is None:
+            return False
+        window = self.tail + chunk
+        self.tail = window[-self.overlap :]
+        return self.pattern.search(window) is not None
+
+
+@dataclass
+class EgressIdentity:
+    """
+    Public addresses of the server, resolved in the background so completions never
+    wait for a lookup. Each proxy in EGRESS_PROXIES is looked up as well, and
+    EGRESS_IPS are always included. Failed refreshes keep the last known addresses.
+    """
+
+    lookup: Callable[[str, str | None], Awaitable[str | None]] = fetch_public_ip
+    addresses: frozenset[str] = frozenset()
+    pattern: re.Pattern | None = None
+    refreshed_at: float | None = None
+    _max_length: int = field(default=0, repr=False)
+
+    def set_addresses(self, addresses: Iterable[str]) -> None:
+        self.addresses = frozenset(a.strip().lower() for a in addresses if a.strip())
+        self.pattern = compile_leak_pattern(self.addresses)
+        self._max_length = max((len(a) for a in self.addresses), default=0)
+
+    async def refresh(self) -> None:
+        async def _lookup(proxy: str | None) -> str | None:
+            for url in settings.EGRESS_IP_LOOKUP_URLS:
+                try:
+                    address = await self.lookup(url, proxy)
+                except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                    logging.warning(f"Public IP lookup with {url} failed: {e}")
+                    continue
+                if address:
+                    return address
+            return None
+
+        results = await asyncio.gather(
+            *[_lookup(proxy) for proxy in [None, *settings.EGRESS_PROXIES]]
+        )
+        found = {address for address in results if address}
+        if not found and self.refreshed_at is not None:
+            return
+        self.set_addresses(found | set(settings.EGRESS_IPS))
+        self.refreshed_at = time.monotonic()
+
+    def contains_leak(self, text: str) -> bool:
+        return self.pattern is not None and self.pattern.search(text) is not None
+
+    def scanner(self) -> LeakScanner:
+        # One extra character so the boundary check sees what precedes the address
+        return LeakScanner(pattern=self.pattern, overlap=self._max_length + 1)
+
+
+egress_identity = EgressIdentity()
+egress_identity.set_addresses(settings.EGRESS_IPS)
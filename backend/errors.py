@@ -1,9 +1,16 @@
 import json
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.exception_handlers import (
+    http_exception_handler,
+    request_validation_exception_handler,
+)
+from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
 from pydantic import ValidationError
 
+OPENAI_PATH_PREFIX = "/v1/"
+
 
 class CustomValidationError(ValueError):
     def __init__(self, message: str, error: dict[str, str | list[str]]) -> None:
@@ -11,13 +18,68 @@ class CustomValidationError(ValueError):
         self.error = error
 
 
+def openai_error_type(status_code: int) -> str:
+    if status_code == 401:
+        return "authentication_error"
+    if status_code == 404:
+        return "not_found_error"
+    if status_code == 429:
+        return "rate_limit_error"
+    if status_code < 500:
+        return "invalid_request_error"
+    return "server_error"
+
+
+def openai_error(
+    status_code: int,
+    message: str,
+    param: str | None = None,
+    headers: dict[str, str] | None = None,
+) -> JSONResponse:
+    """Error in the shape OpenAI clients expect, for the /v1 routes."""
+    return JSONResponse(
+        status_code=status_code,
+        content={
+            "error": {
+                "message": message,
+                "type": openai_error_type(status_code),
+                "param": param,
+                "code": None,
+            }
+        },
+        headers=headers,
+    )
+
+
+def is_openai_request(request: Request) -> bool:
+    return request.url.path.startswith(OPENAI_PATH_PREFIX)
+
+
 def add_exception_handlers(app: FastAPI) -> None:
     @app.exception_handler(CustomValidationError)
-    def _(_: Request, exc: CustomValidationError) -> JSONResponse:
+    def _(request: Request, exc: CustomValidationError) -> JSONResponse:
+        if is_openai_request(request):
+            return openai_error(400, str(exc))
         return JSONResponse(
             status_code=422, content={"detail": str(exc), "error": exc.error}
         )
 
     @app.exception_handler(ValidationError)
-    def _(_: Request, exc: ValidationError) -> JSONResponse:
+    def _(request: Request, exc: ValidationError) -> JSONResponse:
+        if is_openai_request(request):
+            return openai_error(400, str(exc))
         return JSONResponse(status_code=422, content=json.loads(exc.json()))
+
+    @app.exception_handler(RequestValidationError)
+    async def _(request: Request, exc: RequestValidationError) -> JSONResponse:
+        if is_openai_request(request):
+            error = exc.errors()[0]
+            param = ".".join(str(loc) for loc in error["loc"][1:]) or None
+            return openai_error(400, error["msg"], param=param)
+        return await request_validation_exception_handler(request, exc)
+
+    @app.exception_handler(HTTPException)
+    async def _(request: Request, exc: HTTPException):
+        if is_openai_request(request):
+            return openai_error(exc.status_code, str(exc.detail), headers=exc.headers)
+        return await http_exception_handler(request, exc)
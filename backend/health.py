@@ -0,0 +1,175 @@
+# Description: Live provider health scores and circuit breakers fed by real completion calls.
+
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any
+
+from backend.settings import settings
+
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+def ewma(previous: float | None, value: float, alpha: float) -> float:
+    if previous is None:
+        return value
+    return alpha * value + (1 - alpha) * previous
+
+
+@dataclass
+class ProviderHealth:
+    success_rate: float = 1.0
+    latency: float | None = None
+    consecutive_failures: int = 0
+    state: CircuitState = CircuitState.CLOSED
+    opened_at: float = 0.0
+    trial_in_flight: bool = False
+    errors: Counter = field(default_factory=Counter)
+    model_success_rates: dict[str, float] = field(default_factory=dict)
+
+
+@dataclass
+class HealthRegistry:
+    """
+    Keeps exponentially decaying success rate and latency per provider.
+
+    A provider's circuit opens after CIRCUIT_FAILURE_THRESHOLD failures in a row and
+    stops receiving nofail traffic. After CIRCUIT_OPEN_SECONDS a single trial call is
+    let through (half open): success closes the circuit, failure opens it again.
+    """
+
+    providers: dict[str, ProviderHealth] = field(default_factory=dict)
+    # Bumped when a circuit changes, which takes a provider out of nofail routing or
+    # brings it back. Rankings recompute then, and only now and then for scores.
+    circuit_version: int = 0
+    # Providers changed by local calls since the last take_changes
+    changed: set[str] = field(default_factory=set)
+
+    def get(self, provider: str) -> ProviderHealth:
+        health = self.providers.get(provider)
+        if health is None:
+            health = self.providers[provider] = ProviderHealth()
+        return health
+
+    def is_available(self, provider: str, now: float | None = None) -> bool:
+        health = self.providers.get(provider)
+        if health is None or health.state == CircuitState.CLOSED:
+            return True
+        if health.trial_in_flight:
+            return False
+        now = time.monotonic() if now is None else now
+        return now - health.opened_at >= settings.CIRCUIT_OPEN_SECONDS
+
+    def begin(self, provider: str) -> None:
+        """Marks the start of a call, turning an expired open circuit half open."""
+        health = self.get(provider)
+        if health.state == CircuitState.OPEN and self.is_available(provider):
+            self.circuit_version += 1
+            self.changed.add(provider)
+            health.state = CircuitState.HALF_OPEN
+            health.trial_in_flight = True
+
+    def cancel(self, provider: str) -> None:
+        """A call was abandoned without an outcome."""
+        health = self.get(provider)
+        if health.state == CircuitState.HALF_OPEN:
+            self.circuit_version += 1
+            self.changed.add(provider)
+            health.state = CircuitState.OPEN
+            health.trial_in_flight = False
+
+    def record_success(self, provider: str, model: str, latency: float) -> None:
+        alpha = settings.HEALTH_EWMA_ALPHA
+        health = self.get(provider)
+        if health.state != CircuitState.CLOSED or health.trial_in_flight:
+            self.circuit_version += 1
+        self.changed.add(provider)
+        health.success_rate = ewma(health.success_rate, 1.0, alpha)
+        health.latency = ewma(health.latency, latency, alpha)
+        health.model_success_rates[model] = ewma(
+            health.model_success_rates.get(model), 1.0, alpha
+        )
+        health.consecutive_failures = 0
+        health.state = CircuitState.CLOSED
+        health.trial_in_flight = False
+
+    def record_failure(
+        self, provider: str, model: str, error: BaseException | str
+    ) -> None:
+        alpha = settings.HEALTH_EWMA_ALPHA
+        health = self.get(provider)
+        circuit = (health.state, health.trial_in_flight)
+        self.changed.add(provider)
+        health.success_rate = ewma(health.success_rate, 0.0, alpha)
+        health.model_success_rates[model] = ewma(
+            health.model_success_rates.get(model), 0.0, alpha
+        )
+        health.errors[error if isinstance(error, str) else type(error).__name__] += 1
+        health.consecutive_failures += 1
+        if (
+            health.state == CircuitState.HALF_OPEN
+            or health.consecutive_failures >= settings.CIRCUIT_FAILURE_THRESHOLD
+        ):
+            health.state = CircuitState.OPEN
+            health.opened_at = time.monotonic()
+        health.trial_in_flight = False
+        if (health.state, health.trial_in_flight) != circuit:
+            self.circuit_version += 1
+
+    def take_changes(self) -> dict[str, dict[str, Any]]:
+        """Health of the providers changed since the last call, for other workers."""
+        # Monotonic clocks differ between processes, so share wall clock times
+        offset = time.time() - time.monotonic()
+        changes = {
+            provider: {
+                "success_rate": health.success_rate,
+                "latency": health.latency,
+                "consecutive_failures": health.consecutive_failures,
+                "state": health.state.value,
+                "opened_at": health.opened_at + offset,
+                "model_success_rates": health.model_success_rates,
+            }
+            for provider in self.changed
+            if (health := self.providers.get(provider)) is not None
+        }
+        self.changed.clear()
+        return changes
+
+    def apply(self, provider: str, data: dict[str, Any]) -> None:
+        """Takes over the health another worker observed for a provider."""
+        health = self.get(provider)
+        if health.trial_in_flight:
+            # Our own trial call decides the outcome of the half open circuit
+            return
+        offset = time.time() - time.monotonic()
+        if health.state != CircuitState(data["state"]):
+            self.circuit_version += 1
+        health.success_rate = data["success_rate"]
+        health.latency = data["latency"]
+        health.consecutive_failures = data["consecutive_failures"]
+        health.state = CircuitState(data["state"])
+        health.opened_at = data["opened_at"] - offset
+        health.model_success_rates = dict(data["model_success_rates"])
+
+    def score(self, provider: str, model: str | None = None) -> float:
+        """Higher is better. Providers with an open circuit score 0."""
+        if not self.is_available(provider):
+            return 0.0
+        health = self.providers.get(provider)
+        if health is None:
+            health = ProviderHealth()
+        success_rate = health.success_rate
+        if model is not None:
+            success_rate *= health.model_success_rates.get(model, 1.0)
+        latency = settings.HEALTH_DEFAULT_LATENCY
+        if health.latency is not None:
+            latency = health.latency
+        return success_rate / (1 + latency / settings.HEALTH_DEFAULT_LATENCY)
+
+
+provider_health = HealthRegistry()
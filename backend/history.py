@@ -0,0 +1,169 @@
+# Description: Bounded history of provider calls and probes in array-backed ring buffers, with windowed percentiles.
+
+import math
+import time
+from array import array
+from collections import OrderedDict
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+
+from backend.settings import settings
+
+OUTCOMES = (
+    "success",
+    "error",
+    "timeout",
+    "empty",
+    "ip_leak",
+    "cancelled",
+    "probe_pass",
+    "probe_fail",
+)
+OUTCOME_CODES = {outcome: code for code, outcome in enumerate(OUTCOMES)}
+PROBE_OUTCOMES = frozenset({"probe_pass", "probe_fail"})
+
+
+class RingBuffer:
+    """
+    The last capacity events, one typed array per column so an event costs 25
+    bytes whatever the uptime. Time to first byte is NaN when there was none.
+    """
+
+    __slots__ = (
+        "capacity",
+        "size",
+        "next",
+        "timestamps",
+        "latencies",
+        "ttfbs",
+        "outcomes",
+    )
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self.size = 0
+        self.next = 0
+        self.timestamps = array("d", bytes(8 * capacity))
+        self.latencies = array("d", bytes(8 * capacity))
+        self.ttfbs = array("d", bytes(8 * capacity))
+        self.outcomes = array("B", bytes(capacity))
+
+    def append(
+        self, timestamp: float, latency: float, ttfb: float, outcome: int
+    ) -> None:
+        self.timestamps[self.next] = timestamp
+        self.latencies[self.next] = latency
+        self.ttfbs[self.next] = ttfb
+        self.outcomes[self.next] = outcome
+        self.next = (self.next + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def since(self, cutoff: float) -> Iterator[int]:
+        """Positions of the events at or after cutoff, newest first."""
+        for offset in range(1, self.size + 1):
+            index = (self.next - offset) % self.capacity
+            if self.timestamps[index] < cutoff:
+                return
+            yield index
+
+
+def percentiles(values: list[float]) -> dict[str, float] | None:
+    """Nearest-rank p50, p95 and p99, None without values."""
+    if not values:
+        return None
+    values = sorted(values)
+    return {
+        name: values[max(1, math.ceil(q / 100 * len(values))) - 1]
+        for name, q in [("p50", 50), ("p95", 95), ("p99", 99)]
+    }
+
+
+@dataclass
+class HistoryStore:
+    """
+    Calls and probes per provider, and calls per provider and model, each in a
+    RingBuffer. The number of provider and model series is capped as well, the
+    least recently updated one goes first.
+    """
+
+    provider_capacity: int
+    model_capacity: int
+    max_series: int
+    providers: dict[str, RingBuffer] = field(default_factory=dict)
+    models: OrderedDict[tuple[str, str], RingBuffer] = field(
+        default_factory=OrderedDict
+    )
+
+    def record(
+        self,
+        provider: str,
+        model: str | None,
+        outcome: str,
+        latency: float,
+        ttfb: float | None = None,
+        timestamp: float | None = None,
+    ) -> None:
+        timestamp = time.time() if timestamp is None else timestamp
+        event = (timestamp, latency, math.nan if ttfb is None else ttfb)
+        code = OUTCOME_CODES[outcome]
+
+        buffer = self.providers.get(provider)
+        if buffer is None:
+            buffer = self.providers[provider] = RingBuffer(self.provider_capacity)
+        buffer.append(*event, code)
+
+        if model is None:
+            return
+        key = (provider, model)
+        buffer = self.models.get(key)
+        if buffer is None:
+            buffer = self.models[key] = RingBuffer(self.model_capacity)
+            while len(self.models) > self.max_series:
+                self.models.popitem(last=False)
+        else:
+            self.models.move_to_end(key)
+        buffer.append(*event, code)
+
+    def stats(
+        self, provider: str, model: str | None, window: float, now: float | None = None
+    ) -> dict:
+        """Outcome counts, success rate and latency percentiles over the last window seconds."""
+        now = time.time() if now is None else now
+        if model is None:
+            buffer = self.providers.get(provider)
+        else:
+            buffer = self.models.get((provider, model))
+
+        outcomes = dict.fromkeys(OUTCOMES, 0)
+        latencies: list[float] = []
+        ttfbs: list[float] = []
+        if buffer is not None:
+            for index in buffer.since(now - window):
+                outcome = OUTCOMES[buffer.outcomes[index]]
+                outcomes[outcome] += 1
+                if outcome == "success":
+                    latencies.append(buffer.latencies[index])
+                    if not math.isnan(buffer.ttfbs[index]):
+                        ttfbs.append(buffer.ttfbs[index])
+
+        calls = sum(
+            n for outcome, n in outcomes.items() if outcome not in PROBE_OUTCOMES
+        )
+        probes = outcomes["probe_pass"] + outcomes["probe_fail"]
+        return {
+            "window": window,
+            "calls": calls,
+            "success_rate": outcomes["success"] / calls if calls else None,
+            "latency": percentiles(latencies),
+            "ttfb": percentiles(ttfbs),
+            "outcomes": outcomes,
+            "probes": probes,
+            "probe_pass_rate": outcomes["probe_pass"] / probes if probes else None,
+        }
+
+
+provider_history = HistoryStore(
+    provider_capacity=settings.HISTORY_PROVIDER_SIZE,
+    model_capacity=settings.HISTORY_MODEL_SIZE,
+    max_series=settings.HISTORY_MAX_SERIES,
+)
@@ -0,0 +1,199 @@
+# Description: In-process counters, gauges and histograms exposed in the Prometheus text format.
+
+import bisect
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+PROMETHEUS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+ATTEMPT_BUCKETS = (1, 2, 3, 5, 10)
+
+Labels = tuple[str, ...]
+
+
+def escape_label_value(value: object) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names: Labels, values: Labels, extra: str = "") -> str:
+    pairs = [
+        f'{name}="{escape_label_value(value)}"' for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+@dataclass
+class Counter:
+    """
+    Monotonic count per label combination. Recording is a dict update, which
+    needs no lock since the event loop never runs two callbacks at once.
+    """
+
+    name: str
+    help: str
+    label_names: Labels = ()
+    values: dict[Labels, float] = field(default_factory=dict)
+    type: str = "counter"
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self) -> Iterator[str]:
+        for labels, value in self.values.items():
+            yield f"{self.name}{format_labels(self.label_names, labels)} {format_value(value)}"
+
+
+@dataclass
+class Gauge(Counter):
+    type: str = "gauge"
+
+    def set(self, value: float, *labels: str) -> None:
+        self.values[labels] = value
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+    @contextmanager
+    def track(self, *labels: str) -> Iterator[None]:
+        """Counts the block as in progress while it runs."""
+        self.inc(*labels)
+        try:
+            yield
+        finally:
+            self.dec(*labels)
+
+
+@dataclass
+class Histogram:
+    """Cumulative buckets are only computed when rendering."""
+
+    name: str
+    help: str
+    label_names: Labels = ()
+    buckets: tuple[float, ...] = LATENCY_BUCKETS
+    # Per label combination: count per bucket (the last one is +Inf), then the sum
+    values: dict[Labels, list[float]] = field(default_factory=dict)
+    type: str = "histogram"
+
+    def observe(self, value: float, *labels: str) -> None:
+        counts = self.values.get(labels)
+        if counts is None:
+            counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def samples(self) -> Iterator[str]:
+        for labels, counts in self.values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = f'le="{format_value(bound)}"'
+                yield f"{self.name}_bucket{format_labels(self.label_names, labels, le)} {cumulative}"
+            label_text = format_labels(self.label_names, labels)
+            yield f"{self.name}_sum{label_text} {format_value(counts[-1])}"
+            yield f"{self.name}_count{label_text} {cumulative}"
+
+
+@dataclass
+class Registry:
+    metrics: list[Counter | Histogram] = field(default_factory=list)
+
+    def counter(self, name: str, help: str, label_names: Labels = ()) -> Counter:
+        return self._add(Counter(name=name, help=help, label_names=label_names))
+
+    def gauge(self, name: str, help: str, label_names: Labels = ()) -> Gauge:
+        return self._add(Gauge(name=name, help=help, label_names=label_names))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        label_names: Labels = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self._add(
+            Histogram(name=name, help=help, label_names=label_names, buckets=buckets)
+        )
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+provider_requests = registry.counter(
+    "g4f_provider_requests_total",
+    "Upstream provider calls by outcome: success, error, timeout, empty, ip_leak or cancelled.",
+    ("provider", "model", "outcome"),
+)
+provider_latency = registry.histogram(
+    "g4f_provider_request_duration_seconds",
+    "Duration of upstream provider calls, until the first chunk for streams.",
+    ("provider", "model"),
+)
+provider_calls_in_flight = registry.gauge(
+    "g4f_provider_calls_in_flight", "Upstream provider calls in progress."
+)
+completion_attempts = registry.histogram(
+    "g4f_completion_attempts",
+    "Provider calls made to answer one completion request.",
+    ("mode",),
+    buckets=ATTEMPT_BUCKETS,
+)
+nofail_fallbacks = registry.counter(
+    "g4f_nofail_fallbacks_total",
+    "Moves to the next nofail candidate after a failed attempt.",
+)
+completions_in_flight = registry.gauge(
+    "g4f_completions_in_flight", "Completion requests in progress.", ("route",)
+)
+probe_results = registry.counter(
+    "g4f_probe_results_total", "Provider probe results.", ("provider", "result")
+)
+probe_run_duration = registry.histogram(
+    "g4f_probe_run_duration_seconds",
+    "Duration of a run probing the due providers.",
+    buckets=(1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0),
+)
+provider_working = registry.gauge(
+    "g4f_provider_working",
+    "1 if the last probe of the provider passed, 0 if it failed.",
+    ("provider",),
+)
+ip_leak_detections = registry.counter(
+    "g4f_ip_leak_detections_total",
+    "Responses containing a public address of the server.",
+    ("provider",),
+)
+client_disconnects = registry.counter(
+    "g4f_client_disconnects_total",
+    "Completions cancelled because the client went away, by route.",
+    ("route",),
+)
+admission_queue_depth = registry.gauge(
+    "g4f_admission_queue_depth", "Completion requests waiting for a slot."
+)
+admission_rejections = registry.counter(
+    "g4f_admission_rejections_total",
+    "Completion requests answered with 429, by reason: rate_limit, queue_full or queue_timeout.",
+    ("reason",),
+)
@@ -17,6 +17,61 @@ class CompletionRequest(BaseModel):
     model_config = ConfigDict(extra="forbid")
 
 
+class BatchCompletionItem(CompletionRequest):
+    model: str | None = Field(
+        None, description="LLM model to use, the best available if not specified"
+    )
+    provider: str | None = Field(
+        None, description="Provider to use, the best available if not specified"
+    )
+
+
+class SessionRequest(BaseModel):
+    messages: list[Message] = Field(
+        default_factory=list, description="Messages to start the conversation with"
+    )
+    model_config = ConfigDict(extra="forbid")
+
+
+class SessionMessageRequest(BaseModel):
+    content: str = Field(..., description="New message of the user")
+    model_config = ConfigDict(extra="forbid")
+
+
+class SessionResponse(BaseModel):
+    session_id: str
+    messages: list[Message]
+
+
+class LatencyPercentiles(BaseModel):
+    p50: float
+    p95: float
+    p99: float
+
+
+class ProviderWindowStats(BaseModel):
+    window: float = Field(..., description="Seconds looked back over")
+    calls: int
+    success_rate: float | None = Field(
+        None, description="Share of the calls that succeeded, None without calls"
+    )
+    latency: LatencyPercentiles | None = Field(
+        None, description="Seconds the successful calls took"
+    )
+    ttfb: LatencyPercentiles | None = Field(
+        None, description="Seconds until the first chunk of the successful calls"
+    )
+    outcomes: dict[str, int]
+    probes: int
+    probe_pass_rate: float | None = None
+
+
+class ProviderStats(BaseModel):
+    provider: str
+    model: str | None = None
+    windows: list[ProviderWindowStats]
+
+
 class CompletionModel(BaseModel):
     name: str
     supported_provider_names: set[str]
@@ -24,7 +79,7 @@ class CompletionModel(BaseModel):
     @field_serializer("supported_provider_names")
     @classmethod
     def serialize_supported_provider_names(cls, v: set[str]) -> list[str]:
-        return list(v)
+        return sorted(v)
 
 
 class CompletionProvider(BaseModel):
@@ -35,4 +90,55 @@ class CompletionProvider(BaseModel):
     @field_serializer("supported_models")
     @classmethod
     def serialize_supported_models(cls, v: set[str]) -> list[str]:
-        return list(v)
+        return sorted(v)
+
+
+class ContentPart(BaseModel):
+    type: str
+    text: str | None = None
+
+
+class OpenAIMessage(BaseModel):
+    role: Literal["system", "developer", "user", "assistant"]
+    content: str | list[ContentPart] | None = None
+
+    def text(self) -> str:
+        if self.content is None:
+            return ""
+        if isinstance(self.content, str):
+            return self.content
+        return "".join(part.text or "" for part in self.content if part.type == "text")
+
+
+class OpenAIChatCompletionRequest(BaseModel):
+    model: str = Field(
+        ..., description="Model to use, an empty string for the best available model"
+    )
+    messages: list[OpenAIMessage] = Field(..., min_length=1)
+    stream: bool = False
+    provider: str | None = Field(
+        None,
+        description="Provider to use, the best available if not specified. Not part of the OpenAI API.",
+    )
+    # Sampling parameters and the like are accepted but providers don't support them
+    model_config = ConfigDict(extra="ignore")
+
+
+class OpenAIChatMessage(BaseModel):
+    role: Literal["assistant"] = "assistant"
+    content: str
+
+
+class OpenAIChoice(BaseModel):
+    index: int = 0
+    message: OpenAIChatMessage
+    finish_reason: Literal["stop"] = "stop"
+
+
+class OpenAIChatCompletion(BaseModel):
+    id: str
+    object: Literal["chat.completion"] = "chat.completion"
+    created: int
+    model: str
+    provider: str | None = None
+    choices: list[OpenAIChoice]
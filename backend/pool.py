@@ -0,0 +1,159 @@
+# Description: Long-lived g4f clients per provider and a shared keep-alive HTTP connector for their calls.
+
+import asyncio
+import inspect
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any
+
+import aiohttp
+
+from backend.settings import settings
+
+if TYPE_CHECKING:
+    from g4f import ProviderType
+    from g4f.client import AsyncClient
+
+
+class SharedConnector(aiohttp.TCPConnector):
+    """
+    Connector outliving the sessions using it. Providers open and close their own
+    ClientSession per call, which would close the connector they were given, and
+    with it the connections to keep alive. Only shutdown really closes it.
+    """
+
+    async def close(self, *args: Any, **kwargs: Any) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        await super().close()
+
+
+@lru_cache(maxsize=None)
+def accepts_connector(provider: "ProviderType") -> bool:
+    """Whether the provider passes a connector given to it on to its aiohttp session."""
+    create = getattr(provider, "create_async_generator", None)
+    if create is None:
+        return False
+    try:
+        return "connector" in inspect.signature(create).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def resolve_provider(provider: "ProviderType | str | None") -> "ProviderType | None":
+    if provider is None or not isinstance(provider, str):
+        return provider
+    from g4f.Provider import ProviderUtils
+
+    return ProviderUtils.convert.get(provider)
+
+
+@dataclass
+class PooledClient:
+    client: "AsyncClient"
+    last_used: float
+
+
+@dataclass
+class ClientPool:
+    """
+    One g4f AsyncClient per provider, kept for reuse instead of built per call.
+    Least recently used clients go first once there are more than max_clients,
+    and evict_idle drops the ones unused for idle_timeout seconds.
+
+    Providers built on aiohttp that take a connector share one, so connections
+    are kept alive and DNS answers cached across calls, within the configured
+    limits. It belongs to the event loop it was created on.
+    """
+
+    max_clients: int
+    idle_timeout: float
+    clients: OrderedDict[str, PooledClient] = field(default_factory=OrderedDict)
+    _connector: SharedConnector | None = field(default=None, repr=False)
+    _connector_loop: asyncio.AbstractEventLoop | None = field(default=None, repr=False)
+
+    def client(self, provider_name: str) -> "AsyncClient":
+        pooled = self.clients.get(provider_name)
+        if pooled is None:
+            from g4f.client import AsyncClient
+
+            pooled = PooledClient(AsyncClient(), last_used=time.monotonic())
+            self.clients[provider_name] = pooled
+            while len(self.clients) > self.max_clients:
+                self.clients.popitem(last=False)
+        else:
+            pooled.last_used = time.monotonic()
+            self.clients.move_to_end(provider_name)
+        return pooled.client
+
+    def connector(self) -> SharedConnector:
+        loop = asyncio.get_running_loop()
+        if self._connector is None or self._connector_loop is not loop:
+            self._connector = SharedConnector(
+                limit=settings.POOL_CONNECTIONS,
+                limit_per_host=settings.POOL_CONNECTIONS_PER_HOST,
+                keepalive_timeout=settings.POOL_KEEPALIVE,
+                ttl_dns_cache=settings.POOL_DNS_TTL,
+            )
+            self._connector_loop = loop
+        return self._connector
+
+    def evict_idle(self) -> None:
+        idle_since = time.monotonic() - self.idle_timeout
+        for name in [
+            name
+            for name, pooled in self.clients.items()
+            if pooled.last_used < idle_since
+        ]:
+            del self.clients[name]
+
+    async def close(self) -> None:
+        self.clients.clear()
+        if self._connector is not None:
+            await self._connector.shutdown()
+            self._connector = None
+
+
+client_pool = ClientPool(
+    max_clients=settings.POOL_MAX_CLIENTS, idle_timeout=settings.POOL_IDLE_TIMEOUT
+)
+
+
+class PooledChatCompletions:
+    """ChatCompletions going through the pooled client of the provider called."""
+
+    def __init__(self, pool: ClientPool) -> None:
+        self.pool = pool
+
+    def create(
+        self,
+        messages: list[dict],
+        model: str,
+        provider: "ProviderType | str | None" = None,
+        stream: bool = False,
+        **kwargs: Any,
+    ) -> Any:
+        provider_class = resolve_provider(provider)
+        name = getattr(provider_class, "__name__", str(provider))
+        client = self.pool.client(name)
+        # A connector would bypass the proxy of the call or of the client
+        if (
+            provider_class is not None
+            and kwargs.get("proxy") is None
+            and not client.proxy
+            and accepts_connector(provider_class)
+        ):
+            kwargs["connector"] = self.pool.connector()
+        return client.chat.completions.create(
+            messages=messages,
+            model=model,
+            provider=provider_class or provider,
+            stream=stream,
+            **kwargs,
+        )
+
+
+pooled_chat_completions = PooledChatCompletions(client_pool)
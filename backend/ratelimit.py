@@ -0,0 +1,222 @@
+# Description: Per-client rate limiting and a global cap on completions in flight with a bounded wait queue.
+
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+
+from fastapi import HTTPException, Request
+from fastapi.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from backend.metrics import admission_queue_depth, admission_rejections
+from backend.settings import settings
+
+
+@dataclass
+class TokenBucket:
+    tokens: float
+    updated_at: float
+
+    def take(self, rate: float, burst: float, now: float, cost: float = 1) -> float:
+        """
+        Takes cost tokens if there are that many, none otherwise.
+
+        Returns:
+            float: 0 if the tokens were taken, otherwise seconds until they are available.
+        """
+        self.tokens = min(burst, self.tokens + (now - self.updated_at) * rate)
+        self.updated_at = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / rate
+
+
+@dataclass
+class RateLimiter:
+    """
+    Token bucket per client. Only the most recently seen max_clients are kept, a
+    client evicted since its last request starts again with a full bucket.
+    """
+
+    rate: float
+    burst: float
+    max_clients: int
+    buckets: OrderedDict[str, TokenBucket] = field(default_factory=OrderedDict)
+
+    def check(self, client: str, now: float | None = None, cost: float = 1) -> float:
+        """Seconds the client has to wait, 0 if a request costing cost tokens may go ahead."""
+        now = time.monotonic() if now is None else now
+        bucket = self.buckets.get(client)
+        if bucket is None:
+            bucket = self.buckets[client] = TokenBucket(
+                tokens=self.burst, updated_at=now
+            )
+            while len(self.buckets) > self.max_clients:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(client)
+        return bucket.take(self.rate, self.burst, now, cost)
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: float) -> None:
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+@dataclass
+class AdmissionController:
+    """
+    Lets at most max_in_flight requests run at once. Up to max_queue more wait for
+    a slot for at most queue_timeout seconds, anything beyond is rejected at once.
+    """
+
+    max_in_flight: int
+    max_queue: int
+    queue_timeout: float
+    in_flight: int = 0
+    waiting: int = 0
+    slots: asyncio.Semaphore = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self.slots = asyncio.Semaphore(self.max_in_flight)
+
+    async def acquire(self) -> None:
+        if self.slots.locked():
+            if self.waiting >= self.max_queue:
+                raise AdmissionRejected("queue_full", retry_after=1.0)
+            self.waiting += 1
+            admission_queue_depth.set(self.waiting)
+            try:
+                async with asyncio.timeout(self.queue_timeout):
+                    await self.slots.acquire()
+            except TimeoutError:
+                raise AdmissionRejected("queue_timeout", retry_after=1.0) from None
+            finally:
+                self.waiting -= 1
+                admission_queue_depth.set(self.waiting)
+        else:
+            await self.slots.acquire()
+        self.in_flight += 1
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self.slots.release()
+
+
+@dataclass
+class Admission:
+    """
+    Slot of the in flight cap taken by a request. The dependency gives it back once
+    the endpoint returned, unless a streamed response took it over with hold.
+    """
+
+    controller: AdmissionController
+    held: bool = True
+    handed_over: bool = False
+
+    def release(self) -> None:
+        if self.held:
+            self.held = False
+            self.controller.release()
+
+    def hold(self, response: StreamingResponse) -> StreamingResponse:
+        """Keeps the slot until the body of the response is sent or abandoned."""
+        self.handed_over = True
+        held = AdmittedStreamingResponse(
+            response.body_iterator,
+            status_code=response.status_code,
+            background=response.background,
+            admission=self,
+        )
+        held.raw_headers = response.raw_headers
+        return held
+
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """Streaming response releasing the admission of its request once it is over."""
+
+    def __init__(self, *args, admission: Admission, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.admission = admission
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        # Also when the client went away before the body started, or the server
+        # cancelled the request, which a finally in the body would miss
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.admission.release()
+
+
+rate_limiter = RateLimiter(
+    rate=settings.RATE_LIMIT_PER_MINUTE / 60,
+    burst=settings.RATE_LIMIT_BURST,
+    max_clients=settings.RATE_LIMIT_MAX_CLIENTS,
+)
+admission_controller = AdmissionController(
+    max_in_flight=settings.ADMISSION_MAX_IN_FLIGHT,
+    max_queue=settings.ADMISSION_QUEUE_SIZE,
+    queue_timeout=settings.ADMISSION_QUEUE_TIMEOUT,
+)
+
+
+def client_key(request: Request) -> str:
+    """The API key of the client if it sent one, its address otherwise."""
+    api_key = request.headers.get(settings.RATE_LIMIT_KEY_HEADER)
+    if api_key:
+        return f"key:{api_key}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+def too_many_requests(reason: str, retry_after: float) -> HTTPException:
+    admission_rejections.inc(reason)
+    return HTTPException(
+        status_code=429,
+        detail=f"Too many requests ({reason}), retry later",
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+def charge_rate_limit(request: Request, cost: float = 1) -> None:
+    """Takes cost tokens from the bucket of the client, rejects it if it has fewer left."""
+    if settings.RATE_LIMIT_PER_MINUTE > 0 and cost > 0:
+        wait = rate_limiter.check(client_key(request), cost=cost)
+        if wait > 0:
+            raise too_many_requests("rate_limit", wait)
+
+
+async def admit_completion(request: Request) -> AsyncIterator[Admission]:
+    """
+    Dependency of the completion routes: rejects clients over their rate limit and
+    holds a slot of the global in flight cap while the request is handled. Routes
+    streaming their response hand the slot over to it with Admission.hold, since
+    the body is only sent after the dependency exited.
+    """
+    charge_rate_limit(request)
+    try:
+        await admission_controller.acquire()
+    except AdmissionRejected as e:
+        raise too_many_requests(e.reason, e.retry_after) from None
+    admission = Admission(admission_controller)
+    try:
+        yield admission
+    finally:
+        if not admission.handed_over:
+            admission.release()
+
+
+@asynccontextmanager
+async def admission_slot() -> AsyncIterator[None]:
+    """Holds a slot of the in flight cap for work fanned out of an admitted request."""
+    await admission_controller.acquire()
+    try:
+        yield
+    finally:
+        admission_controller.release()
@@ -0,0 +1,72 @@
+# Description: JSON bodies rendered once and served as bytes with ETag and gzip support.
+
+import gzip
+import hashlib
+from dataclasses import dataclass
+from email.utils import formatdate
+
+from fastapi import Request, Response
+
+
+@dataclass(frozen=True)
+class RenderedBody:
+    body: bytes
+    gzipped: bytes
+    etag: str
+    last_modified: str
+
+
+def render_json(body: bytes, modified_at: float) -> RenderedBody:
+    """
+    Prepares a JSON body for serving many times.
+
+    Args:
+        body (bytes): The serialized JSON.
+        modified_at (float): Unix time the content last changed.
+
+    Returns:
+        RenderedBody: The body, its gzip variant and the validators for both. The
+        ETag depends on the content only, so every worker gives out the same one.
+    """
+    return RenderedBody(
+        body=body,
+        gzipped=gzip.compress(body, compresslevel=6),
+        etag=f'"{hashlib.sha256(body).hexdigest()[:32]}"',
+        last_modified=formatdate(modified_at, usegmt=True),
+    )
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # Weak comparison, as in RFC 9110 for If-None-Match
+    return "*" in candidates or any(
+        tag.removeprefix("W/") == etag for tag in candidates
+    )
+
+
+def accepts_gzip(accept_encoding: str | None) -> bool:
+    for coding in (accept_encoding or "").lower().split(","):
+        name, _, params = coding.strip().partition(";")
+        if name.strip() == "gzip":
+            return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+
+def rendered_response(request: Request, rendered: RenderedBody) -> Response:
+    """Serves a rendered body, answering 304 if the client already has it."""
+    headers = {
+        "ETag": rendered.etag,
+        "Last-Modified": rendered.last_modified,
+        "Vary": "Accept-Encoding",
+        "Cache-Control": "no-cache",
+    }
+    if etag_matches(request.headers.get("if-none-match"), rendered.etag):
+        return Response(status_code=304, headers=headers)
+    if accepts_gzip(request.headers.get("accept-encoding")):
+        headers["Content-Encoding"] = "gzip"
+        body = rendered.gzipped
+    else:
+        body = rendered.body
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -1,36 +1,114 @@
+import asyncio
+import html
+import json
 import logging
-from functools import lru_cache
-from typing import NamedTuple
+import time
+import uuid
+from collections.abc import AsyncGenerator, AsyncIterator, Awaitable, Callable
+from functools import lru_cache, partial
+from typing import NamedTuple, TypeVar
+from urllib.parse import urlencode
 
-import g4f
-import requests
-from fastapi import APIRouter, Depends, FastAPI, HTTPException, Request
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import (
+    HTMLResponse,
+    JSONResponse,
+    PlainTextResponse,
+    RedirectResponse,
+    StreamingResponse,
+)
 from fastapi.templating import Jinja2Templates
+from pydantic import TypeAdapter
 
 from backend.adapters import adapt_response
+from backend.background import ai_respond, ai_stream
+from backend.cache import CachePolicy, completion_cache_key, response_cache
+from backend.deadline import RetryBudget, request_budget
 from backend.dependencies import (
-    BEST_MODELS_ORDERED,
+    Catalog,
+    ChatCompletions,
     CompletionParams,
     CompletionResponse,
     Message,
+    NofailParms,
+    RoutingIndex,
+    SessionCompletionResponse,
     UiCompletionRequest,
+    allowed_values_or_none,
     chat_completion,
+    get_provider_graph,
     provider_and_models,
 )
+from backend.disconnect import cancel_on_disconnect
+from backend.egress import egress_identity
 from backend.errors import CustomValidationError
-from backend.models import CompletionRequest
-from backend.settings import TEMPLATES_PATH
+from backend.health import provider_health
+from backend.history import provider_history
+from backend.metrics import (
+    PROMETHEUS_MEDIA_TYPE,
+    admission_rejections,
+    client_disconnects,
+    completion_attempts,
+    completions_in_flight,
+    ip_leak_detections,
+    nofail_fallbacks,
+    provider_calls_in_flight,
+    provider_latency,
+    provider_requests,
+    registry,
+)
+from backend.models import (
+    BatchCompletionItem,
+    CompletionModel,
+    CompletionProvider,
+    CompletionRequest,
+    OpenAIChatCompletion,
+    OpenAIChatCompletionRequest,
+    OpenAIChatMessage,
+    OpenAIChoice,
+    ProviderStats,
+    SessionMessageRequest,
+    SessionRequest,
+    SessionResponse,
+)
+from backend.ratelimit import (
+    Admission,
+    AdmissionRejected,
+    admission_slot,
+    admit_completion,
+    charge_rate_limit,
+)
+from backend.rendering import RenderedBody, render_json, rendered_response
+from backend.sessions import Session, session_store
+from backend.settings import TEMPLATES_PATH, settings
+from backend.singleflight import SingleFlight
+from backend.startup import startup_timer
+from backend.streaming import (
+    NDJSON_MEDIA_TYPE,
+    SSE_MEDIA_TYPE,
+    encode_frame,
+    encode_sse_html,
+    wants_sse,
+)
 
 router_root = APIRouter()
 router_api = APIRouter(prefix="/api")
 router_ui = APIRouter(prefix="/app")
+router_openai = APIRouter(prefix="/v1")
+
+completion_semaphore = asyncio.Semaphore(settings.MAX_CONCURRENT_COMPLETIONS)
+# Attempts of a completion, the first one included, before giving up
+MAX_ATTEMPTS = 10
+completion_flights = SingleFlight(max_waiters=settings.SINGLE_FLIGHT_MAX_WAITERS)
+
+T = TypeVar("T")
 
 
 def add_routers(app: FastAPI) -> None:
     app.include_router(router_root)
     app.include_router(router_api)
     app.include_router(router_ui)
+    app.include_router(router_openai)
 
 
 @router_root.get("/")
@@ -38,32 +116,49 @@ def get_root():
     return RedirectResponse(url=router_ui.prefix)
 
 
-class NofailParms(NamedTuple):
-    model: str
-    provider: str
+@lru_cache(maxsize=1)
+def _rank_nofail_candidates(
+    routing: RoutingIndex, circuit_version: int, second: int
+) -> tuple[NofailParms, ...]:
+    candidates = []
+    for model_name, provider_name in routing.fallback_chain:
+        if not provider_health.is_available(provider_name):
+            provider_name = max(
+                routing.model_providers[model_name],
+                key=lambda name: provider_health.score(name, model_name),
+            )
+        candidates.append(NofailParms(model=model_name, provider=provider_name))
 
+    # Stable sort, so equally healthy candidates keep the model preference order
+    candidates.sort(key=lambda c: -provider_health.score(c.provider, c.model))
+    return tuple(candidates)
 
-def get_nofail_params(offset: int = 0) -> NofailParms:
-    for model in BEST_MODELS_ORDERED:
-        try:
-            provider = g4f.get_model_and_provider(model, None, False)[1]
-        except g4f.errors.ModelNotFoundError:
-            logging.warning(f"Model not found: {model}")
-            continue
 
-        # If the provider is not working, try to find another one that supports the model
-        if provider.__name__ not in provider_and_models.all_working_provider_names:
-            if offset > 0:
-                offset -= 1
-                continue
-            for provider_name in provider_and_models.all_working_provider_names:
-                if (
-                    model
-                    in provider_and_models.all_working_providers_map[
-                        provider_name
-                    ].supported_models
-                ):
-                    return NofailParms(model=model, provider=provider_name)
+def rank_nofail_candidates() -> tuple[NofailParms, ...]:
+    """
+    Nofail candidates ordered by live provider health, then by model preference.
+    Recomputed when the routing index or a circuit changed, and otherwise at most
+    once a second, so scores moving with every call do not cost a sort per request.
+    """
+    routing = provider_and_models.routing
+    if not provider_health.providers:
+        return routing.fallback_chain
+    # Open circuits also become available again with time alone
+    return _rank_nofail_candidates(
+        routing, provider_health.circuit_version, int(time.monotonic())
+    )
+
+
+def get_nofail_params(tried: set[str]) -> NofailParms:
+    """
+    Best ranked nofail candidate whose provider was not tried yet, added to tried.
+    A provider that failed likely fails for its other models too, and the ranking
+    may change between attempts, so retries skip providers rather than positions.
+    """
+    for candidate in rank_nofail_candidates():
+        if candidate.provider not in tried:
+            tried.add(candidate.provider)
+            return candidate
 
     raise HTTPException(
         status_code=500, detail="Failed to find a model and provider to use"
@@ -71,120 +166,1059 @@ def get_nofail_params(offset: int = 0) -> NofailParms:
 
 
 def get_best_model_for_provider(provider_name: str) -> str:
-    provider = provider_and_models.all_working_providers_map.get(provider_name)
-    if provider is None:
+    models = provider_and_models.routing.provider_models.get(provider_name)
+    if models is None:
         raise HTTPException(
             status_code=422, detail=f"Provider not found: {provider_name}"
         )
-    models = list(provider.supported_models)
     if not models:
         raise HTTPException(
             status_code=422,
             detail=f"No models supported by provider: {provider_name}. Please specify a model.",
         )
 
-    def _sort_key(model: str) -> int:
-        return BEST_MODELS_ORDERED.index(model) if model in BEST_MODELS_ORDERED else 999
+    health = provider_health.providers.get(provider_name)
+    if health is None or not health.model_success_rates:
+        return models[0]
+    return min(
+        models,
+        key=lambda model: (
+            -health.model_success_rates.get(model, 1.0),
+            provider_and_models.routing.rank(model),
+        ),
+    )
 
-    models.sort(key=_sort_key)
-    return models[0]
 
+async def respond(
+    messages: list[dict],
+    model: str,
+    provider: str,
+    chat: ChatCompletions,
+    timeout: float | None = None,
+) -> str:
+    """
+    Calls the provider and records the outcome in the provider health scores. A
+    provider taking longer than the timeout counts as failed.
+    """
+    provider_health.begin(provider)
+    started = time.monotonic()
+    try:
+        with provider_calls_in_flight.track():
+            async with completion_semaphore, asyncio.timeout(timeout):
+                response = await ai_respond(messages, model, provider, chat=chat)
+    except asyncio.CancelledError:
+        provider_health.cancel(provider)
+        provider_requests.inc(provider, model, "cancelled")
+        provider_history.record(
+            provider, model, "cancelled", time.monotonic() - started
+        )
+        raise
+    except Exception as e:
+        outcome = "timeout" if isinstance(e, TimeoutError) else "error"
+        latency = time.monotonic() - started
+        provider_health.record_failure(provider, model, e)
+        provider_requests.inc(provider, model, outcome)
+        provider_latency.observe(latency, provider, model)
+        provider_history.record(provider, model, outcome, latency)
+        raise
 
-@lru_cache(maxsize=1)
-def get_public_ip() -> str | None:
-    response = requests.get("https://api.ipify.org?format=json")
-    if not response.ok:
-        return None
-    return response.json().get("ip")
+    latency = time.monotonic() - started
+    provider_latency.observe(latency, provider, model)
+    if not isinstance(response, str) or response.strip() == "":
+        outcome = "empty"
+        provider_health.record_failure(provider, model, "EmptyResponse")
+    elif egress_identity.contains_leak(response):
+        outcome = "ip_leak"
+        provider_health.record_failure(provider, model, "IpLeak")
+        ip_leak_detections.inc(provider)
+    else:
+        outcome = "success"
+        provider_health.record_success(provider, model, latency)
+    provider_requests.inc(provider, model, outcome)
+    # Without streaming, the first byte comes with the whole answer
+    provider_history.record(provider, model, outcome, latency, ttfb=latency)
+    return response
 
 
-@router_api.post("/completions")
-def post_completion(
-    completion: CompletionRequest,
-    params: CompletionParams = Depends(),
-    chat: type[g4f.ChatCompletion] = Depends(chat_completion),
-) -> CompletionResponse:
-    nofail = False
+def resolve_completion_params(params: CompletionParams) -> tuple[str, str, bool]:
+    """Pick the model and provider to start with and whether nofail mode is on."""
     if params.model is None:
         if params.provider is None:
-            model_name, provider_name = get_nofail_params()
-            nofail = True
-        else:
-            provider_name = params.provider
-            model_name = get_best_model_for_provider(provider_name)
-    else:
-        model_name = params.model
-        provider_name = params.provider
+            model_name, provider_name = get_nofail_params(set())
+            return model_name, provider_name, True
+        return get_best_model_for_provider(params.provider), params.provider, False
+    return params.model, params.provider, False
+
+
+def next_nofail_params(tried: set[str]) -> NofailParms:
+    nofail_fallbacks.inc()
+    return get_nofail_params(tried)
+
+
+def budget_exhausted(budget: RetryBudget) -> HTTPException:
+    return HTTPException(
+        status_code=504,
+        detail=f"Request timeout of {budget.timeout:g}s ran out. Attempts: {budget.describe()}",
+    )
+
+
+async def create_completion(
+    messages: list[dict],
+    params: CompletionParams,
+    chat: ChatCompletions,
+    budget: RetryBudget | None = None,
+) -> CompletionResponse:
+    """
+    Completes the messages, falling back to other providers in nofail mode, within
+    the time budget of the request (REQUEST_TIMEOUT by default).
+    """
+    if budget is None:
+        budget = RetryBudget(settings.REQUEST_TIMEOUT)
+    model_name, provider_name, nofail = resolve_completion_params(params)
+    tried = {provider_name}
 
     ip_detected_response: CompletionResponse | None = None
-    for attempt in range(10):
-        print(f"Trying model: {model_name} and provider: {provider_name}")
-        try:
-            response = chat.create(
-                model=model_name,
-                provider=provider_name,
-                messages=[msg.model_dump() for msg in completion.messages],
-                stream=False,
-            )
-            if isinstance(response, str):
-                if response.strip() == "" and nofail:
-                    model_name, provider_name = get_nofail_params(attempt)
-                    model_name = get_best_model_for_provider(provider_name)
-                    continue
+    attempts = 0
+    try:
+        for attempt in range(MAX_ATTEMPTS):
+            if attempt > 0 and (budget.exhausted or not await budget.backoff()):
+                raise budget_exhausted(budget)
+            attempts = attempt + 1
+            print(f"Trying model: {model_name} and provider: {provider_name}")
+            # Without fallback, the provider asked for may take all the time left
+            retries_left = MAX_ATTEMPTS - attempts if nofail else 0
+            started = time.monotonic()
+            try:
+                response = await respond(
+                    messages,
+                    model_name,
+                    provider_name,
+                    chat,
+                    timeout=budget.attempt_timeout(retries_left),
+                )
+                if isinstance(response, str):
+                    if response.strip() == "" and nofail:
+                        budget.record(model_name, provider_name, started, "empty")
+                        model_name, provider_name = next_nofail_params(tried)
+                        continue
+
+                    completion_response = CompletionResponse(
+                        completion=adapt_response(model_name, response),
+                        model=model_name,
+                        provider=provider_name,
+                    )
+
+                    # HACK: Workaround for IP ban from some providers
+                    if egress_identity.contains_leak(response):
+                        budget.record(model_name, provider_name, started, "ip_leak")
+                        if ip_detected_response is not None:
+                            ip_detected_response = completion_response
+                        continue
+
+                    budget.record(model_name, provider_name, started, "success")
+                    return completion_response
+
+                raise CustomValidationError(
+                    "Unexpected response type from the provider",
+                    error={"response": str(response)},
+                )
+            except Exception as e:
+                outcome = "timeout" if isinstance(e, TimeoutError) else type(e).__name__
+                budget.record(model_name, provider_name, started, outcome)
+                if not nofail:
+                    if isinstance(e, TimeoutError):
+                        raise budget_exhausted(budget) from e
+                    raise e
+                model_name, provider_name = next_nofail_params(tried)
+
+        # Better than nothing maybe
+        if ip_detected_response is not None:
+            return ip_detected_response
+
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to get a response from the provider. Attempts: {budget.describe()}",
+        )
+    finally:
+        completion_attempts.observe(attempts, "sequential")
+
+
+def get_nofail_candidates(limit: int) -> list[NofailParms]:
+    """
+    Nofail candidates in ranking order with one candidate per provider, since a
+    provider that is down fails for every model and racing it twice is wasted.
+    """
+    candidates = []
+    providers: set[str] = set()
+    for candidate in rank_nofail_candidates():
+        if len(candidates) >= limit:
+            break
+        if candidate.provider in providers:
+            continue
+        providers.add(candidate.provider)
+        candidates.append(candidate)
+    return candidates
+
+
+class HedgedCompletion(NamedTuple):
+    response: CompletionResponse
+    winner: int
+    launched: int
 
-                completion_response = CompletionResponse(
-                    completion=adapt_response(model_name, response),
-                    model=model_name,
-                    provider=provider_name,
+
+async def create_hedged_completion(
+    messages: list[dict], chat: ChatCompletions, budget: RetryBudget | None = None
+) -> HedgedCompletion:
+    """
+    Races the nofail candidates against each other. The next candidate is started
+    when the running ones take longer than HEDGE_DELAY or one of them fails, and
+    the first usable answer wins while the remaining calls are cancelled. Every
+    candidate has to answer before the deadline of the request.
+    """
+    if budget is None:
+        budget = RetryBudget(settings.REQUEST_TIMEOUT)
+    candidates = get_nofail_candidates(settings.HEDGE_MAX_CANDIDATES)
+    pending: dict[asyncio.Task, int] = {}
+    started: list[float] = []
+    launched = 0
+
+    def can_launch() -> bool:
+        return launched < len(candidates) and not budget.exhausted
+
+    def launch() -> None:
+        nonlocal launched
+        candidate = candidates[launched]
+        print(f"Hedging model: {candidate.model} and provider: {candidate.provider}")
+        started.append(time.monotonic())
+        pending[
+            asyncio.create_task(
+                respond(
+                    messages,
+                    candidate.model,
+                    candidate.provider,
+                    chat,
+                    timeout=budget.remaining(),
                 )
+            )
+        ] = launched
+        launched += 1
 
+    def record(index: int, outcome: str) -> None:
+        model_name, provider_name = candidates[index]
+        budget.record(model_name, provider_name, started[index], outcome)
+
+    try:
+        for _ in range(min(settings.HEDGE_FANOUT, len(candidates))):
+            launch()
+        while pending:
+            done, _ = await asyncio.wait(
+                pending,
+                timeout=settings.HEDGE_DELAY if can_launch() else None,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:
+                launch()
+                continue
+            for task in done:
+                index = pending.pop(task)
+                if task.exception() is not None:
+                    logging.warning(
+                        f"Hedged candidate {candidates[index]} failed: {task.exception()}"
+                    )
+                    is_timeout = isinstance(task.exception(), TimeoutError)
+                    record(index, "timeout" if is_timeout else "error")
+                    continue
+                text = task.result()
+                if not isinstance(text, str) or text.strip() == "":
+                    record(index, "empty")
+                    continue
                 # HACK: Workaround for IP ban from some providers
-                ip = get_public_ip()
-                if ip is not None and ip in response.lower():
-                    if ip_detected_response is not None:
-                        ip_detected_response = completion_response
+                if egress_identity.contains_leak(text):
+                    record(index, "ip_leak")
                     continue
+                record(index, "success")
+                model_name, provider_name = candidates[index]
+                completion_attempts.observe(launched, "hedged")
+                return HedgedCompletion(
+                    response=CompletionResponse(
+                        completion=adapt_response(model_name, text),
+                        model=model_name,
+                        provider=provider_name,
+                    ),
+                    winner=index,
+                    launched=launched,
+                )
+            # Replace the candidates that failed without waiting for the delay
+            while len(pending) < settings.HEDGE_FANOUT and can_launch():
+                launch()
+    finally:
+        for task, index in pending.items():
+            task.cancel()
+            record(index, "cancelled")
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    completion_attempts.observe(launched, "hedged")
+    if budget.exhausted:
+        raise budget_exhausted(budget)
+    raise HTTPException(
+        status_code=500,
+        detail=f"Failed to get a response from any of the hedged candidates. Attempts: {budget.describe()}",
+    )
 
-                return completion_response
 
-            raise CustomValidationError(
-                "Unexpected response type from g4f.ChatCompletion.create",
-                error={"response": str(response)},
+async def respond_stream(
+    messages: list[dict],
+    model: str,
+    provider: str,
+    chat: ChatCompletions,
+    first_chunk_timeout: float | None = None,
+) -> AsyncIterator[str]:
+    """
+    Streams from the provider. The provider health is updated once the first chunk
+    arrives, or when the stream fails, times out or turns out empty before that.
+    The history gets the call once the stream is over.
+    """
+    provider_health.begin(provider)
+    started = time.monotonic()
+    ttfb: float | None = None
+    outcome = "empty"
+    try:
+        with provider_calls_in_flight.track():
+            async with (
+                completion_semaphore,
+                asyncio.timeout(first_chunk_timeout) as waiting,
+            ):
+                async for text in ai_stream(messages, model, provider, chat=chat):
+                    if ttfb is None:
+                        ttfb = time.monotonic() - started
+                        # The timeout only bounds the wait for the first chunk
+                        waiting.reschedule(None)
+                        outcome = "success"
+                        provider_health.record_success(provider, model, ttfb)
+                        provider_requests.inc(provider, model, "success")
+                        provider_latency.observe(ttfb, provider, model)
+                    yield text
+        if ttfb is None:
+            provider_health.record_failure(provider, model, "EmptyResponse")
+            provider_requests.inc(provider, model, "empty")
+    except (asyncio.CancelledError, GeneratorExit):
+        if ttfb is None:
+            outcome = "cancelled"
+            provider_health.cancel(provider)
+            provider_requests.inc(provider, model, "cancelled")
+        raise
+    except Exception as e:
+        if ttfb is None:
+            outcome = "timeout" if isinstance(e, TimeoutError) else "error"
+            provider_health.record_failure(provider, model, e)
+            provider_requests.inc(provider, model, outcome)
+        raise
+    finally:
+        provider_history.record(
+            provider, model, outcome, time.monotonic() - started, ttfb=ttfb
+        )
+
+
+class IpLeakDetected(Exception):
+    pass
+
+
+class CompletionStream(NamedTuple):
+    model: str
+    provider: str
+    # Every text chunk of the response, raises IpLeakDetected when one of them
+    # contained a public address of the server
+    chunks: AsyncGenerator[str, None]
+
+
+async def open_completion_stream(
+    messages: list[dict],
+    params: CompletionParams,
+    chat: ChatCompletions,
+    budget: RetryBudget | None = None,
+) -> CompletionStream:
+    """
+    Starts a streamed completion. Falls back to other providers in nofail mode
+    as long as nothing was sent to the client, that is until the first chunk. The
+    time budget bounds the wait for the first chunk, not the stream after it.
+    """
+    if budget is None:
+        budget = RetryBudget(settings.REQUEST_TIMEOUT)
+    model_name, provider_name, nofail = resolve_completion_params(params)
+    tried = {provider_name}
+
+    attempts = 0
+    try:
+        for attempt in range(MAX_ATTEMPTS):
+            if attempt > 0 and (budget.exhausted or not await budget.backoff()):
+                raise budget_exhausted(budget)
+            attempts = attempt + 1
+            print(f"Streaming model: {model_name} and provider: {provider_name}")
+            retries_left = MAX_ATTEMPTS - attempts if nofail else 0
+            started = time.monotonic()
+            chunks = respond_stream(
+                messages,
+                model_name,
+                provider_name,
+                chat,
+                first_chunk_timeout=budget.attempt_timeout(retries_left),
             )
+            leak_scanner = egress_identity.scanner()
+            try:
+                first_chunk = await anext(chunks)
+            except StopAsyncIteration:
+                budget.record(model_name, provider_name, started, "empty")
+                if not nofail:
+                    first_chunk = ""
+                    break
+                model_name, provider_name = next_nofail_params(tried)
+                continue
+            except TimeoutError as e:
+                await chunks.aclose()
+                budget.record(model_name, provider_name, started, "timeout")
+                if not nofail:
+                    raise budget_exhausted(budget) from e
+                model_name, provider_name = next_nofail_params(tried)
+                continue
+            except Exception as e:
+                await chunks.aclose()
+                budget.record(model_name, provider_name, started, type(e).__name__)
+                if not nofail:
+                    raise e
+                model_name, provider_name = next_nofail_params(tried)
+                continue
+
+            if leak_scanner.feed(first_chunk):
+                ip_leak_detections.inc(provider_name)
+                await chunks.aclose()
+                budget.record(model_name, provider_name, started, "ip_leak")
+                if nofail:
+                    model_name, provider_name = next_nofail_params(tried)
+                continue
+            budget.record(model_name, provider_name, started, "success")
+            break
+        else:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Failed to get a response from the provider. Attempts: {budget.describe()}",
+            )
+    finally:
+        completion_attempts.observe(attempts, "stream")
+
+    async def texts() -> AsyncGenerator[str, None]:
+        try:
+            if first_chunk:
+                yield first_chunk
+            async for text in chunks:
+                if leak_scanner.feed(text):
+                    ip_leak_detections.inc(provider_name)
+                    raise IpLeakDetected(provider_name)
+                yield text
+        finally:
+            await chunks.aclose()
+
+    return CompletionStream(model=model_name, provider=provider_name, chunks=texts())
+
+
+async def create_completion_stream(
+    messages: list[dict],
+    params: CompletionParams,
+    chat: ChatCompletions,
+    sse: bool,
+    budget: RetryBudget | None = None,
+) -> StreamingResponse:
+    """Streams a completion as start, chunk and end frames."""
+    stream = await open_completion_stream(messages, params, chat, budget)
+
+    async def body() -> AsyncIterator[bytes]:
+        meta = {"model": stream.model, "provider": stream.provider}
+        yield encode_frame("start", meta, sse)
+        parts = []
+        try:
+            async for text in stream.chunks:
+                parts.append(text)
+                yield encode_frame("chunk", {"content": text}, sse)
+        except (asyncio.CancelledError, GeneratorExit):
+            # The server closes the body when the client goes away
+            client_disconnects.inc("api")
+            raise
+        except IpLeakDetected:
+            yield encode_frame(
+                "error", {"detail": "Response rejected by the server"}, sse
+            )
+            return
         except Exception as e:
-            if not nofail:
-                raise e
-            provider_name = get_nofail_params(attempt).provider
-            model_name = get_best_model_for_provider(provider_name)
+            logging.exception(e)
+            yield encode_frame("error", {"detail": str(e)}, sse)
+            return
+        finally:
+            await stream.chunks.aclose()
+        completion = adapt_response(stream.model, "".join(parts))
+        yield encode_frame("end", {**meta, "completion": completion}, sse)
+
+    return StreamingResponse(
+        body(), media_type=SSE_MEDIA_TYPE if sse else NDJSON_MEDIA_TYPE
+    )
 
-    # Better than nothing maybe
-    if ip_detected_response is not None:
-        return ip_detected_response
 
-    raise HTTPException(
-        status_code=500,
-        detail=f"Failed to get a response from the provider. Last tried model: {model_name} and provider: {provider_name}",
+async def join_flight(
+    key: str, compute: Callable[[], Awaitable[T]], budget: RetryBudget | None = None
+) -> T:
+    """
+    Shares the call with the identical requests in flight. The flight runs within
+    the budget of the request that started it, so a caller joining it waits only
+    until its own deadline.
+
+    Raises:
+        HTTPException: 504 when the deadline of the caller passed first.
+    """
+    if budget is None or key not in completion_flights.flights:
+        return await completion_flights.do(key, compute)
+    deadline = asyncio.timeout(budget.remaining())
+    try:
+        async with deadline:
+            return await completion_flights.do(key, compute)
+    except TimeoutError:
+        if deadline.expired():
+            raise budget_exhausted(budget) from None
+        raise
+
+
+async def create_cached_completion(
+    messages: list[dict],
+    params: CompletionParams,
+    cache_control: str | None,
+    compute: Callable[[], Awaitable[CompletionResponse]],
+    coalesce: bool = False,
+    budget: RetryBudget | None = None,
+) -> tuple[CompletionResponse, str | None]:
+    """
+    Serves the completion from the response cache when it is enabled and allowed by
+    the Cache-Control header of the request. With coalesce, identical requests in
+    flight at the same time share one upstream call, each waiting for it within its
+    own budget. Returns the completion and the cache status for the X-Cache header,
+    None when the cache is disabled.
+    """
+    key = completion_cache_key(messages, params.model, params.provider)
+    if coalesce:
+        compute = partial(join_flight, key, compute, budget)
+    if not settings.CACHE_ENABLED:
+        return await compute(), None
+
+    policy = CachePolicy.from_header(cache_control)
+    if policy.read:
+        cached = response_cache.get(key)
+        if cached is not None:
+            return cached, "HIT"
+
+    completion = await compute()
+    # Never keep empty answers or answers that leaked our IP around
+    text = completion.completion
+    if policy.store and text.strip() and not egress_identity.contains_leak(text):
+        response_cache.put(key, completion, policy.ttl)
+    return completion, "MISS" if policy.read else "BYPASS"
+
+
+@router_api.post("/completions")
+async def post_completion(
+    request: Request,
+    response: Response,
+    completion: CompletionRequest,
+    admission: Admission = Depends(admit_completion),
+    params: CompletionParams = Depends(),
+    chat: ChatCompletions = Depends(chat_completion),
+    budget: RetryBudget = Depends(request_budget),
+    stream: bool = Query(
+        False,
+        description="Stream the completion as it is generated. Frames are sent as Server-Sent Events if the Accept header asks for text/event-stream, otherwise as NDJSON.",
+    ),
+    hedge: bool = Query(
+        False,
+        description="When neither model nor provider is given, race the best candidates against each other instead of trying them one after another. The winning candidate is reported in the X-Hedge-Winner header.",
+    ),
+) -> CompletionResponse:
+    messages = [msg.model_dump() for msg in completion.messages]
+    if stream:
+        # Until the first chunk, then the server notices the disconnect itself
+        stream_response = await cancel_on_disconnect(
+            request,
+            create_completion_stream(
+                messages,
+                params,
+                chat,
+                sse=wants_sse(request.headers.get("accept")),
+                budget=budget,
+            ),
+            "api",
+        )
+        return admission.hold(stream_response)
+
+    hedged_mode = hedge and params.model is None and params.provider is None
+    hedged: HedgedCompletion | None = None
+
+    async def compute() -> CompletionResponse:
+        nonlocal hedged
+        if not hedged_mode:
+            return await create_completion(messages, params, chat, budget)
+        run = partial(create_hedged_completion, messages, chat, budget)
+        if settings.SINGLE_FLIGHT_API:
+            # Only shared with other hedged requests, each gets the hedge metadata
+            key = f"hedged:{completion_cache_key(messages, None, None)}"
+            hedged = await join_flight(key, run, budget)
+        else:
+            hedged = await run()
+        return hedged.response
+
+    with completions_in_flight.track("api"):
+        completion_response, cache_status = await cancel_on_disconnect(
+            request,
+            create_cached_completion(
+                messages,
+                params,
+                request.headers.get("cache-control"),
+                compute,
+                coalesce=settings.SINGLE_FLIGHT_API and not hedged_mode,
+                budget=budget,
+            ),
+            "api",
+        )
+    if hedged is not None:
+        response.headers["X-Hedge-Winner"] = str(hedged.winner)
+        response.headers["X-Hedge-Launched"] = str(hedged.launched)
+    if cache_status is not None:
+        response.headers["X-Cache"] = cache_status
+    return completion_response
+
+
+async def complete_batch_item(
+    index: int, item: BatchCompletionItem, chat: ChatCompletions
+) -> dict:
+    """Completes one item of a batch, turning its errors into a result as well."""
+    try:
+        params = CompletionParams(model=item.model, provider=item.provider)
+        messages = [msg.model_dump() for msg in item.messages]
+        completion, _ = await create_cached_completion(
+            messages,
+            params,
+            None,
+            lambda: create_completion(messages, params, chat),
+            coalesce=settings.SINGLE_FLIGHT_API,
+        )
+    except CustomValidationError as e:
+        return {
+            "index": index,
+            "error": {"status_code": 422, "detail": str(e), "error": e.error},
+        }
+    except HTTPException as e:
+        return {
+            "index": index,
+            "error": {"status_code": e.status_code, "detail": e.detail},
+        }
+    except Exception as e:
+        logging.exception(e)
+        return {"index": index, "error": {"status_code": 500, "detail": str(e)}}
+    return {"index": index, "completion": completion.model_dump()}
+
+
+async def stream_batch(
+    items: list[BatchCompletionItem],
+    chat: ChatCompletions,
+    concurrency: int,
+    sse: bool,
+) -> AsyncIterator[bytes]:
+    """Yields a result frame per item in the order the items finish."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(index: int, item: BatchCompletionItem) -> dict:
+        # Every running item counts against the in flight cap like a request
+        try:
+            async with semaphore, admission_slot():
+                return await complete_batch_item(index, item, chat)
+        except AdmissionRejected as e:
+            admission_rejections.inc(e.reason)
+            return {
+                "index": index,
+                "error": {
+                    "status_code": 429,
+                    "detail": f"Too many requests ({e.reason}), retry later",
+                },
+            }
+
+    tasks = [asyncio.ensure_future(run(i, item)) for i, item in enumerate(items)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield encode_frame("result", await next_done, sse)
+    except (asyncio.CancelledError, GeneratorExit):
+        # The client went away, nobody is going to read the remaining results
+        if not all(task.done() for task in tasks):
+            client_disconnects.inc("batch")
+        raise
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+@router_api.post("/completions/batch")
+async def post_completion_batch(
+    request: Request,
+    items: list[BatchCompletionItem],
+    _: Admission = Depends(admit_completion),
+    chat: ChatCompletions = Depends(chat_completion),
+    concurrency: int = Query(
+        settings.BATCH_CONCURRENCY,
+        ge=1,
+        le=settings.BATCH_MAX_CONCURRENCY,
+        description="Items completed at the same time.",
+    ),
+) -> StreamingResponse:
+    """
+    Completes independent conversations concurrently. Each result is streamed as
+    soon as it is ready, as a NDJSON line (or Server-Sent Event if the Accept
+    header asks for text/event-stream) with the index of its item and either the
+    completion or the error of that item.
+
+    Each item costs a token of the rate limit of the client and holds a slot of
+    the in flight cap while it runs, the slot of the request itself is given back
+    once the response starts.
+    """
+    max_items = settings.BATCH_MAX_ITEMS
+    if settings.RATE_LIMIT_PER_MINUTE > 0:
+        max_items = min(max_items, int(settings.RATE_LIMIT_BURST))
+    if len(items) > max_items:
+        raise CustomValidationError(
+            f"Batch of {len(items)} items is larger than {max_items}",
+            error={},
+        )
+    # admit_completion already took the token of the first item
+    charge_rate_limit(request, len(items) - 1)
+    sse = wants_sse(request.headers.get("accept"))
+    return StreamingResponse(
+        stream_batch(items, chat, concurrency, sse),
+        media_type=SSE_MEDIA_TYPE if sse else NDJSON_MEDIA_TYPE,
     )
 
 
-@router_api.get("/providers")
-def get_list_providers():
-    return provider_and_models.all_working_providers_map
+def get_session_or_404(session_id: str) -> Session:
+    session = session_store.get(session_id)
+    if session is None:
+        raise HTTPException(
+            status_code=404, detail=f"Session not found or expired: {session_id}"
+        )
+    return session
+
 
+@router_api.post("/sessions", status_code=201)
+async def post_session(request: SessionRequest | None = None) -> SessionResponse:
+    """Starts a conversation held by the server, optionally with earlier messages."""
+    messages = [msg.model_dump() for msg in request.messages] if request else []
+    session = session_store.create(messages)
+    return SessionResponse(session_id=session.id, messages=session.messages)
 
-@router_api.get("/models")
-def get_list_models():
-    return provider_and_models.all_models_map
+
+@router_api.get("/sessions/{session_id}")
+async def get_session(session_id: str) -> SessionResponse:
+    session = get_session_or_404(session_id)
+    return SessionResponse(session_id=session.id, messages=session.messages)
+
+
+@router_api.delete("/sessions/{session_id}", status_code=204)
+async def delete_session(session_id: str) -> None:
+    if not session_store.delete(session_id):
+        raise HTTPException(
+            status_code=404, detail=f"Session not found or expired: {session_id}"
+        )
+
+
+@router_api.post(
+    "/sessions/{session_id}/completions", dependencies=[Depends(admit_completion)]
+)
+async def post_session_completion(
+    request: Request,
+    response: Response,
+    session_id: str,
+    message: SessionMessageRequest,
+    params: CompletionParams = Depends(),
+    chat: ChatCompletions = Depends(chat_completion),
+) -> SessionCompletionResponse:
+    """
+    Continues the conversation of the session. Only the new message is sent, the
+    earlier ones come from the session, which is then extended with the message
+    and its completion.
+    """
+    session = get_session_or_404(session_id)
+    messages = session.messages + [{"role": "user", "content": message.content}]
+    with completions_in_flight.track("session"):
+        completion, cache_status = await cancel_on_disconnect(
+            request,
+            create_cached_completion(
+                messages,
+                params,
+                request.headers.get("cache-control"),
+                lambda: create_completion(messages, params, chat),
+                coalesce=settings.SINGLE_FLIGHT_API,
+            ),
+            "session",
+        )
+    session_store.save(
+        session, messages + [{"role": "assistant", "content": completion.completion}]
+    )
+    if cache_status is not None:
+        response.headers["X-Cache"] = cache_status
+    return SessionCompletionResponse(session_id=session.id, **completion.model_dump())
+
+
+providers_adapter = TypeAdapter(dict[str, CompletionProvider])
+models_adapter = TypeAdapter(dict[str, CompletionModel])
+
+
+@lru_cache(maxsize=256)
+def render_providers(catalog: Catalog, model: str | None) -> RenderedBody:
+    names = catalog.all_working_provider_names
+    if model is not None:
+        names = catalog.routing.model_providers.get(model, ())
+    providers = {name: catalog.all_working_providers_map[name] for name in names}
+    return render_json(providers_adapter.dump_json(providers), catalog.created_at)
+
+
+@lru_cache(maxsize=256)
+def render_models(catalog: Catalog, provider: str | None) -> RenderedBody:
+    names = catalog.all_model_names
+    if provider is not None:
+        names = catalog.routing.provider_models[provider]
+    models = {
+        name: catalog.all_models_map[name]
+        for name in names
+        if name in catalog.all_models_map
+    }
+    return render_json(models_adapter.dump_json(models), catalog.created_at)
+
+
+@router_api.get(
+    "/providers",
+    response_model=dict[str, CompletionProvider],
+    response_class=JSONResponse,
+)
+def get_list_providers(
+    request: Request,
+    model: str | None = Query(
+        None, description="Only list the providers supporting this model."
+    ),
+) -> Response:
+    """
+    Working providers, rendered once per catalog update. Send the ETag back in
+    If-None-Match to get a 304 when nothing changed.
+    """
+    catalog = provider_and_models.catalog
+    allowed_values_or_none(model, catalog.routing.model_names)
+    return rendered_response(request, render_providers(catalog, model))
+
+
+@router_api.get("/providers/{name}/stats", response_model=ProviderStats)
+def get_provider_stats(
+    name: str,
+    model: str | None = Query(
+        None, description="Only count the calls to this model of the provider."
+    ),
+    window: list[float] = Query(
+        [60, 300, 3600], description="Windows to compute the stats over, in seconds."
+    ),
+) -> ProviderStats:
+    """
+    Success rate and latency percentiles of the recent calls to a provider, from
+    the bounded history this worker keeps.
+    """
+    if (
+        name not in get_provider_graph().providers
+        and name not in provider_history.providers
+    ):
+        raise HTTPException(status_code=404, detail=f"Provider {name} not found")
+    invalid = [w for w in window if not 0 < w <= settings.HISTORY_MAX_WINDOW]
+    if invalid:
+        raise CustomValidationError(
+            f"Windows must be between 0 and {settings.HISTORY_MAX_WINDOW:g} seconds",
+            error={"window": [f"{w:g}" for w in invalid]},
+        )
+    now = time.time()
+    return ProviderStats(
+        provider=name,
+        model=model,
+        windows=[provider_history.stats(name, model, w, now=now) for w in window],
+    )
+
+
+@router_api.get(
+    "/models", response_model=dict[str, CompletionModel], response_class=JSONResponse
+)
+def get_list_models(
+    request: Request,
+    provider: str | None = Query(
+        None, description="Only list the models supported by this provider."
+    ),
+) -> Response:
+    """
+    Known models, rendered once per catalog update. Send the ETag back in
+    If-None-Match to get a 304 when nothing changed.
+    """
+    catalog = provider_and_models.catalog
+    allowed_values_or_none(provider, catalog.routing.provider_names)
+    return rendered_response(request, render_models(catalog, provider))
+
+
+@router_root.get("/metrics", response_class=PlainTextResponse)
+def get_metrics() -> PlainTextResponse:
+    """Counters, gauges and histograms in the Prometheus text format."""
+    return PlainTextResponse(registry.render(), media_type=PROMETHEUS_MEDIA_TYPE)
 
 
 @router_api.get("/health")
 def get_health_check():
-    return {"status": "ok"}
+    return {"status": "ok", "startup_phases": startup_timer.phases}
+
+
+### OpenAI compatible routes
+
+
+def openai_completion_params(request: OpenAIChatCompletionRequest) -> CompletionParams:
+    model = request.model or None
+    if model is not None and model not in provider_and_models.routing.model_names:
+        raise HTTPException(
+            status_code=404, detail=f"The model `{model}` does not exist"
+        )
+    return CompletionParams(model=model, provider=request.provider)
+
+
+def openai_chunk(
+    completion_id: str,
+    created: int,
+    stream: CompletionStream,
+    delta: dict,
+    finish_reason: str | None = None,
+) -> bytes:
+    chunk = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": stream.model,
+        "provider": stream.provider,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode()
+
+
+def openai_stream_error(message: str) -> bytes:
+    error = {"message": message, "type": "server_error", "param": None, "code": None}
+    return f"data: {json.dumps({'error': error})}\n\n".encode()
+
+
+async def create_openai_stream(
+    messages: list[dict], params: CompletionParams, chat: ChatCompletions
+) -> StreamingResponse:
+    """Streams chat.completion.chunk events ended by [DONE], as OpenAI does."""
+    stream = await open_completion_stream(messages, params, chat)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+
+    async def body() -> AsyncIterator[bytes]:
+        yield openai_chunk(
+            completion_id, created, stream, {"role": "assistant", "content": ""}
+        )
+        try:
+            async for text in stream.chunks:
+                yield openai_chunk(completion_id, created, stream, {"content": text})
+        except (asyncio.CancelledError, GeneratorExit):
+            client_disconnects.inc("openai")
+            raise
+        except IpLeakDetected:
+            yield openai_stream_error("Response rejected by the server")
+            return
+        except Exception as e:
+            logging.exception(e)
+            yield openai_stream_error(str(e))
+            return
+        finally:
+            await stream.chunks.aclose()
+        yield openai_chunk(completion_id, created, stream, {}, finish_reason="stop")
+        yield b"data: [DONE]\n\n"
+
+    return StreamingResponse(body(), media_type=SSE_MEDIA_TYPE)
+
+
+@router_openai.post(
+    "/chat/completions",
+    response_model=OpenAIChatCompletion,
+)
+async def post_openai_chat_completion(
+    request: Request,
+    completion: OpenAIChatCompletionRequest,
+    admission: Admission = Depends(admit_completion),
+    chat: ChatCompletions = Depends(chat_completion),
+):
+    """
+    Chat completions in the shape of the OpenAI API, so OpenAI SDKs can use this
+    server as their base URL. An empty model picks the best available one.
+    """
+    params = openai_completion_params(completion)
+    messages = [
+        {"role": message.role, "content": message.text()}
+        for message in completion.messages
+    ]
+    if completion.stream:
+        stream_response = await cancel_on_disconnect(
+            request, create_openai_stream(messages, params, chat), "openai"
+        )
+        return admission.hold(stream_response)
+
+    with completions_in_flight.track("openai"):
+        completion_response, _ = await cancel_on_disconnect(
+            request,
+            create_cached_completion(
+                messages,
+                params,
+                request.headers.get("cache-control"),
+                lambda: create_completion(messages, params, chat),
+                coalesce=settings.SINGLE_FLIGHT_API,
+            ),
+            "openai",
+        )
+    return OpenAIChatCompletion(
+        id=f"chatcmpl-{uuid.uuid4().hex}",
+        created=int(time.time()),
+        model=completion_response.model,
+        provider=completion_response.provider,
+        choices=[
+            OpenAIChoice(
+                message=OpenAIChatMessage(content=completion_response.completion)
+            )
+        ],
+    )
+
+
+@lru_cache(maxsize=4)
+def render_openai_models(catalog: Catalog) -> RenderedBody:
+    created = int(catalog.created_at)
+    models = {
+        "object": "list",
+        "data": [
+            {"id": name, "object": "model", "created": created, "owned_by": "g4f"}
+            for name in catalog.all_model_names
+        ],
+    }
+    return render_json(json.dumps(models).encode(), catalog.created_at)
+
+
+@router_openai.get("/models")
+def get_openai_models(request: Request) -> Response:
+    """Known models in the shape of the OpenAI API."""
+    return rendered_response(request, render_openai_models(provider_and_models.catalog))
 
 
 ### UI routes
 
 templates = Jinja2Templates(directory=TEMPLATES_PATH)
+# Compiled once, streams render them without going through TemplateResponse
+message_template = templates.get_template("messages.html")
+stream_template = templates.get_template("stream.html")
 
 
 @router_ui.get("/")
@@ -200,23 +1234,144 @@ def get_ui(request: Request) -> HTMLResponse:
     )
 
 
-@router_ui.post("/completions")
-def get_completions(
+@router_ui.post("/completions", dependencies=[Depends(admit_completion)])
+async def get_completions(
     request: Request,
     payload: UiCompletionRequest,
-    chat: type[g4f.ChatCompletion] = Depends(chat_completion),
+    chat: ChatCompletions = Depends(chat_completion),
 ) -> HTMLResponse:
     user_request = Message(role="user", content=payload.message)
-    completion = post_completion(
-        CompletionRequest(messages=payload.history + [user_request]),
-        CompletionParams(model=payload.model, provider=payload.provider),
-        chat=chat,
-    )
+    # Once the page has a session it no longer sends the history. Should the
+    # session have expired, the conversation starts over.
+    session = session_store.get(payload.session_id) if payload.session_id else None
+    if session is not None:
+        history = session.messages
+    else:
+        history = [msg.model_dump() for msg in payload.history]
+    messages = history + [user_request.model_dump()]
+    params = CompletionParams(model=payload.model, provider=payload.provider)
+    with completions_in_flight.track("ui"):
+        completion, cache_status = await cancel_on_disconnect(
+            request,
+            create_cached_completion(
+                messages,
+                params,
+                request.headers.get("cache-control"),
+                lambda: create_completion(messages, params, chat=chat),
+                coalesce=settings.SINGLE_FLIGHT_UI,
+            ),
+            "ui",
+        )
     bot_response = Message(role="assistant", content=completion.completion)
-    return templates.TemplateResponse(
+    if session is None:
+        session = session_store.create()
+    session_store.save(session, messages + [bot_response.model_dump()])
+    response = templates.TemplateResponse(
         name="messages.html",
         request=request,
         context={
             "messages": [user_request, bot_response],
         },
     )
+    response.headers["X-Session-Id"] = session.id
+    if cache_status is not None:
+        response.headers["X-Cache"] = cache_status
+    return response
+
+
+@router_ui.post("/completions/stream")
+async def post_ui_completion_stream(payload: UiCompletionRequest) -> HTMLResponse:
+    """
+    Adds the user message to the session of the page and renders it right away,
+    followed by a placeholder the assistant message streams into over SSE.
+    """
+    params = CompletionParams(model=payload.model, provider=payload.provider)
+    user_request = Message(role="user", content=payload.message)
+    session = session_store.get(payload.session_id) if payload.session_id else None
+    if session is None:
+        session = session_store.create([msg.model_dump() for msg in payload.history])
+    session_store.save(session, session.messages + [user_request.model_dump()])
+
+    query = urlencode(
+        {
+            name: value
+            for name, value in [("model", params.model), ("provider", params.provider)]
+            if value is not None
+        }
+    )
+    stream_url = f"{router_ui.prefix}/sessions/{session.id}/stream"
+    if query:
+        stream_url += f"?{query}"
+    response = HTMLResponse(
+        stream_template.render(messages=[user_request], stream_url=stream_url)
+    )
+    response.headers["X-Session-Id"] = session.id
+    return response
+
+
+def render_stream_end(content: str, error: bool = False) -> bytes:
+    message = Message(role="assistant", content=content)
+    stream_end = "error" if error else "completion"
+    return encode_sse_html(
+        "error" if error else "end",
+        message_template.render(messages=[message], stream_end=stream_end),
+    )
+
+
+@router_ui.get("/sessions/{session_id}/stream")
+async def get_ui_completion_stream(
+    session_id: str,
+    admission: Admission = Depends(admit_completion),
+    params: CompletionParams = Depends(),
+    chat: ChatCompletions = Depends(chat_completion),
+) -> Response:
+    """
+    Streams the answer to the last message of the session as HTML fragments for the
+    htmx SSE extension: escaped text chunks, then the complete message rendered
+    from messages.html, which replaces the streamed one.
+    """
+    session = session_store.get(session_id)
+    if (
+        session is None
+        or not session.messages
+        or session.messages[-1]["role"] != "user"
+    ):
+        # Nothing to answer, e.g. the browser reconnecting after the end. A 204
+        # stops EventSource from reconnecting again.
+        return Response(status_code=204)
+    messages = session.messages
+
+    async def body() -> AsyncIterator[bytes]:
+        parts = []
+        with completions_in_flight.track("ui"):
+            try:
+                stream = await open_completion_stream(messages, params, chat)
+                try:
+                    async for text in stream.chunks:
+                        parts.append(text)
+                        yield encode_sse_html("chunk", html.escape(text))
+                finally:
+                    await stream.chunks.aclose()
+            except (asyncio.CancelledError, GeneratorExit):
+                client_disconnects.inc("ui")
+                session_store.save(session, messages[:-1])
+                raise
+            except Exception as e:
+                if isinstance(e, IpLeakDetected):
+                    detail = "Response rejected by the server"
+                elif isinstance(e, HTTPException):
+                    detail = str(e.detail)
+                else:
+                    logging.exception(e)
+                    detail = str(e)
+                # The message stays unanswered, take it back out of the session
+                session_store.save(session, messages[:-1])
+                yield render_stream_end(f"Error: {detail}", error=True)
+                return
+        completion = adapt_response(stream.model, "".join(parts))
+        session_store.save(
+            session, messages + [{"role": "assistant", "content": completion}]
+        )
+        yield render_stream_end(completion)
+
+    return admission.hold(StreamingResponse(body(), media_type=SSE_MEDIA_TYPE))
@@ -3,6 +3,7 @@ import logging
 
 from hypercorn.asyncio import serve
 from hypercorn.config import Config
+from hypercorn.run import run
 
 from backend import app
 from backend.settings import settings
@@ -13,11 +14,18 @@ if __name__ == "__main__":
     config.use_reloader = settings.RELOAD
     config.worker_class = "asyncio"
     config.keep_alive_timeout = 30
-    config.workers = 1
+    config.workers = settings.WORKERS
     config.access_log_format = "%(R)s %(s)s %(st)s %(D)s %({Header}o)s"
     config.accesslog = logging.getLogger("main")
     config.loglevel = "INFO" if not settings.DEBUG else "DEBUG"
 
     logging.getLogger("main").setLevel(config.loglevel)
 
+    if settings.WORKERS > 1:
+        if not settings.SHARED_STATE_PATH:
+            raise SystemExit("SHARED_STATE_PATH is required with more than one worker")
+        # Every worker process imports the app by itself
+        config.application_path = "backend:app"
+        raise SystemExit(run(config))
+
     asyncio.run(serve(app, config))
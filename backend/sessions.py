@@ -0,0 +1,144 @@
+# Description: Conversations held by the server, so clients only send the newest message of each turn.
+
+import json
+import os
+import sqlite3
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from backend.settings import settings
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    updated_at REAL NOT NULL,
+    messages TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at);
+"""
+
+
+@dataclass
+class Session:
+    id: str
+    messages: list[dict] = field(default_factory=list)
+    updated_at: float = field(default_factory=time.time)
+
+
+@dataclass
+class SessionStore:
+    """
+    Sessions in memory, least recently used first out once there are more than
+    max_sessions. Sessions idle for longer than ttl seconds expire, and only the
+    last max_messages messages of a session are kept.
+
+    With a path, sessions are also written to a SQLite database. They then survive
+    restarts, are shared by the workers, and memory only caches them. The SQLite
+    connection belongs to the thread opening it, so the store is only used from
+    the event loop: the routes and tasks using it are async.
+    """
+
+    max_sessions: int
+    ttl: float
+    max_messages: int
+    path: str | None = None
+    sessions: OrderedDict[str, Session] = field(default_factory=OrderedDict)
+    _connection: sqlite3.Connection | None = field(default=None, repr=False)
+
+    @property
+    def connection(self) -> sqlite3.Connection | None:
+        if self.path is not None and self._connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=5)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def create(self, messages: list[dict] | None = None) -> Session:
+        session = Session(id=uuid.uuid4().hex)
+        self.save(session, messages or [])
+        return session
+
+    def get(self, session_id: str) -> Session | None:
+        session = self.sessions.get(session_id)
+        if self.connection is not None:
+            session = self._load(session_id, cached=session)
+        if session is None:
+            return None
+        if time.time() - session.updated_at > self.ttl:
+            self.delete(session_id)
+            return None
+        self._cache(session)
+        return session
+
+    def save(self, session: Session, messages: list[dict]) -> None:
+        """Replaces the messages of the session, keeping the newest ones."""
+        session.messages = messages[-self.max_messages :]
+        session.updated_at = time.time()
+        self._cache(session)
+        if self.connection is not None:
+            with self.connection as connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO sessions (id, updated_at, messages) VALUES (?, ?, ?)",
+                    (session.id, session.updated_at, json.dumps(session.messages)),
+                )
+
+    def delete(self, session_id: str) -> bool:
+        found = self.sessions.pop(session_id, None) is not None
+        if self.connection is not None:
+            with self.connection as connection:
+                cursor = connection.execute(
+                    "DELETE FROM sessions WHERE id = ?", (session_id,)
+                )
+                found = found or cursor.rowcount > 0
+        return found
+
+    def purge_expired(self) -> None:
+        expired_before = time.time() - self.ttl
+        for session_id in [
+            session.id
+            for session in self.sessions.values()
+            if session.updated_at < expired_before
+        ]:
+            del self.sessions[session_id]
+        if self.connection is not None:
+            with self.connection as connection:
+                connection.execute(
+                    "DELETE FROM sessions WHERE updated_at < ?", (expired_before,)
+                )
+
+    def _cache(self, session: Session) -> None:
+        self.sessions[session.id] = session
+        self.sessions.move_to_end(session.id)
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+
+    def _load(self, session_id: str, cached: Session | None) -> Session | None:
+        """Reads the session from the database unless the cached copy is current."""
+        row = self.connection.execute(
+            "SELECT updated_at FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            self.sessions.pop(session_id, None)
+            return None
+        if cached is not None and cached.updated_at == row[0]:
+            return cached
+        (messages,) = self.connection.execute(
+            "SELECT messages FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        return Session(id=session_id, messages=json.loads(messages), updated_at=row[0])
+
+
+session_store = SessionStore(
+    max_sessions=settings.SESSIONS_MAX,
+    ttl=settings.SESSION_TTL,
+    max_messages=settings.SESSION_MAX_MESSAGES,
+    path=settings.SESSIONS_PATH,
+)
@@ -7,6 +7,106 @@ class Settings(BaseSettings):
     RELOAD: bool = False
     CHECK_WORKING_PROVIDERS: bool = True
     DEBUG: bool = False
+    WORKERS: int = 1
+    # SQLite database the workers share probe results and provider health through,
+    # required when running more than one worker. Only the worker holding the lock
+    # file next to it probes providers, the others sync every few seconds.
+    SHARED_STATE_PATH: str | None = None
+    SHARED_STATE_SYNC_SECONDS: int = 5
+    # Upper bound of upstream provider calls in flight at the same time
+    MAX_CONCURRENT_COMPLETIONS: int = 512
+    # Pooled g4f clients, one per provider: most clients kept and seconds an unused
+    # one is kept. Providers built on aiohttp that take a connector share one, with
+    # at most POOL_CONNECTIONS connections (POOL_CONNECTIONS_PER_HOST per host), idle
+    # connections closed after POOL_KEEPALIVE seconds and DNS cached POOL_DNS_TTL.
+    POOL_MAX_CLIENTS: int = 256
+    POOL_IDLE_TIMEOUT: float = 10 * 60
+    POOL_CONNECTIONS: int = 100
+    POOL_CONNECTIONS_PER_HOST: int = 10
+    POOL_KEEPALIVE: float = 30.0
+    POOL_DNS_TTL: int = 5 * 60
+    # History of provider calls and probes: events kept per provider and per provider
+    # and model, and most provider and model pairs kept
+    HISTORY_PROVIDER_SIZE: int = 4096
+    HISTORY_MODEL_SIZE: int = 512
+    HISTORY_MAX_SERIES: int = 2048
+    # Longest window /api/providers/{name}/stats looks back over, in seconds
+    HISTORY_MAX_WINDOW: float = 24 * 60 * 60
+    # Time budget of a completion request in seconds, clients may ask for another one
+    # with the X-Request-Timeout header up to REQUEST_TIMEOUT_MAX. When there are
+    # fallbacks, an attempt gets ATTEMPT_TIMEOUT_SHARE of the time left but at least
+    # ATTEMPT_TIMEOUT_MIN, and the next one starts after a jittered backoff growing
+    # from RETRY_BACKOFF_BASE up to RETRY_BACKOFF_MAX seconds.
+    REQUEST_TIMEOUT: float = 120.0
+    REQUEST_TIMEOUT_MAX: float = 600.0
+    ATTEMPT_TIMEOUT_SHARE: float = 0.5
+    ATTEMPT_TIMEOUT_MIN: float = 2.0
+    RETRY_BACKOFF_BASE: float = 0.05
+    RETRY_BACKOFF_MAX: float = 1.0
+    # Hedged nofail completions: seconds to wait before racing the next candidate,
+    # candidates started at once and total candidates tried per request
+    HEDGE_DELAY: float = 3.0
+    HEDGE_FANOUT: int = 1
+    HEDGE_MAX_CANDIDATES: int = 4
+    # Provider health: weight of the newest call in the decaying averages, latency
+    # in seconds that halves a provider score, and circuit breaker thresholds
+    HEALTH_EWMA_ALPHA: float = 0.3
+    HEALTH_DEFAULT_LATENCY: float = 5.0
+    CIRCUIT_FAILURE_THRESHOLD: int = 3
+    CIRCUIT_OPEN_SECONDS: float = 30.0
+    # Per client token buckets on the completion routes, disabled when the rate is 0.
+    # Clients are told apart by RATE_LIMIT_KEY_HEADER, or by address without it.
+    RATE_LIMIT_PER_MINUTE: float = 0.0
+    RATE_LIMIT_BURST: float = 10.0
+    RATE_LIMIT_KEY_HEADER: str = "X-API-Key"
+    RATE_LIMIT_MAX_CLIENTS: int = 10_000
+    # Completion requests handled at once, requests allowed to wait for a slot and
+    # how long they wait before being rejected with 429
+    ADMISSION_MAX_IN_FLIGHT: int = 256
+    ADMISSION_QUEUE_SIZE: int = 256
+    ADMISSION_QUEUE_TIMEOUT: float = 10.0
+    # Batch completions: most items per batch and items completed at the same time,
+    # by default and at most when the client asks for more
+    BATCH_MAX_ITEMS: int = 1000
+    BATCH_CONCURRENCY: int = 8
+    BATCH_MAX_CONCURRENCY: int = 32
+    # Server-side conversation sessions: most sessions kept in memory, seconds an
+    # idle session lives and messages kept per session. With SESSIONS_PATH they are
+    # also stored in a SQLite database, surviving restarts and shared by workers.
+    SESSIONS_MAX: int = 10_000
+    SESSION_TTL: float = 24 * 60 * 60
+    SESSION_MAX_MESSAGES: int = 200
+    SESSIONS_PATH: str | None = None
+    # Exact-match response cache, disabled unless CACHE_ENABLED is set
+    CACHE_ENABLED: bool = False
+    CACHE_TTL: float = 300.0
+    CACHE_MAX_ENTRIES: int = 1024
+    CACHE_MAX_BYTES: int = 16 * 1024 * 1024
+    # Coalesce identical concurrent completions into one upstream call, per route
+    SINGLE_FLIGHT_API: bool = True
+    SINGLE_FLIGHT_UI: bool = True
+    SINGLE_FLIGHT_MAX_WAITERS: int = 64
+    # Public addresses that must never show up in responses. They are looked up in
+    # the background through every proxy, EGRESS_IPS are added as they are.
+    EGRESS_IP_LOOKUP_URLS: list[str] = ["https://api.ipify.org?format=json"]
+    EGRESS_PROXIES: list[str] = []
+    EGRESS_IPS: list[str] = []
+    EGRESS_LOOKUP_TIMEOUT: float = 5.0
+    EGRESS_REFRESH_SECONDS: int = 10 * 60
+    # Provider probes: how often due probes are looked for, bounds of the interval
+    # between two probes of a provider (lower for failing providers, so recoveries
+    # are noticed soon) and the relative jitter applied to it
+    PROBE_TICK_SECONDS: int = 10
+    PROBE_MIN_INTERVAL: float = 5 * 60
+    PROBE_MAX_INTERVAL: float = 4 * 60 * 60
+    PROBE_FAILED_MAX_INTERVAL: float = 15 * 60
+    PROBE_JITTER: float = 0.2
+    PROBE_CONCURRENCY: int = 8
+    PROBE_TIMEOUT: float = 5.0
+    # File keeping the latest probe results across restarts, disabled when empty.
+    # Snapshots older than SNAPSHOT_MAX_AGE seconds are ignored.
+    SNAPSHOT_PATH: str | None = None
+    SNAPSHOT_MAX_AGE: float = 6 * 60 * 60
     model_config = SettingsConfigDict(
         env_file=".env",
         env_file_encoding="utf-8",
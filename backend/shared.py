@@ -0,0 +1,135 @@
+# Description: State shared by the worker processes of one server and election of the probe leader.
+
+import fcntl
+import json
+import os
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from typing import Any
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS probes (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS health (
+    provider TEXT PRIMARY KEY,
+    worker INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    data TEXT NOT NULL
+);
+"""
+
+
+@dataclass
+class LeaderLock:
+    """
+    Exclusive lock on a file, held by at most one process. The operating system
+    releases it when its holder exits, so another worker can take over.
+    """
+
+    path: str
+    _fd: int | None = field(default=None, repr=False)
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self) -> bool:
+        if self._fd is not None:
+            return True
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self) -> None:
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+
+@dataclass
+class SharedState:
+    """
+    SQLite database the workers exchange probe results and provider health through.
+
+    Probe results are written by the leader only and carry a version, so followers
+    apply them once per change. Health is last writer wins per provider: each worker
+    writes the providers it saw calls to and reads what the others wrote since.
+    Like the connection, it is only used from the event loop.
+    """
+
+    path: str
+    worker: int = field(default_factory=os.getpid)
+    probes_version: int = 0
+    health_read_at: float = 0.0
+    _connection: sqlite3.Connection | None = field(default=None, repr=False)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=5)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def publish_probes(self, data: dict[str, Any]) -> None:
+        with self.connection as connection:
+            connection.execute(
+                "INSERT INTO probes (id, version, data) VALUES (1, 1, ?) "
+                "ON CONFLICT (id) DO UPDATE SET version = version + 1, data = excluded.data",
+                (json.dumps(data),),
+            )
+            (self.probes_version,) = connection.execute(
+                "SELECT version FROM probes WHERE id = 1"
+            ).fetchone()
+
+    def read_probes(self) -> dict[str, Any] | None:
+        """Probe results published since the last call, None if there are none."""
+        row = self.connection.execute(
+            "SELECT version, data FROM probes WHERE id = 1 AND version != ?",
+            (self.probes_version,),
+        ).fetchone()
+        if row is None:
+            return None
+        self.probes_version = row[0]
+        return json.loads(row[1])
+
+    def publish_health(self, providers: dict[str, dict[str, Any]]) -> None:
+        if not providers:
+            return
+        now = time.time()
+        with self.connection as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO health (provider, worker, updated_at, data) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (provider, self.worker, now, json.dumps(data))
+                    for provider, data in providers.items()
+                ],
+            )
+
+    def read_health(self) -> dict[str, dict[str, Any]]:
+        """Health written by the other workers since the last call."""
+        # Rows written during the previous read may share its timestamp
+        since, self.health_read_at = self.health_read_at, time.time()
+        rows = self.connection.execute(
+            "SELECT provider, data FROM health WHERE worker != ? AND updated_at >= ?",
+            (self.worker, since),
+        ).fetchall()
+        return {provider: json.loads(data) for provider, data in rows}
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
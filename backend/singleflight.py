@@ -0,0 +1,53 @@
+# Description: Coalescing of identical concurrent calls into a single upstream call.
+
+import asyncio
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from typing import Any, TypeVar
+
+T = TypeVar("T")
+
+
+@dataclass
+class Flight:
+    task: asyncio.Task
+    waiters: int = 0
+
+
+@dataclass
+class SingleFlight:
+    """
+    Runs one call per key at a time. Callers arriving while a call for their key is
+    in flight wait for it and share its result or exception. Once a flight has
+    max_waiters callers, further callers run their own call instead of piling up.
+    The call is cancelled only when every caller waiting for it went away.
+    """
+
+    max_waiters: int
+    flights: dict[str, Flight] = field(default_factory=dict)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = self._start(key, fn)
+        elif flight.waiters >= self.max_waiters:
+            return await fn()
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+
+    def _start(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Flight:
+        flight = Flight(task=asyncio.ensure_future(fn()))
+        self.flights[key] = flight
+
+        def _done(_: asyncio.Task) -> None:
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+
+        flight.task.add_done_callback(_done)
+        return flight
@@ -0,0 +1,77 @@
+# Description: Persistence of provider probe results so restarts don't begin with stale routing.
+
+import json
+import logging
+import os
+import tempfile
+import time
+from importlib.metadata import version
+from typing import Any
+
+SNAPSHOT_VERSION = 1
+
+
+def g4f_version() -> str:
+    return version("g4f")
+
+
+def save_snapshot(path: str, data: dict[str, Any]) -> None:
+    """
+    Atomically writes a snapshot, so readers never see a partially written file.
+
+    Args:
+        path (str): Destination of the snapshot.
+        data (dict[str, Any]): JSON serializable content of the snapshot.
+    """
+    payload = {
+        "version": SNAPSHOT_VERSION,
+        "g4f_version": g4f_version(),
+        "saved_at": time.time(),
+        **data,
+    }
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".snapshot-")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(payload, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_snapshot(path: str, max_age: float) -> dict[str, Any] | None:
+    """
+    Reads a snapshot written by save_snapshot.
+
+    Args:
+        path (str): Location of the snapshot.
+        max_age (float): Snapshots older than this many seconds are ignored.
+
+    Returns:
+        dict[str, Any] | None: Content of the snapshot, None if it is missing,
+        unreadable, stale or was written by another format or g4f version.
+    """
+    try:
+        with open(path) as f:
+            payload = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable snapshot {path}: {e}")
+        return None
+
+    if not isinstance(payload, dict) or payload.get("version") != SNAPSHOT_VERSION:
+        logging.warning(f"Ignoring snapshot {path} with unknown format")
+        return None
+    if payload.get("g4f_version") != g4f_version():
+        logging.warning(f"Ignoring snapshot {path} from another g4f version")
+        return None
+    age = time.time() - payload.get("saved_at", 0)
+    if not 0 <= age <= max_age:
+        logging.warning(f"Ignoring snapshot {path} saved {age:.0f} seconds ago")
+        return None
+    return payload
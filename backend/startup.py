@@ -0,0 +1,29 @@
+# Description: Timing of the startup phases, reported once the server is ready.
+
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+
+@dataclass
+class StartupTimer:
+    phases: dict[str, float] = field(default_factory=dict)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + (
+                time.perf_counter() - started
+            )
+
+    def report(self) -> str:
+        return ", ".join(
+            f"{name}: {seconds * 1000:.0f}ms" for name, seconds in self.phases.items()
+        )
+
+
+startup_timer = StartupTimer()
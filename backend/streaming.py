@@ -0,0 +1,56 @@
+# Description: Encoding of streamed completion frames as Server-Sent Events or NDJSON.
+
+import json
+from typing import Any
+
+SSE_MEDIA_TYPE = "text/event-stream"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def wants_sse(accept: str | None) -> bool:
+    """
+    Checks if the client asked for Server-Sent Events in its Accept header.
+
+    Args:
+        accept (str | None): Value of the Accept header.
+
+    Returns:
+        bool: True if SSE frames should be sent, False for NDJSON.
+    """
+    return accept is not None and SSE_MEDIA_TYPE in accept
+
+
+def encode_sse_html(event: str, html: str) -> bytes:
+    """
+    Encodes a HTML fragment as Server-Sent Event, for the htmx SSE extension to swap
+    into the page as is.
+
+    Args:
+        event (str): Name of the event, matched against sse-swap attributes.
+        html (str): The fragment, spread over one data line per line.
+
+    Returns:
+        bytes: The encoded event.
+    """
+    lines = html.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    data = "".join(f"data: {line}\n" for line in lines)
+    return f"event: {event}\n{data}\n".encode()
+
+
+def encode_frame(event: str, data: dict[str, Any], sse: bool) -> bytes:
+    """
+    Encodes one frame of a streamed response.
+
+    Args:
+        event (str): Name of the frame, e.g. "start", "chunk", "end" or "error".
+        data (dict[str, Any]): JSON serializable payload of the frame.
+        sse (bool): Whether to encode as Server-Sent Event or as a NDJSON line.
+
+    Returns:
+        bytes: The encoded frame.
+    """
+    if sse:
+        payload = json.dumps(data, ensure_ascii=False)
+        return f"event: {event}\ndata: {payload}\n\n".encode()
+    payload = json.dumps({"event": event, **data}, ensure_ascii=False)
+    return f"{payload}\n".encode()
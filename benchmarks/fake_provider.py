@@ -0,0 +1,162 @@
+# Description: Configurable stand-in for g4f providers, so benchmarks run offline with controlled latency and failures.
+
+import asyncio
+import random
+from collections.abc import AsyncIterator
+from dataclasses import dataclass, field
+from typing import Any
+
+from g4f.client.stubs import ChatCompletion, ChatCompletionChunk
+
+from backend import background, dependencies
+from backend.dependencies import BEST_MODELS_ORDERED, chat_completion
+from backend.egress import egress_identity
+from backend.settings import settings
+
+# Documentation range address (RFC 5737) posing as the public IP of the server
+FAKE_EGRESS_IP = "203.0.113.7"
+
+
+class FakeProviderError(Exception):
+    pass
+
+
+@dataclass
+class FakeProviderConfig:
+    """
+    Behaviour of every fake provider. Latencies follow a log-normal distribution
+    with the given median, rates are the probabilities of each outcome per call.
+    """
+
+    latency: float = 0.05
+    latency_sigma: float = 0.5
+    error_rate: float = 0.0
+    empty_rate: float = 0.0
+    ip_echo_rate: float = 0.0
+    # Streams send their first chunk after the latency, the others chunk_interval apart
+    chunks: int = 8
+    chunk_interval: float = 0.005
+
+
+@dataclass
+class FakeChatCompletions:
+    """Implements the ChatCompletions protocol with FakeProviderConfig behaviour."""
+
+    config: FakeProviderConfig = field(default_factory=FakeProviderConfig)
+    seed: int | None = None
+    calls: int = 0
+    rng: random.Random = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self.rng = random.Random(self.seed)
+
+    def create(
+        self,
+        messages: list[dict],
+        model: str,
+        provider: Any = None,
+        stream: bool = False,
+        **kwargs: Any,
+    ) -> Any:
+        self.calls += 1
+        if stream:
+            return self._stream()
+        return self._complete()
+
+    def _latency(self) -> float:
+        return self.config.latency * self.rng.lognormvariate(
+            0, self.config.latency_sigma
+        )
+
+    def _outcome(self) -> str:
+        """One of error, empty, ip_echo or text."""
+        roll = self.rng.random()
+        for outcome, rate in [
+            ("error", self.config.error_rate),
+            ("empty", self.config.empty_rate),
+            ("ip_echo", self.config.ip_echo_rate),
+        ]:
+            if roll < rate:
+                return outcome
+            roll -= rate
+        return "text"
+
+    def _text(self, outcome: str) -> str:
+        if outcome == "ip_echo":
+            return f"Your IP address is {FAKE_EGRESS_IP}."
+        return "The quick brown fox jumps over the lazy dog."
+
+    async def _complete(self) -> ChatCompletion:
+        outcome = self._outcome()
+        await asyncio.sleep(self._latency())
+        if outcome == "error":
+            raise FakeProviderError("Fake provider failed")
+        content = "" if outcome == "empty" else self._text(outcome)
+        return ChatCompletion.model_construct(content, "stop")
+
+    async def _stream(self) -> AsyncIterator[ChatCompletionChunk]:
+        outcome = self._outcome()
+        await asyncio.sleep(self._latency())
+        if outcome == "error":
+            raise FakeProviderError("Fake provider failed")
+        if outcome == "empty":
+            return
+        words = self._text(outcome).split(" ")
+        size = max(1, -(-len(words) // max(1, self.config.chunks)))
+        for start in range(0, len(words), size):
+            if start:
+                await asyncio.sleep(self.config.chunk_interval)
+            text = " ".join(words[start : start + size])
+            yield ChatCompletionChunk.model_construct(
+                text if start == 0 else f" {text}", None
+            )
+
+
+def fake_providers_map(count: int) -> dict[str, type]:
+    """
+    Provider classes shaped like g4f's, as far as the provider graph looks at them.
+    Each supports a rotating share of the best models, so every model has several
+    providers to fall back to.
+    """
+    providers = {}
+    for index in range(count):
+        name = f"FakeProvider{index:03d}"
+        models = [
+            BEST_MODELS_ORDERED[(index + offset) % len(BEST_MODELS_ORDERED)]
+            for offset in range(2)
+        ]
+        providers[name] = type(
+            name,
+            (),
+            {
+                "working": True,
+                "needs_auth": False,
+                "url": f"https://{name.lower()}.invalid",
+                "models": models,
+                "default_model": models[0],
+            },
+        )
+    return providers
+
+
+def install_fake_providers(
+    app: Any, fake: FakeChatCompletions, provider_count: int
+) -> dict[str, type]:
+    """
+    Replaces the real providers of the app by fake ones: the chat_completion
+    dependency, the completions of the probes and get_base_working_providers_map.
+    Must be called before the catalog is first built. Snapshots and shared state
+    are turned off so runs leave nothing behind.
+    """
+    providers = fake_providers_map(provider_count)
+    dependencies.get_base_working_providers_map = lambda: providers
+    background.get_base_working_providers_map = lambda: providers
+    dependencies.get_provider_graph.cache_clear()
+    background.chat_completion = lambda: fake
+    app.dependency_overrides[chat_completion] = lambda: fake
+
+    settings.SNAPSHOT_PATH = None
+    background.shared_state = None
+    background.leader_lock = None
+    egress_identity.set_addresses([FAKE_EGRESS_IP])
+    return providers
@@ -0,0 +1,245 @@
+# Description: Load and latency benchmarks of the API against fake providers, written to a JSON file to compare commits.
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import platform
+import subprocess
+import time
+from collections import Counter
+from collections.abc import Awaitable, Callable
+from dataclasses import asdict, dataclass, replace
+
+import httpx
+
+from backend import app, background
+from backend.dependencies import provider_and_models
+from benchmarks.fake_provider import (
+    FakeChatCompletions,
+    FakeProviderConfig,
+    install_fake_providers,
+)
+
+SCENARIOS = ["completions", "stream", "nofail", "providers", "update_providers"]
+
+
+@dataclass
+class Result:
+    scenario: str
+    concurrency: int
+    requests: int
+    duration: float
+    throughput: float
+    p50: float
+    p95: float
+    p99: float
+    mean: float
+    statuses: dict[str, int]
+    upstream_calls: int
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """Nearest-rank percentile of already sorted values, q between 0 and 100."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(q / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+async def drive(
+    send: Callable[[int], Awaitable[str]], requests: int, concurrency: int
+) -> tuple[float, list[float], Counter]:
+    """
+    Sends the requests from concurrency workers at once.
+
+    Returns:
+        tuple: Wall time of the run, latency of every request and the count of each
+            status returned by send.
+    """
+    latencies: list[float] = []
+    statuses: Counter = Counter()
+    next_index = iter(range(requests))
+
+    async def worker() -> None:
+        for index in next_index:
+            started = time.perf_counter()
+            try:
+                status = await send(index)
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[status] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return time.perf_counter() - started, latencies, statuses
+
+
+def completion_sender(
+    client: httpx.AsyncClient, params: dict[str, str]
+) -> Callable[[int], Awaitable[str]]:
+    async def send(index: int) -> str:
+        # Distinct messages, identical requests in flight would be coalesced
+        body = {"messages": [{"role": "user", "content": f"Benchmark {index}"}]}
+        response = await client.post("/api/completions", params=params, json=body)
+        if params.get("stream") and b'"event": "error"' in response.content:
+            return "stream_error"
+        return str(response.status_code)
+
+    return send
+
+
+async def run_scenario(
+    scenario: str,
+    client: httpx.AsyncClient,
+    fake: FakeChatCompletions,
+    config: FakeProviderConfig,
+    requests: int,
+    concurrency: int,
+) -> Result:
+    # Only nofail is about failing providers, the others measure the happy path
+    if scenario == "nofail":
+        fake.config = config
+    else:
+        fake.config = replace(config, error_rate=0, empty_rate=0, ip_echo_rate=0)
+
+    routing = provider_and_models.routing
+    model, provider = routing.fallback_chain[0]
+    if scenario == "completions":
+        send = completion_sender(client, {"model": model, "provider": provider})
+    elif scenario == "stream":
+        send = completion_sender(
+            client, {"model": model, "provider": provider, "stream": "true"}
+        )
+    elif scenario == "nofail":
+        send = completion_sender(client, {})
+    elif scenario == "providers":
+
+        async def send(index: int) -> str:
+            response = await client.get("/api/providers")
+            return str(response.status_code)
+
+    elif scenario == "update_providers":
+        # Probes are serialized by a lock, runs of them cannot overlap
+        concurrency = 1
+
+        async def send(index: int) -> str:
+            await background.update_working_providers()
+            return "done"
+
+    else:
+        raise ValueError(f"Unknown scenario: {scenario}")
+
+    calls_before = fake.calls
+    duration, latencies, statuses = await drive(send, requests, concurrency)
+    latencies.sort()
+    return Result(
+        scenario=scenario,
+        concurrency=concurrency,
+        requests=requests,
+        duration=duration,
+        throughput=requests / duration if duration else 0.0,
+        p50=percentile(latencies, 50),
+        p95=percentile(latencies, 95),
+        p99=percentile(latencies, 99),
+        mean=sum(latencies) / len(latencies) if latencies else 0.0,
+        statuses=dict(statuses),
+        upstream_calls=fake.calls - calls_before,
+    )
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args: argparse.Namespace) -> dict:
+    config = FakeProviderConfig(
+        latency=args.latency,
+        latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        empty_rate=args.empty_rate,
+        ip_echo_rate=args.ip_echo_rate,
+        chunks=args.chunks,
+        chunk_interval=args.chunk_interval,
+    )
+    fake = FakeChatCompletions(config=config, seed=args.seed)
+    install_fake_providers(app, fake, args.providers)
+
+    results = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+        for scenario in args.scenarios:
+            for concurrency in args.concurrency:
+                requests = (
+                    args.probe_runs if scenario == "update_providers" else args.requests
+                )
+                # The routes print every attempt, which would drown the report
+                with contextlib.redirect_stdout(io.StringIO()):
+                    await run_scenario(
+                        scenario, client, fake, config, args.warmup, concurrency
+                    )
+                    result = await run_scenario(
+                        scenario, client, fake, config, requests, concurrency
+                    )
+                results.append(result)
+                print(
+                    f"{result.scenario:>16} c={result.concurrency:<4} "
+                    f"{result.throughput:9.1f} req/s  p50={result.p50 * 1000:8.2f}ms "
+                    f"p95={result.p95 * 1000:8.2f}ms p99={result.p99 * 1000:8.2f}ms "
+                    f"{result.statuses}"
+                )
+                if scenario == "update_providers":
+                    break
+
+    return {
+        "commit": git_commit(),
+        "created_at": time.time(),
+        "python": platform.python_version(),
+        "providers": args.providers,
+        "fake_provider": asdict(config),
+        "results": [asdict(result) for result in results],
+    }
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    defaults = FakeProviderConfig()
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the API in process against fake providers, offline."
+    )
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--probe-runs", type=int, default=5)
+    parser.add_argument("--providers", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=defaults.latency)
+    parser.add_argument("--latency-sigma", type=float, default=defaults.latency_sigma)
+    parser.add_argument("--error-rate", type=float, default=0.1)
+    parser.add_argument("--empty-rate", type=float, default=0.05)
+    parser.add_argument("--ip-echo-rate", type=float, default=0.02)
+    parser.add_argument("--chunks", type=int, default=defaults.chunks)
+    parser.add_argument("--chunk-interval", type=float, default=defaults.chunk_interval)
+    parser.add_argument("--output", default="benchmark-results.json")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
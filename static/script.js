@@ -1,19 +1,52 @@
 var messageHistory = [];
+// Set once the server holds the conversation, the history is then no longer sent
+var sessionId = null;
 function addMessage(role, content) {
   messageHistory.push({"role": role, "content": content});
 }
 function getHistory() {
-  return messageHistory;
+  return sessionId ? [] : messageHistory;
+}
+function getSessionId() {
+  return sessionId;
+}
+function setBusy(busy) {
+  var form = document.getElementById("form");
+  form.input.disabled = busy;
+  form.btnSubmit.disabled = busy;
+  if (!busy) {
+    form.input.focus();
+  }
 }
 document.addEventListener('htmx:afterRequest', function (evt) {
   if (evt.detail.xhr.status != 200 || evt.detail.successful != true) {
     // TODO: handle error in UI
     console.error(evt);
+    if (evt.detail.target.id == 'messages') {
+      // The message never reached the conversation
+      messageHistory.pop();
+      setBusy(false);
+    }
     return;
   }
   if (evt.detail.target.id == 'messages') {
-    addMessage('assistant', evt.detail.target.lastElementChild.querySelector("div.hidden").innerText.trim());
+    // The assistant message streams in afterwards, see the htmx:load handler
+    sessionId = evt.detail.xhr.getResponseHeader('X-Session-Id') || sessionId;
+  }
+});
+// The complete assistant message replaces the streamed one once the stream ends
+document.addEventListener('htmx:load', function (evt) {
+  var elt = evt.detail.elt;
+  if (!elt.dataset || elt.dataset.streamEnd === undefined) {
+    return;
+  }
+  if (elt.dataset.streamEnd == 'completion') {
+    addMessage('assistant', elt.querySelector("div.hidden").innerText.trim());
+  } else {
+    // The server dropped the unanswered message from the session as well
+    messageHistory.pop();
   }
+  setBusy(false);
 });
 var textarea = document.getElementById("input");
 var heightLimit = 200; /* Maximum height: 200px */
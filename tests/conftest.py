@@ -1,17 +1,27 @@
 from typing import Generator
-from unittest.mock import Mock
+from unittest.mock import AsyncMock, Mock
 
 import pytest
 from fastapi.testclient import TestClient
+from g4f.client.stubs import ChatCompletion
 
 from backend import app
 from backend.dependencies import chat_completion
+from backend.egress import egress_identity
+
+
+@pytest.fixture(autouse=True)
+def no_egress_lookup(monkeypatch: pytest.MonkeyPatch) -> None:
+    # Lookups would hit the network on every app startup
+    monkeypatch.setattr(egress_identity, "lookup", AsyncMock(return_value=None))
 
 
 @pytest.fixture(scope="function")
 def client() -> Generator[TestClient, None, None]:
     chat = Mock()
-    chat.create.return_value = "response"
+    chat.create = AsyncMock(
+        return_value=ChatCompletion.model_construct("response", "stop")
+    )
     app.dependency_overrides[chat_completion] = lambda: chat
 
     with TestClient(app) as client:
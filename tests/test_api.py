@@ -1,17 +1,29 @@
-from unittest.mock import Mock
+import asyncio
+import json
+from unittest.mock import AsyncMock, Mock
 
+import httpx
 import pytest
 from fastapi.testclient import TestClient
+from g4f.client.stubs import ChatCompletion, ChatCompletionChunk
 
 from backend import app
-from backend.dependencies import chat_completion, provider_and_models
+from backend.dependencies import (
+    BEST_MODELS_ORDERED,
+    chat_completion,
+    is_chat_model,
+    provider_and_models,
+)
+from backend.health import HealthRegistry
 
 COMPLETION_PATH = "/api/completions"
 
 
 def test_api_validation():
     chat = Mock()
-    chat.create.return_value = "response"
+    chat.create = AsyncMock(
+        return_value=ChatCompletion.model_construct("response", "stop")
+    )
     app.dependency_overrides[chat_completion] = lambda: chat
 
     with TestClient(app) as client:
@@ -122,3 +134,321 @@ def test_all_provider_model_combination(
         assert response.json()["completion"] == "response"
     else:
         assert response.status_code == 422
+
+
+def test_streaming_completion():
+    async def stream_chunks():
+        for content in ["Hel", "lo", ""]:
+            yield ChatCompletionChunk.model_construct(content, None)
+
+    chat = Mock()
+    chat.create = Mock(side_effect=lambda **kwargs: stream_chunks())
+    app.dependency_overrides[chat_completion] = lambda: chat
+
+    provider = provider_and_models.all_working_provider_names[0]
+    with TestClient(app) as client:
+        response = client.post(
+            COMPLETION_PATH,
+            params={"provider": provider, "stream": True},
+            json={"messages": [{"role": "user", "content": "Hello"}]},
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        frames = [json.loads(line) for line in response.text.splitlines()]
+        assert [frame["event"] for frame in frames] == [
+            "start",
+            "chunk",
+            "chunk",
+            "end",
+        ]
+        assert frames[0]["provider"] == provider
+        assert frames[-1]["completion"] == "Hello"
+
+        response = client.post(
+            COMPLETION_PATH,
+            params={"provider": provider, "stream": True},
+            headers={"Accept": "text/event-stream"},
+            json={"messages": [{"role": "user", "content": "Hello"}]},
+        )
+        assert response.status_code == 200
+        assert response.text.startswith("event: start\ndata: ")
+        assert "event: end\n" in response.text
+
+
+def test_ui_streaming_completion():
+    async def stream_chunks():
+        for content in ["<b>Hel", "lo\nthere"]:
+            yield ChatCompletionChunk.model_construct(content, None)
+
+    chat = Mock()
+    chat.create = Mock(side_effect=lambda **kwargs: stream_chunks())
+    app.dependency_overrides[chat_completion] = lambda: chat
+
+    provider = provider_and_models.all_working_provider_names[0]
+    with TestClient(app) as client:
+        response = client.post(
+            "/app/completions/stream", json={"message": "Hello", "provider": provider}
+        )
+        assert response.status_code == 200
+        session_id = response.headers["X-Session-Id"]
+        stream_url = f"/app/sessions/{session_id}/stream?provider={provider}"
+        assert f'sse-connect="{stream_url}"' in response.text
+
+        response = client.get(stream_url)
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = response.text.split("\n\n")
+        assert events[0] == "event: chunk\ndata: &lt;b&gt;Hel"
+        assert events[1] == "event: chunk\ndata: lo\ndata: there"
+        assert events[2].startswith("event: end\n")
+        assert 'data-stream-end="completion"' in events[2]
+
+        messages = client.get(f"/api/sessions/{session_id}").json()["messages"]
+        assert messages[-1] == {"role": "assistant", "content": "<b>Hello\nthere"}
+        # The message is answered, a reconnecting browser gets nothing more
+        assert client.get(stream_url).status_code == 204
+
+
+def test_hedged_completion():
+    calls = []
+
+    async def create(**kwargs):
+        calls.append(kwargs["provider"])
+        if len(calls) == 1:
+            raise ValueError("Provider is down")
+        return ChatCompletion.model_construct("response", "stop")
+
+    chat = Mock()
+    chat.create = AsyncMock(side_effect=create)
+    app.dependency_overrides[chat_completion] = lambda: chat
+
+    with TestClient(app) as client:
+        response = client.post(
+            COMPLETION_PATH,
+            params={"hedge": True},
+            json={"messages": [{"role": "user", "content": "Hello"}]},
+        )
+        assert response.status_code == 200
+        assert response.json()["completion"] == "response"
+        assert response.json()["provider"] == calls[1]
+        assert response.headers["X-Hedge-Winner"] == "1"
+
+
+def test_hedged_completion_does_not_join_plain_flight():
+    async def create(**kwargs):
+        await asyncio.sleep(0.3)
+        return ChatCompletion.model_construct("response", "stop")
+
+    chat = Mock()
+    chat.create = AsyncMock(side_effect=create)
+    app.dependency_overrides[chat_completion] = lambda: chat
+
+    async def main() -> tuple[httpx.Response, httpx.Response]:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as client:
+
+            async def post(**params) -> httpx.Response:
+                return await client.post(
+                    COMPLETION_PATH,
+                    params=params,
+                    json={"messages": [{"role": "user", "content": "Hello"}]},
+                )
+
+            plain = asyncio.create_task(post())
+            await asyncio.sleep(0.05)
+            hedged = await post(hedge=True)
+            return await plain, hedged
+
+    plain, hedged = asyncio.run(main())
+    assert plain.status_code == hedged.status_code == 200
+    assert "X-Hedge-Winner" not in plain.headers
+    assert hedged.headers["X-Hedge-Winner"] == "0"
+    assert int(hedged.headers["X-Hedge-Launched"]) >= 1
+
+
+def test_routing_index():
+    routing = provider_and_models.routing
+    assert routing.fallback_chain
+    for model, provider in routing.fallback_chain:
+        assert (
+            model
+            in provider_and_models.all_working_providers_map[provider].supported_models
+        )
+        assert model in BEST_MODELS_ORDERED or is_chat_model(model)
+    assert not is_chat_model("gpt-4o-mini-tts")
+    assert not is_chat_model("flux")
+    assert routing.model_names == set(provider_and_models.all_model_names)
+    assert routing.provider_names == set(provider_and_models.all_working_provider_names)
+    for provider, models in routing.provider_models.items():
+        ranks = [routing.rank(model) for model in models]
+        assert ranks == sorted(ranks)
+
+
+def test_catalog_etags(client: TestClient):
+    response = client.get("/api/providers")
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert set(response.json()) == set(provider_and_models.all_working_provider_names)
+
+    etag = response.headers["ETag"]
+    response = client.get("/api/providers", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+    model = provider_and_models.routing.fallback_chain[0].model
+    response = client.get("/api/providers", params={"model": model})
+    assert response.headers["ETag"] != etag
+    assert set(response.json()) == set(
+        provider_and_models.routing.model_providers[model]
+    )
+
+    provider = provider_and_models.all_working_provider_names[0]
+    response = client.get(
+        "/api/models",
+        params={"provider": provider},
+        headers={"Accept-Encoding": "identity"},
+    )
+    assert "Content-Encoding" not in response.headers
+    assert set(response.json()) == set(
+        provider_and_models.routing.provider_models[provider]
+    )
+
+    response = client.get("/api/models", params={"provider": "Kjf0ajL0gjlskb0K"})
+    assert response.status_code == 422
+
+
+def test_batch_completion():
+    async def create(**kwargs):
+        if kwargs["messages"][0]["content"] == "fail":
+            raise ValueError("Provider is down")
+        return ChatCompletion.model_construct("response", "stop")
+
+    chat = Mock()
+    chat.create = AsyncMock(side_effect=create)
+    app.dependency_overrides[chat_completion] = lambda: chat
+    provider = provider_and_models.all_working_provider_names[0]
+
+    with TestClient(app) as client:
+        response = client.post(
+            f"{COMPLETION_PATH}/batch",
+            params={"concurrency": 2},
+            json=[
+                {"messages": [{"role": "user", "content": "Hello"}]},
+                {"messages": [{"role": "user", "content": "Hello"}], "model": "-"},
+                {
+                    "messages": [{"role": "user", "content": "fail"}],
+                    "provider": provider,
+                },
+            ],
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        results = {
+            result["index"]: result
+            for result in map(json.loads, response.text.splitlines())
+        }
+        assert results[0]["completion"]["completion"] == "response"
+        assert results[1]["error"]["status_code"] == 422
+        assert results[2]["error"]["status_code"] == 500
+        assert "Provider is down" in results[2]["error"]["detail"]
+
+        response = client.post(
+            f"{COMPLETION_PATH}/batch", params={"concurrency": 0}, json=[]
+        )
+        assert response.status_code == 422
+
+
+def test_openai_chat_completion(client: TestClient):
+    response = client.post(
+        "/v1/chat/completions",
+        json={
+            "model": "",
+            "messages": [
+                {"role": "system", "content": "Be brief"},
+                {"role": "user", "content": [{"type": "text", "text": "Hello"}]},
+            ],
+            "temperature": 0.5,
+        },
+    )
+    assert response.status_code == 200
+    assert response.json()["object"] == "chat.completion"
+    assert response.json()["choices"][0]["message"]["content"] == "response"
+
+    response = client.post(
+        "/v1/chat/completions",
+        json={
+            "model": "Kjf0ajL0gjlskb0K",
+            "messages": [{"role": "user", "content": "Hello"}],
+        },
+    )
+    assert response.status_code == 404
+    assert response.json()["error"]["type"] == "not_found_error"
+
+    response = client.get("/v1/models")
+    assert response.json()["object"] == "list"
+    assert {model["id"] for model in response.json()["data"]} == set(
+        provider_and_models.all_model_names
+    )
+
+
+def test_openai_chat_completion_stream():
+    async def stream_chunks():
+        for content in ["Hel", "lo"]:
+            yield ChatCompletionChunk.model_construct(content, None)
+
+    chat = Mock()
+    chat.create = Mock(side_effect=lambda **kwargs: stream_chunks())
+    app.dependency_overrides[chat_completion] = lambda: chat
+
+    with TestClient(app) as client:
+        response = client.post(
+            "/v1/chat/completions",
+            json={
+                "model": provider_and_models.routing.fallback_chain[0].model,
+                "messages": [{"role": "user", "content": "Hello"}],
+                "stream": True,
+            },
+        )
+        assert response.status_code == 200
+        events = [
+            line.removeprefix("data: ")
+            for line in response.text.splitlines()
+            if line.startswith("data: ")
+        ]
+        assert events[-1] == "[DONE]"
+        chunks = [json.loads(event) for event in events[:-1]]
+        assert all(chunk["object"] == "chat.completion.chunk" for chunk in chunks)
+        content = "".join(
+            chunk["choices"][0]["delta"].get("content", "") for chunk in chunks
+        )
+        assert content == "Hello"
+        assert chunks[-1]["choices"][0]["finish_reason"] == "stop"
+
+
+def test_nofail_fallbacks_try_each_provider_once(monkeypatch):
+    monkeypatch.setattr("backend.routes.provider_health", HealthRegistry())
+    monkeypatch.setattr("backend.deadline.settings.RETRY_BACKOFF_BASE", 0.001)
+    calls = []
+
+    async def create(**kwargs):
+        calls.append((kwargs["model"], kwargs["provider"]))
+        raise ValueError("Provider is down")
+
+    chat = Mock()
+    chat.create = AsyncMock(side_effect=create)
+    app.dependency_overrides[chat_completion] = lambda: chat
+
+    with TestClient(app) as client:
+        response = client.post(
+            COMPLETION_PATH, json={"messages": [{"role": "user", "content": "Hello"}]}
+        )
+    assert response.status_code == 500
+    assert len(calls) == 10
+    providers = [provider for _, provider in calls]
+    assert len(set(providers)) == len(providers)
+    # Candidates keep their own model, the first one is the best ranked model
+    assert calls[0] == tuple(provider_and_models.routing.fallback_chain[0])
+    working = provider_and_models.all_working_providers_map
+    for model, provider in calls:
+        assert model in working[provider].supported_models
@@ -0,0 +1,58 @@
+from unittest.mock import AsyncMock, Mock
+
+from fastapi.testclient import TestClient
+from g4f.client.stubs import ChatCompletion
+
+from backend import app
+from backend.cache import CachePolicy, ResponseCache, response_cache
+from backend.dependencies import CompletionResponse, chat_completion
+from backend.settings import settings
+
+COMPLETION_PATH = "/api/completions"
+
+
+def test_cache_lru_eviction():
+    cache = ResponseCache(max_entries=2, max_bytes=1024)
+    for key in ["a", "b"]:
+        cache.put(key, CompletionResponse(completion=key), ttl=60)
+    assert cache.get("a") is not None
+    cache.put("c", CompletionResponse(completion="c"), ttl=60)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+
+    cache.put("expired", CompletionResponse(completion="expired"), ttl=-1)
+    assert cache.get("expired") is None
+
+
+def test_cache_policy():
+    assert CachePolicy.from_header(None).read
+    assert not CachePolicy.from_header("no-cache").read
+    assert CachePolicy.from_header("no-cache").store
+    assert not CachePolicy.from_header("no-store").store
+    assert CachePolicy.from_header("max-age=10").ttl == 10
+
+
+def test_cached_completion(monkeypatch):
+    monkeypatch.setattr(settings, "CACHE_ENABLED", True)
+    response_cache.clear()
+    chat = Mock()
+    chat.create = AsyncMock(
+        return_value=ChatCompletion.model_construct("response", "stop")
+    )
+    app.dependency_overrides[chat_completion] = lambda: chat
+    request = {"messages": [{"role": "user", "content": "Hello cache"}]}
+
+    with TestClient(app) as client:
+        response = client.post(COMPLETION_PATH, json=request)
+        assert response.headers["X-Cache"] == "MISS"
+        response = client.post(COMPLETION_PATH, json=request)
+        assert response.headers["X-Cache"] == "HIT"
+        assert response.json()["completion"] == "response"
+        assert chat.create.call_count == 1
+
+        response = client.post(
+            COMPLETION_PATH, json=request, headers={"Cache-Control": "no-cache"}
+        )
+        assert response.headers["X-Cache"] == "BYPASS"
+        assert chat.create.call_count == 2
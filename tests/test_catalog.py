@@ -0,0 +1,40 @@
+from backend.dependencies import ProviderAndModels, build_catalog, get_provider_graph
+
+
+def test_catalog_update_matches_full_build():
+    graph = get_provider_graph()
+    names = sorted(graph.providers)
+    catalog = build_catalog(graph, names)
+
+    for working in [names[::2], names[1::3], names[:1], [], names]:
+        catalog = catalog.with_working_providers(graph, working)
+        expected = build_catalog(graph, working)
+        assert catalog.all_working_providers_map == expected.all_working_providers_map
+        assert catalog.all_models_map == expected.all_models_map
+        # Same order too, which a dict comparison ignores
+        assert catalog.all_working_provider_names == expected.all_working_provider_names
+        assert catalog.all_model_names == expected.all_model_names
+        assert catalog.routing.fallback_chain == expected.routing.fallback_chain
+        assert dict(catalog.routing.model_providers) == dict(
+            expected.routing.model_providers
+        )
+
+
+def test_catalog_snapshots_are_swapped():
+    provider_and_models = ProviderAndModels()
+    snapshot = provider_and_models.load()
+    assert provider_and_models.load() is snapshot
+    assert provider_and_models.catalog is snapshot
+    working = sorted(snapshot.all_working_provider_names)
+    models = dict(snapshot.all_models_map)
+
+    provider_and_models.update_model_providers(working[1:])
+    assert provider_and_models.catalog is not snapshot
+    assert working[0] not in provider_and_models.all_working_providers_map
+    # Readers holding the previous snapshot keep seeing it unchanged
+    assert sorted(snapshot.all_working_provider_names) == working
+    assert dict(snapshot.all_models_map) == models
+
+    unchanged = provider_and_models.catalog
+    provider_and_models.update_model_providers(working[1:])
+    assert provider_and_models.catalog is unchanged
@@ -0,0 +1,116 @@
+import asyncio
+import time
+from unittest.mock import AsyncMock, Mock
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from g4f.client.stubs import ChatCompletion
+
+from backend import app
+from backend.deadline import RetryBudget, settings
+from backend.dependencies import chat_completion
+
+
+@pytest.fixture
+def short_attempts(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "ATTEMPT_TIMEOUT_MIN", 0.05)
+    monkeypatch.setattr(settings, "RETRY_BACKOFF_BASE", 0.001)
+
+
+def test_attempt_timeouts(short_attempts):
+    budget = RetryBudget(10)
+    assert budget.attempt_timeout(retries_left=0) == pytest.approx(10, abs=0.01)
+    assert budget.attempt_timeout(retries_left=3) == pytest.approx(5, abs=0.01)
+
+    # Less than ATTEMPT_TIMEOUT_MIN left: the first attempt gets it, no retry does
+    budget = RetryBudget(0.04)
+    assert budget.attempt_timeout(retries_left=3) == pytest.approx(0.04, abs=0.01)
+    assert not budget.exhausted
+    budget.record("model", "provider", started=0, outcome="timeout")
+    assert budget.exhausted
+    assert asyncio.run(budget.backoff()) is False
+
+
+def test_request_timeout(short_attempts):
+    async def create(**kwargs):
+        await asyncio.sleep(1)
+
+    chat = Mock()
+    chat.create = Mock(side_effect=create)
+    app.dependency_overrides[chat_completion] = lambda: chat
+
+    request = {"json": {"messages": [{"role": "user", "content": "Hello"}]}}
+    with TestClient(app) as client:
+        response = client.post(
+            "/api/completions", headers={"X-Request-Timeout": "0.3"}, **request
+        )
+        assert response.status_code == 504
+        detail = response.json()["detail"]
+        assert detail.startswith("Request timeout of 0.3s ran out")
+        # Each attempt got a share of the time left, the fallbacks still had some
+        assert 2 <= detail.count("timeout, ") <= chat.create.call_count
+
+        response = client.post(
+            "/api/completions", headers={"X-Request-Timeout": "soon"}, **request
+        )
+        assert response.status_code == 422
+
+
+def test_hedged_request_timeout(short_attempts):
+    async def create(**kwargs):
+        await asyncio.sleep(1)
+
+    chat = Mock()
+    chat.create = Mock(side_effect=create)
+    app.dependency_overrides[chat_completion] = lambda: chat
+
+    with TestClient(app) as client:
+        response = client.post(
+            "/api/completions",
+            params={"hedge": True},
+            headers={"X-Request-Timeout": "0.3"},
+            json={"messages": [{"role": "user", "content": "Hello"}]},
+        )
+    assert response.status_code == 504
+    detail = response.json()["detail"]
+    assert detail.startswith("Request timeout of 0.3s ran out")
+    assert detail.count("timeout, ") == chat.create.call_count
+
+
+def test_coalesced_requests_keep_their_own_deadline(short_attempts):
+    async def create(**kwargs):
+        await asyncio.sleep(1)
+        return ChatCompletion.model_construct("response", "stop")
+
+    chat = Mock()
+    chat.create = AsyncMock(side_effect=create)
+    app.dependency_overrides[chat_completion] = lambda: chat
+
+    async def main() -> tuple[httpx.Response, httpx.Response, float]:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as client:
+
+            async def post(timeout: str) -> httpx.Response:
+                return await client.post(
+                    "/api/completions",
+                    params={"provider": "Blackbox"},
+                    headers={"X-Request-Timeout": timeout},
+                    json={"messages": [{"role": "user", "content": "Hello"}]},
+                )
+
+            first = asyncio.create_task(post("5"))
+            await asyncio.sleep(0.1)
+            started = time.monotonic()
+            # Joins the flight of the first request, but not beyond its own deadline
+            second = await post("0.3")
+            waited = time.monotonic() - started
+            return await first, second, waited
+
+    first, second, waited = asyncio.run(main())
+    assert first.status_code == 200
+    assert second.status_code == 504
+    assert waited < 0.8
+    assert chat.create.call_count == 1
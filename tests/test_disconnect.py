@@ -0,0 +1,64 @@
+import asyncio
+import json
+import time
+from unittest.mock import Mock
+
+from backend import app
+from backend.dependencies import chat_completion
+from backend.metrics import client_disconnects
+
+
+def test_disconnect_cancels_completion():
+    cancelled = []
+
+    async def create(**kwargs):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(kwargs["provider"])
+            raise
+
+    chat = Mock()
+    chat.create = Mock(side_effect=create)
+    app.dependency_overrides[chat_completion] = lambda: chat
+
+    async def main() -> list[dict]:
+        body = json.dumps({"messages": [{"role": "user", "content": "Hello"}]})
+        messages = [{"type": "http.request", "body": body.encode(), "more_body": False}]
+        sent = []
+
+        async def receive() -> dict:
+            if messages:
+                return messages.pop(0)
+            # The client gives up while the provider is still thinking
+            await asyncio.sleep(0.1)
+            return {"type": "http.disconnect"}
+
+        async def send(message: dict) -> None:
+            sent.append(message)
+
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "POST",
+            "scheme": "http",
+            "path": "/api/completions",
+            "raw_path": b"/api/completions",
+            "query_string": b"",
+            "root_path": "",
+            "headers": [(b"content-type", b"application/json")],
+            "client": ("127.0.0.1", 1234),
+            "server": ("testserver", 80),
+        }
+        await app(scope, receive, send)
+        return sent
+
+    disconnects = client_disconnects.values.get(("api",), 0)
+    started = time.monotonic()
+    sent = asyncio.run(main())
+
+    assert time.monotonic() - started < 5
+    assert len(cancelled) == chat.create.call_count == 1
+    assert client_disconnects.values[("api",)] == disconnects + 1
+    assert sent[0]["status"] == 499
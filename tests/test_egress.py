@@ -0,0 +1,34 @@
+import asyncio
+
+from backend.egress import EgressIdentity
+
+
+def test_egress_refresh_with_local_lookup():
+    async def lookup(url: str, proxy: str | None) -> str | None:
+        return "203.0.113.7"
+
+    identity = EgressIdentity(lookup=lookup)
+    asyncio.run(identity.refresh())
+    assert identity.addresses == {"203.0.113.7"}
+    assert identity.contains_leak("Your IP is 203.0.113.7.")
+    assert not identity.contains_leak("Not 203.0.113.71 or 1203.0.113.7")
+
+    # A failed refresh keeps the addresses known so far
+    async def failing_lookup(url: str, proxy: str | None) -> str | None:
+        raise asyncio.TimeoutError()
+
+    identity.lookup = failing_lookup
+    asyncio.run(identity.refresh())
+    assert identity.addresses == {"203.0.113.7"}
+
+
+def test_leak_scanner_across_chunks():
+    identity = EgressIdentity()
+    identity.set_addresses(["203.0.113.7", "2001:DB8::1"])
+    scanner = identity.scanner()
+    assert not scanner.feed("Your address is 203.0")
+    assert scanner.feed(".113.7, right?")
+
+    scanner = identity.scanner()
+    assert not scanner.feed("Nothing to see here")
+    assert scanner.feed(" 2001:db8::1")
@@ -0,0 +1,61 @@
+from backend.health import CircuitState, HealthRegistry
+from backend.settings import settings
+
+
+def test_circuit_breaker_opens_and_recovers(monkeypatch):
+    monkeypatch.setattr(settings, "CIRCUIT_OPEN_SECONDS", 0)
+    health = HealthRegistry()
+
+    for _ in range(settings.CIRCUIT_FAILURE_THRESHOLD):
+        health.begin("Provider")
+        health.record_failure("Provider", "gpt-4", ValueError("down"))
+    assert health.get("Provider").state == CircuitState.OPEN
+    assert health.get("Provider").errors["ValueError"] == 3
+
+    # Only a single trial call is let through while half open
+    health.begin("Provider")
+    assert health.get("Provider").state == CircuitState.HALF_OPEN
+    assert not health.is_available("Provider")
+    assert health.score("Provider") == 0
+
+    health.record_success("Provider", "gpt-4", 1.0)
+    assert health.get("Provider").state == CircuitState.CLOSED
+    assert health.is_available("Provider")
+
+
+def test_health_score_ranking():
+    health = HealthRegistry()
+    health.record_success("Fast", "gpt-4", 0.5)
+    health.record_success("Slow", "gpt-4", 30)
+    health.record_failure("Failing", "gpt-4", "EmptyResponse")
+
+    assert health.score("Fast") > health.score("Unknown") > health.score("Slow")
+    assert health.score("Unknown") > health.score("Failing")
+    assert health.score("Failing", "gpt-4") < health.score("Failing", "other")
+
+
+def test_circuit_version_only_moves_with_circuits():
+    health = HealthRegistry()
+    health.record_success("Provider", "gpt-4", 1.0)
+    health.record_failure("Provider", "gpt-4", "EmptyResponse")
+    # Scores changed, the circuit did not
+    assert health.circuit_version == 0
+
+    for _ in range(settings.CIRCUIT_FAILURE_THRESHOLD):
+        health.record_failure("Provider", "gpt-4", "EmptyResponse")
+    assert health.circuit_version == 1
+    health.record_failure("Provider", "gpt-4", "EmptyResponse")
+    assert health.circuit_version == 1
+    health.record_success("Provider", "gpt-4", 1.0)
+    assert health.circuit_version == 2
+
+
+def test_nofail_ranking_ignores_score_only_changes(monkeypatch):
+    from backend.health import provider_health
+    from backend.routes import rank_nofail_candidates
+
+    monkeypatch.setattr("backend.routes.time.monotonic", lambda: 1000.0)
+    provider_health.record_success("Blackbox", "gpt-4o", 1.0)
+    ranked = rank_nofail_candidates()
+    provider_health.record_success("Blackbox", "gpt-4o", 2.0)
+    assert rank_nofail_candidates() is ranked
@@ -0,0 +1,67 @@
+from fastapi.testclient import TestClient
+
+from backend.history import HistoryStore, RingBuffer, percentiles, provider_history
+
+
+def test_ring_buffer_keeps_the_last_events():
+    buffer = RingBuffer(4)
+    for t in range(10):
+        buffer.append(float(t), 0.0, 0.0, 0)
+
+    assert buffer.size == 4
+    assert [buffer.timestamps[i] for i in buffer.since(0)] == [9, 8, 7, 6]
+    assert [buffer.timestamps[i] for i in buffer.since(8)] == [9, 8]
+
+
+def test_percentiles():
+    assert percentiles([]) is None
+    assert percentiles([3.0]) == {"p50": 3.0, "p95": 3.0, "p99": 3.0}
+    values = [float(v) for v in range(100, 0, -1)]
+    assert percentiles(values) == {"p50": 50.0, "p95": 95.0, "p99": 99.0}
+
+
+def test_history_stats_over_windows():
+    history = HistoryStore(provider_capacity=8, model_capacity=4, max_series=2)
+    for t in range(6):
+        history.record("A", "m", "success", latency=t + 1, ttfb=0.5, timestamp=t)
+    history.record("A", "m", "timeout", latency=10, timestamp=6)
+    history.record("A", None, "probe_pass", latency=1, timestamp=7)
+
+    recent = history.stats("A", None, window=3, now=7)
+    assert recent["calls"] == 3
+    assert recent["success_rate"] == 2 / 3
+    assert recent["latency"]["p99"] == 6
+    assert recent["outcomes"]["timeout"] == 1
+    assert recent["probe_pass_rate"] == 1
+
+    # The model series only holds the last 4 calls
+    assert history.stats("A", "m", window=100, now=7)["calls"] == 4
+    assert history.stats("B", None, window=100, now=7)["calls"] == 0
+
+    history.record("A", "n", "success", latency=1)
+    history.record("B", "m", "success", latency=1)
+    assert list(history.models) == [("A", "n"), ("B", "m")]
+
+
+def test_provider_stats_endpoint(client: TestClient):
+    response = client.post(
+        "/api/completions",
+        params={"provider": "Blackbox"},
+        json={"messages": [{"role": "user", "content": "Hello"}]},
+    )
+    assert response.status_code == 200
+
+    response = client.get(
+        "/api/providers/Blackbox/stats", params={"window": [60, 3600]}
+    )
+    assert response.status_code == 200
+    stats = response.json()
+    assert [w["window"] for w in stats["windows"]] == [60, 3600]
+    assert stats["windows"][0]["calls"] >= 1
+    assert stats["windows"][0]["latency"]["p50"] >= 0
+    assert "Blackbox" in provider_history.providers
+
+    response = client.get("/api/providers/Blackbox/stats", params={"window": 0})
+    assert response.status_code == 422
+    response = client.get("/api/providers/xkdjak3jal/stats")
+    assert response.status_code == 404
@@ -0,0 +1,39 @@
+from fastapi.testclient import TestClient
+
+from backend.metrics import Registry
+
+
+def test_metrics_rendering():
+    registry = Registry()
+    requests = registry.counter("requests_total", "Requests.", ("provider",))
+    latency = registry.histogram("latency_seconds", "Latency.", buckets=(1.0, 5.0))
+
+    requests.inc('Quo"te')
+    requests.inc('Quo"te')
+    latency.observe(0.5)
+    latency.observe(1.0)
+    latency.observe(7.0)
+
+    lines = registry.render().splitlines()
+    assert "# TYPE requests_total counter" in lines
+    assert 'requests_total{provider="Quo\\"te"} 2' in lines
+    assert 'latency_seconds_bucket{le="1.0"} 2' in lines
+    assert 'latency_seconds_bucket{le="5.0"} 2' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in lines
+    assert "latency_seconds_sum 8.5" in lines
+    assert "latency_seconds_count 3" in lines
+
+
+def test_metrics_endpoint(client: TestClient):
+    response = client.post(
+        "/api/completions", json={"messages": [{"role": "user", "content": "Hello"}]}
+    )
+    assert response.status_code == 200
+    provider = response.json()["provider"]
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert f'provider="{provider}"' in response.text
+    assert 'g4f_completion_attempts_count{mode="sequential"}' in response.text
+    assert 'g4f_completions_in_flight{route="api"} 0' in response.text
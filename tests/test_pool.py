@@ -0,0 +1,53 @@
+import asyncio
+
+import aiohttp
+
+from backend.pool import ClientPool, accepts_connector
+
+
+def test_clients_are_reused(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("backend.pool.time.monotonic", lambda: now[0])
+    pool = ClientPool(max_clients=2, idle_timeout=60)
+
+    client = pool.client("A")
+    assert pool.client("A") is client
+    pool.client("B")
+    now[0] = 30
+    pool.client("A")
+    now[0] = 50
+    pool.client("C")
+    # The least recently used client makes room
+    assert list(pool.clients) == ["A", "C"]
+
+    now[0] = 100
+    pool.evict_idle()
+    assert list(pool.clients) == ["C"]
+
+
+def test_connector_outlives_sessions():
+    async def main():
+        pool = ClientPool(max_clients=2, idle_timeout=60)
+        connector = pool.connector()
+        async with aiohttp.ClientSession(connector=connector):
+            pass
+        assert not connector.closed
+        assert pool.connector() is connector
+
+        await pool.close()
+        assert connector.closed
+
+    asyncio.run(main())
+
+
+def test_accepts_connector():
+    class WithConnector:
+        @classmethod
+        async def create_async_generator(cls, model, messages, connector=None): ...
+
+    class WithoutConnector:
+        @classmethod
+        async def create_async_generator(cls, model, messages, proxy=None): ...
+
+    assert accepts_connector(WithConnector)
+    assert not accepts_connector(WithoutConnector)
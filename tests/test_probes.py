@@ -0,0 +1,53 @@
+from backend.background import ProbeScheduler
+from backend.dependencies import get_base_working_providers_map
+from backend.settings import settings
+from backend.snapshot import load_snapshot, save_snapshot
+
+
+def test_probe_scheduler_intervals(monkeypatch):
+    monkeypatch.setattr(settings, "PROBE_JITTER", 0)
+    monkeypatch.setattr(settings, "PROBE_MIN_INTERVAL", 10)
+    monkeypatch.setattr(settings, "PROBE_MAX_INTERVAL", 35)
+    monkeypatch.setattr(settings, "PROBE_FAILED_MAX_INTERVAL", 15)
+    name = next(iter(get_base_working_providers_map()))
+    scheduler = ProbeScheduler(working_provider_names={name})
+
+    assert name in scheduler.due(now=0)
+    assert not scheduler.record(name, True, now=0)
+    assert name not in scheduler.due(now=5)
+    assert name in scheduler.due(now=10)
+
+    # Stable results back off up to the maximum interval
+    scheduler.record(name, True, now=10)
+    assert scheduler.schedules[name].interval == 20
+    scheduler.record(name, True, now=30)
+    assert scheduler.schedules[name].interval == 35
+
+    # A changed result is checked again soon
+    assert scheduler.record(name, False, now=65)
+    assert scheduler.schedules[name].interval == 10
+    assert name not in scheduler.working_provider_names
+
+    # A provider that stays down keeps being probed often
+    for now in [75, 90, 105]:
+        scheduler.record(name, False, now=now)
+        assert scheduler.schedules[name].interval == 15
+
+
+def test_probe_snapshot_round_trip(tmp_path, monkeypatch):
+    path = str(tmp_path / "snapshot.json")
+    names = list(get_base_working_providers_map())
+    scheduler = ProbeScheduler(working_provider_names=set(names))
+    scheduler.record(names[0], False, now=0)
+    save_snapshot(path, scheduler.dump())
+
+    restored = ProbeScheduler()
+    restored.restore(load_snapshot(path, max_age=60))
+    assert restored.working_provider_names == set(names[1:])
+    assert restored.schedules[names[0]].last_result is False
+
+    # Stale and foreign snapshots fall back to probing from scratch
+    assert load_snapshot(path, max_age=-1) is None
+    assert load_snapshot(str(tmp_path / "missing.json"), max_age=60) is None
+    monkeypatch.setattr("backend.snapshot.g4f_version", lambda: "0.0.0")
+    assert load_snapshot(path, max_age=60) is None
@@ -0,0 +1,171 @@
+import asyncio
+import json
+from unittest.mock import Mock
+
+import pytest
+from fastapi.testclient import TestClient
+from g4f.client.stubs import ChatCompletion, ChatCompletionChunk
+
+from backend import app, ratelimit
+from backend.dependencies import chat_completion
+from backend.ratelimit import AdmissionController, AdmissionRejected, RateLimiter
+
+
+def test_rate_limiter_buckets():
+    limiter = RateLimiter(rate=1.0, burst=2, max_clients=2)
+    assert limiter.check("a", now=0) == 0
+    assert limiter.check("a", now=0) == 0
+    assert limiter.check("a", now=0) == pytest.approx(1.0)
+    assert limiter.check("a", now=1) == 0
+    # Nothing is taken when the bucket holds fewer tokens than the cost
+    assert limiter.check("a", now=3, cost=3) == pytest.approx(1.0)
+    assert limiter.check("a", now=3, cost=2) == 0
+
+    # Least recently seen clients are forgotten beyond max_clients
+    limiter.check("b", now=1)
+    limiter.check("c", now=1)
+    assert list(limiter.buckets) == ["b", "c"]
+
+
+def test_admission_queue():
+    async def main():
+        admission = AdmissionController(
+            max_in_flight=1, max_queue=1, queue_timeout=0.05
+        )
+        await admission.acquire()
+
+        with pytest.raises(AdmissionRejected) as timed_out:
+            await admission.acquire()
+        assert timed_out.value.reason == "queue_timeout"
+
+        waiter = asyncio.ensure_future(admission.acquire())
+        await asyncio.sleep(0)
+        assert admission.waiting == 1
+        with pytest.raises(AdmissionRejected) as full:
+            await admission.acquire()
+        assert full.value.reason == "queue_full"
+
+        admission.release()
+        await waiter
+        assert admission.in_flight == 1 and admission.waiting == 0
+
+    asyncio.run(main())
+
+
+def test_rate_limited_completions(client: TestClient, monkeypatch):
+    monkeypatch.setattr(ratelimit.settings, "RATE_LIMIT_PER_MINUTE", 60.0)
+    monkeypatch.setattr(
+        ratelimit, "rate_limiter", RateLimiter(rate=1 / 60, burst=1, max_clients=10)
+    )
+    request = {"json": {"messages": [{"role": "user", "content": "Hello"}]}}
+
+    response = client.post("/api/completions", headers={"X-API-Key": "a"}, **request)
+    assert response.status_code == 200
+    response = client.post("/api/completions", headers={"X-API-Key": "a"}, **request)
+    assert response.status_code == 429
+    assert 55 <= int(response.headers["Retry-After"]) <= 60
+
+    response = client.post("/api/completions", headers={"X-API-Key": "b"}, **request)
+    assert response.status_code == 200
+
+
+def test_rate_limited_batches(client: TestClient, monkeypatch):
+    monkeypatch.setattr(ratelimit.settings, "RATE_LIMIT_PER_MINUTE", 60.0)
+    monkeypatch.setattr(ratelimit.settings, "RATE_LIMIT_BURST", 3.0)
+    monkeypatch.setattr(
+        ratelimit, "rate_limiter", RateLimiter(rate=1 / 60, burst=3, max_clients=10)
+    )
+    item = {"messages": [{"role": "user", "content": "Hello"}]}
+    headers = {"X-API-Key": "a"}
+
+    # Never affordable, whatever the client waits
+    response = client.post("/api/completions/batch", headers=headers, json=[item] * 4)
+    assert response.status_code == 422
+
+    response = client.post("/api/completions/batch", headers=headers, json=[item] * 2)
+    assert response.status_code == 200
+    # One token left for two items
+    response = client.post("/api/completions/batch", headers=headers, json=[item] * 2)
+    assert response.status_code == 429
+    assert 55 <= int(response.headers["Retry-After"]) <= 60
+
+
+def test_batch_items_hold_admission(monkeypatch):
+    controller = AdmissionController(max_in_flight=2, max_queue=8, queue_timeout=5)
+    monkeypatch.setattr(ratelimit, "admission_controller", controller)
+    in_flight = []
+
+    async def complete(**kwargs):
+        in_flight.append(controller.in_flight)
+        await asyncio.sleep(0.05)
+        return ChatCompletion.model_construct("Hello", "stop")
+
+    chat = Mock()
+    chat.create = Mock(side_effect=complete)
+    app.dependency_overrides[chat_completion] = lambda: chat
+
+    items = [{"messages": [{"role": "user", "content": f"Hi {i}"}]} for i in range(6)]
+    with TestClient(app) as client:
+        response = client.post(
+            "/api/completions/batch", params={"concurrency": 6}, json=items
+        )
+    assert response.status_code == 200
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert all("completion" in result for result in results)
+    # The batch runs no more items at once than the in flight cap lets through
+    assert len(in_flight) == 6 and max(in_flight) == 2
+    assert controller.in_flight == 0
+
+
+@pytest.mark.parametrize(
+    "path, params, body",
+    [
+        (
+            "/api/completions",
+            {"stream": True},
+            {"messages": [{"role": "user", "content": "Hi"}]},
+        ),
+        (
+            "/api/completions/batch",
+            {},
+            [{"messages": [{"role": "user", "content": "Hi"}]}],
+        ),
+        (
+            "/v1/chat/completions",
+            {},
+            {
+                "model": "",
+                "stream": True,
+                "messages": [{"role": "user", "content": "Hi"}],
+            },
+        ),
+    ],
+)
+def test_streamed_body_holds_admission(monkeypatch, path, params, body):
+    controller = AdmissionController(max_in_flight=1, max_queue=0, queue_timeout=1)
+    monkeypatch.setattr(ratelimit, "admission_controller", controller)
+    in_flight = []
+
+    async def stream_chunks():
+        for content in ["Hel", "lo"]:
+            in_flight.append(controller.in_flight)
+            yield ChatCompletionChunk.model_construct(content, None)
+
+    async def complete():
+        in_flight.append(controller.in_flight)
+        return ChatCompletion.model_construct("Hello", "stop")
+
+    chat = Mock()
+    chat.create = Mock(
+        side_effect=lambda stream=False, **kwargs: (
+            stream_chunks() if stream else complete()
+        )
+    )
+    app.dependency_overrides[chat_completion] = lambda: chat
+
+    with TestClient(app) as client:
+        response = client.post(path, params=params, json=body)
+    assert response.status_code == 200
+    # Still admitted while the body streams, released once it is sent
+    assert in_flight and set(in_flight) == {1}
+    assert controller.in_flight == 0
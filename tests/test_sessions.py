@@ -0,0 +1,93 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.sessions import SessionStore
+
+
+def test_session_store_limits(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("backend.sessions.time.time", lambda: now[0])
+    store = SessionStore(max_sessions=2, ttl=60, max_messages=2)
+
+    first = store.create([{"role": "user", "content": str(i)} for i in range(3)])
+    assert [msg["content"] for msg in first.messages] == ["1", "2"]
+
+    second = store.create()
+    store.get(first.id)
+    store.create()
+    # The least recently used session is evicted
+    assert store.get(second.id) is None
+    assert store.get(first.id) is first
+
+    now[0] += 61
+    assert store.get(first.id) is None
+
+
+def test_session_store_persistence(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    store = SessionStore(max_sessions=10, ttl=60, max_messages=10, path=path)
+    other = SessionStore(max_sessions=10, ttl=60, max_messages=10, path=path)
+
+    session = store.create([{"role": "user", "content": "Hello"}])
+    assert other.get(session.id).messages == session.messages
+
+    store.save(session, session.messages + [{"role": "assistant", "content": "Hi"}])
+    assert other.get(session.id).messages == session.messages
+
+    assert other.delete(session.id)
+    assert store.get(session.id) is None
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path, monkeypatch) -> SessionStore:
+    path = str(tmp_path / "sessions.db") if request.param == "sqlite" else None
+    store = SessionStore(max_sessions=10, ttl=60, max_messages=10, path=path)
+    monkeypatch.setattr("backend.routes.session_store", store)
+    return store
+
+
+def test_session_completions(client: TestClient, store: SessionStore):
+    response = client.post(
+        "/api/sessions", json={"messages": [{"role": "user", "content": "Hi"}]}
+    )
+    assert response.status_code == 201
+    session_id = response.json()["session_id"]
+
+    response = client.post(
+        f"/api/sessions/{session_id}/completions", json={"content": "Hello"}
+    )
+    assert response.status_code == 200
+    assert response.json()["session_id"] == session_id
+
+    messages = client.get(f"/api/sessions/{session_id}").json()["messages"]
+    assert [msg["role"] for msg in messages] == ["user", "user", "assistant"]
+
+    assert client.delete(f"/api/sessions/{session_id}").status_code == 204
+    assert client.get(f"/api/sessions/{session_id}").status_code == 404
+    response = client.post(
+        f"/api/sessions/{session_id}/completions", json={"content": "Hello"}
+    )
+    assert response.status_code == 404
+
+
+def test_ui_session(client: TestClient, store: SessionStore):
+    response = client.post("/app/completions", json={"message": "Hello"})
+    session_id = response.headers["X-Session-Id"]
+
+    response = client.post(
+        "/app/completions", json={"message": "Again", "session_id": session_id}
+    )
+    assert response.headers["X-Session-Id"] == session_id
+    messages = client.get(f"/api/sessions/{session_id}").json()["messages"]
+    assert [msg["content"] for msg in messages] == [
+        "Hello",
+        "response",
+        "Again",
+        "response",
+    ]
+
+    response = client.post(
+        "/app/completions/stream", json={"message": "Stream", "session_id": session_id}
+    )
+    assert response.headers["X-Session-Id"] == session_id
+    assert len(store.sessions[session_id].messages) == 5
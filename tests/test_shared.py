@@ -0,0 +1,64 @@
+import time
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+
+from backend import app
+from backend.health import CircuitState, HealthRegistry
+from backend.settings import settings
+from backend.shared import LeaderLock, SharedState
+
+
+def test_single_leader(tmp_path: Path):
+    path = str(tmp_path / "leader.lock")
+    first, second = LeaderLock(path), LeaderLock(path)
+    assert first.try_acquire()
+    assert first.try_acquire()
+    assert not second.try_acquire()
+
+    first.release()
+    assert second.try_acquire()
+    second.release()
+
+
+def test_probes_shared_once_per_version(tmp_path: Path):
+    path = str(tmp_path / "shared.db")
+    leader, follower = SharedState(path, worker=1), SharedState(path, worker=2)
+    assert follower.read_probes() is None
+
+    leader.publish_probes({"working_providers": ["Blackbox"]})
+    assert follower.read_probes() == {"working_providers": ["Blackbox"]}
+    assert follower.read_probes() is None
+
+    leader.publish_probes({"working_providers": []})
+    assert follower.read_probes() == {"working_providers": []}
+
+
+def test_health_shared_between_workers(tmp_path: Path):
+    path = str(tmp_path / "shared.db")
+    first, second = SharedState(path, worker=1), SharedState(path, worker=2)
+    first_health, second_health = HealthRegistry(), HealthRegistry()
+
+    for _ in range(settings.CIRCUIT_FAILURE_THRESHOLD):
+        first_health.record_failure("Blackbox", "gpt-4", "EmptyResponse")
+    first.publish_health(first_health.take_changes())
+    assert first_health.take_changes() == {}
+    assert first.read_health() == {}
+
+    for provider, data in second.read_health().items():
+        second_health.apply(provider, data)
+    assert second_health.get("Blackbox").state == CircuitState.OPEN
+    assert not second_health.is_available("Blackbox")
+    assert second.read_health() == {}
+
+
+def test_workers_sync_on_the_event_loop(tmp_path: Path, monkeypatch):
+    state = SharedState(str(tmp_path / "shared.db"))
+    monkeypatch.setattr("backend.background.shared_state", state)
+    with TestClient(app) as client:
+        started = time.monotonic()
+        while state._connection is None and time.monotonic() - started < 5:
+            time.sleep(0.01)
+        assert state._connection is not None
+        # Opened by the sync task, the connection must be usable from the loop
+        client.portal.call(state.close)
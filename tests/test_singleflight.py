@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from backend.singleflight import SingleFlight
+
+
+def test_single_flight_shares_result():
+    calls = []
+
+    async def upstream() -> str:
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "response"
+
+    async def main() -> list[str]:
+        flights = SingleFlight(max_waiters=10)
+        return await asyncio.gather(*[flights.do("key", upstream) for _ in range(5)])
+
+    assert asyncio.run(main()) == ["response"] * 5
+    assert len(calls) == 1
+
+
+def test_single_flight_bounded_waiters_and_errors():
+    calls = []
+
+    async def upstream() -> str:
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("Provider is down")
+
+    async def main() -> list:
+        flights = SingleFlight(max_waiters=2)
+        results = await asyncio.gather(
+            *[flights.do("key", upstream) for _ in range(3)], return_exceptions=True
+        )
+        assert not flights.flights
+        return results
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert len(calls) == 2
+
+
+def test_single_flight_cancelled_when_nobody_waits():
+    async def main() -> None:
+        flights = SingleFlight(max_waiters=10)
+        started = asyncio.Event()
+
+        async def upstream() -> str:
+            started.set()
+            await asyncio.sleep(10)
+            return "response"
+
+        waiter = asyncio.create_task(flights.do("key", upstream))
+        await started.wait()
+        flight = flights.flights["key"]
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await asyncio.sleep(0)
+        assert flight.task.cancelled()
+
+    asyncio.run(main())